@@ -34,7 +34,7 @@ apt-get update -qq
 echo -e "${YELLOW}[2/10] Installing system dependencies...${NC}"
 apt-get install -y git curl wget software-properties-common \
     lsb-release ca-certificates apt-transport-https \
-    ethtool dmidecode lshw pciutils > /dev/null 2>&1
+    ethtool dmidecode lshw pciutils dropbear-bin > /dev/null 2>&1
 
 echo -e "${YELLOW}[3/10] Checking Python 3.10+...${NC}"
 PYTHON_VERSION=$(python3 --version 2>&1 | awk '{print $2}' | cut -d. -f1,2 || echo "0.0")
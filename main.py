@@ -1,40 +1,95 @@
+import atexit
+import json
+import multiprocessing
 import os
-import subprocess
+import shutil
+import signal
 import sys
 import time
-from multiprocessing import Process, Pipe
-from threading import Thread
-import subprocess
-import psutil
-
-from src import runtime
-from src.security.auth_daemon import auth_daemon
-from src.service.fingerprint import get_fingerprint
-from src.service.instances import emergency_self_destruct
-from src.client.qudata import QudataClient
-from src.client.models import Stats, InitAgent
-from src.storage.state import get_current_state
-from src.utils.enums import InstanceStatus
-
-
-def run_agent_process(pipe_conn):
+from threading import Event
+
+from src.utils import startup
+
+if "--profile-startup" in sys.argv:
+    os.environ[startup.PROFILE_ENV] = "1"
+startup.install()
+
+# The launcher and the guardian only need these; the agent imports its
+# heavy dependencies (httpx, keyring, psutil) itself, see run_agent_process.
+from src import consts, runtime  # noqa: E402
+from src.server.handoff import (  # noqa: E402
+    create_listener,
+    expected_ready,
+    run_server,
+    wait_ready,
+)
+from src.service.guardian import (  # noqa: E402
+    AGENT_FAILED,
+    AGENT_RUNNING,
+    AGENT_STOPPED,
+    HEARTBEAT_ENV,
+    Heartbeat,
+    start_agent_heartbeat,
+    watch,
+)
+from src.security.credentials import install_agent_credential  # noqa: E402
+from src.service.live_metrics import LIVE_METRICS_ENV, LiveMetrics  # noqa: E402
+
+
+# The heartbeat segment, its eventfd and the listening socket are
+# inherited, not pickled.
+Process = multiprocessing.get_context("fork").Process
+
+
+def run_agent_process(heartbeat: Heartbeat, listen_fd: int, ready_fd: int):
+    with startup.phase("agent imports"):
+        import psutil
+
+        from src.client.models import InitAgent, InstanceStatus, Stats
+        from src.client.qudata import QudataClient
+        from src.security.auth_daemon import auth_daemon, wait_auth_daemon
+        from src.service.fingerprint import get_fingerprint
+        from src.service.health import start_deep_checks
+        from src.service.instances import emergency_self_destruct
+        from src.service.live_metrics import live_metrics, start_sampler
+        from src.service.port_proxy import start_port_proxies
+        from src.service.recovery import recover
+        from src.service.warm_pool import start_refill
+        from src.storage.state import get_current_state
+        from src.utils.scheduler import Scheduler
+        from src.utils.xlogging import get_logger
+
+    # Per-tick lines go through the logger, whose rate limit keeps them in check.
+    logger = get_logger("agent")
+
+    def guardian_lost():
+        print(
+            "CRITICAL: Guardian process disconnected! Initiating self-destruct.",
+            file=sys.stderr)
+        emergency_self_destruct()
+        os._exit(1)
+
+    scheduler = Scheduler().start()
+    start_agent_heartbeat(heartbeat, guardian_lost, scheduler)
     try:
-        client = QudataClient()
-        agent_secret = client._client.headers.get("X-Agent-Secret")
+        with startup.phase("agent client"):
+            client = QudataClient()
+            agent_secret = client._client.headers.get("X-Agent-Secret")
 
         if not agent_secret:
             print(
                 "INFO: No agent secret found. Performing initial registration (init)...")
             try:
-                init_data = InitAgent(
-                    agent_id="placeholder-id", #заглушка
-                    agent_port=8000,
-                    address=runtime.agent_address(),
-                    fingerprint=get_fingerprint(),
-                    pid=runtime.agent_pid()
-                )
+                with startup.phase("agent init"):
+                    init_data = InitAgent(
+                        agent_id="placeholder-id", #заглушка
+                        agent_port=runtime.agent_port(),
+                        address=runtime.agent_address(),
+                        fingerprint=get_fingerprint(),
+                        pid=runtime.agent_pid()
+                    )
 
-                agent_response = client.init(init_data)
+                    agent_response = client.init(init_data)
                 print(
                     f"INFO: Agent initialization successful. Secret received: {agent_response.secret_key is not None}")
             except Exception as e:
@@ -44,166 +99,226 @@ def run_agent_process(pipe_conn):
         else:
             print("INFO: Agent secret found. Skipping initialization.")
 
-        auth_daemon_thread = Thread(target=auth_daemon, daemon=True)
-        auth_daemon_thread.start()
-
-        def heartbeat_to_guardian_thread():
-            while True:
-                try:
-                    pipe_conn.send("AGENT_PULSE")
-                    time.sleep(1)
-                except (IOError, EOFError):
-                    print(
-                        "CRITICAL: Guardian process disconnected! Initiating self-destruct.",
-                        file=sys.stderr)
-                    emergency_self_destruct()
-                    exit(1)
-
-        hb_thread = Thread(target=heartbeat_to_guardian_thread, daemon=True)
-        hb_thread.start()
-
-        def stats_heartbeat_thread():
-            time.sleep(5)
-            client = QudataClient()
-            while True:
-                try:
-                    state = get_current_state()
-                    if state.status == "destroyed":
-                        print("INFO: No active instance. Stats heartbeat is idle.")
-                        time.sleep(15)
-                        continue
-
-                    try:
-                        container_status_enum = InstanceStatus(state.status)
-                    except ValueError:
-                        container_status_enum = InstanceStatus.error
-
-                    stats_data = Stats(
-                        cpu_util=psutil.cpu_percent(),
-                        ram_util=psutil.virtual_memory().percent,
-                        instance_status=container_status_enum,
-                    )
-                    # небольшое пояснение, сбор других данных чуть позже добавлю
-                    print(
-                        f"INFO: Sending stats heartbeat. Current instance status: {stats_data.instance_status.value}")
-                    client.send_stats(stats_data)
+        # Before recovery: with dockerd's AuthZ plugin pointing at it, every
+        # Docker call waits for the daemon, and after a crash it is gone.
+        with startup.phase("auth daemon"):
+            auth_daemon_process = Process(target=auth_daemon, daemon=True)
+            auth_daemon_process.start()
+            if not wait_auth_daemon(timeout=consts.RECOVERY_TIMEOUT):
+                print("WARNING: Auth daemon is not accepting connections yet.",
+                      file=sys.stderr)
 
-                except Exception as e:
-                    print(f"ERROR: Failed to send stats heartbeat: {e}",
-                          file=sys.stderr)
+        # Before the server starts: ready means the instance record, its port
+        # leases and the SSH watcher match what Docker actually runs.
+        with startup.phase("recovery"):
+            recovery = recover()
+        print(f"INFO: Recovery: {json.dumps(recovery)}")
+        start_port_proxies(scheduler)
 
-                # Ждем 15 секунд
-                time.sleep(15)
+        heartbeat.set_agent_state(AGENT_RUNNING)
 
-        stats_thread = Thread(target=stats_heartbeat_thread, daemon=True)
-        stats_thread.start()
+        def send_stats():
+            state = get_current_state()
+            if state.status == "destroyed":
+                logger.info("No active instance. Stats heartbeat is idle.")
+                return
+
+            try:
+                container_status_enum = InstanceStatus(state.status)
+            except ValueError:
+                container_status_enum = InstanceStatus.error
+
+            # The sampler owns psutil.cpu_percent(): a second caller would
+            # reset its interval.
+            live = live_metrics()
+            system = live["system"] if live else {
+                "cpu_util": psutil.cpu_percent(),
+                "ram_util": psutil.virtual_memory().percent,
+            }
+            stats_data = Stats(
+                cpu_util=system["cpu_util"],
+                ram_util=system["ram_util"],
+                instance_status=container_status_enum,
+            )
+            # небольшое пояснение, сбор других данных чуть позже добавлю
+            logger.info(
+                f"Sending stats heartbeat. Current instance status: {stats_data.instance_status.value}")
+            client.send_stats(stats_data)
+
+        # A send that is still retrying when the next tick comes skips it
+        # instead of stacking up.
+        scheduler.add(
+            "stats-heartbeat",
+            send_stats,
+            consts.STATS_INTERVAL,
+            jitter=consts.STATS_JITTER,
+            deadline=consts.STATS_INTERVAL,
+            delay=5,
+        )
+        start_sampler(scheduler)
+        start_deep_checks(scheduler)
+        start_refill(scheduler)
+        scheduler.add(
+            "scheduler-report",
+            lambda: logger.info(f"Scheduler: {json.dumps(scheduler.snapshot())}"),
+            consts.SCHEDULER_REPORT_INTERVAL,
+            delay=consts.SCHEDULER_REPORT_INTERVAL,
+        )
 
         print(
-            "INFO: All agent threads (Auth, Guardian Heartbeat, Stats Heartbeat) are running.")
-        print("INFO: Starting Gunicorn server...")
-
-        gunicorn_command = [
-            sys.executable,
-            "-m",
-            "gunicorn",
-            "-w",
-            "3",
-            "-b",
-            "0.0.0.0:8000",
-            "--chdir",
-            ".",
-            "src.server.server:app",
-        ]
-
-        process = subprocess.run(gunicorn_command)
+            "INFO: Auth daemon process and scheduled jobs (Guardian Heartbeat, Stats Heartbeat) are running.")
+        print(f"INFO: Starting API server in '{runtime.server_mode()}' mode...")
+        startup.report("agent")
+
+        returncode = run_server(listen_fd, ready_fd)
         print(
-            f"INFO: Gunicorn process terminated with code {process.returncode}.",
+            f"INFO: API server process terminated with code {returncode}.",
             file=sys.stderr,
         )
 
+        heartbeat.set_agent_state(AGENT_STOPPED)
     except KeyboardInterrupt:
-        pass
+        heartbeat.set_agent_state(AGENT_STOPPED)
     except Exception as e:
         print(f"FATAL ERROR IN AGENT PROCESS: {e}", file=sys.stderr)
-        try:
-            pipe_conn.send(f"AGENT_DIED:{e}")
-        except:
-            pass
+        heartbeat.set_agent_state(AGENT_FAILED)
 
 
-def run_guardian_process(pipe_conn, parent_pid):
-    print("INFO: Guardian process started.")
-    last_pulse_time = time.time()
+def run_guardian_process(heartbeat: Heartbeat, parent_pid):
+    # Imported up front: on failure there is no time to load it.
+    from src.service.instances import emergency_self_destruct
 
-    def check_parent():
-        try:
-            os.kill(parent_pid, 0)
-            return True
-        except OSError:
-            return False
+    print("INFO: Guardian process started.")
 
-    while True:
-        try:
-            if pipe_conn.poll(5):
-                signal = pipe_conn.recv()
-                if signal == "AGENT_PULSE":
-                    last_pulse_time = time.time()
-                elif isinstance(signal, str) and signal.startswith(
-                        "AGENT_DIED"):
-                    print(
-                        f"CRITICAL: Guardian received fatal error from main agent: {signal}",
-                        file=sys.stderr)
-                    break
-            else:
-                if time.time() - last_pulse_time > 5:
-                    print(
-                        "CRITICAL: Main agent process is unresponsive! Initiating self-destruct.",
-                        file=sys.stderr)
-                    emergency_self_destruct()
-                    break
-
-            if not check_parent():
-                print(
-                    "INFO: Main launcher process is gone. Guardian is shutting down.",
-                    file=sys.stderr)
-                break
+    def on_failure(reason):
+        print(
+            f"CRITICAL: Guardian detected: {reason}! Initiating self-destruct.",
+            file=sys.stderr)
+        emergency_self_destruct()
 
-            time.sleep(1)
+    try:
+        reason = watch(
+            heartbeat,
+            parent_pid,
+            on_failure,
+            deadline=runtime.guardian_deadline(),
+            hang_timeout=runtime.guardian_hang_timeout(),
+        )
+    except KeyboardInterrupt:
+        return
+    if reason == "agent failed":
+        print(
+            "CRITICAL: Guardian received fatal error from main agent.",
+            file=sys.stderr)
+    elif reason == "launcher exited":
+        print(
+            "INFO: Main launcher process is gone. Guardian is shutting down.",
+            file=sys.stderr)
+
+
+def start_agent(heartbeat: Heartbeat, listen_fd: int):
+    ready_r, ready_w = os.pipe()
+    agent = Process(target=run_agent_process, args=(heartbeat, listen_fd, ready_w))
+    agent.start()
+    os.close(ready_w)
+    print(f"INFO: Launcher started main agent with PID: {agent.pid}")
+    return agent, ready_r
+
+
+def upgrade_agent(heartbeat: Heartbeat, listen_fd: int, current):
+    """Starts a new generation and drains the current one once it is ready."""
+    agent, ready_fd = start_agent(heartbeat, listen_fd)
+    ready = wait_ready(
+        ready_fd,
+        expected_ready(runtime.server_mode()),
+        consts.HANDOFF_READY_TIMEOUT,
+    )
+    if not ready or not agent.is_alive():
+        print(
+            "ERROR: New agent did not become ready. Keeping the current one.",
+            file=sys.stderr)
+        agent.terminate()
+        agent.join()
+        return current
 
-        except (IOError, EOFError):
-            print(
-                "CRITICAL: Communication pipe broke. Main agent is dead. Initiating self-destruct.",
-                file=sys.stderr)
-            emergency_self_destruct()
-            break
+    print(f"INFO: Agent {agent.pid} is ready ({ready} workers). "
+          f"Draining agent {current.pid}...")
+    heartbeat.register_agent(agent.pid)
+    current.terminate()
+    current.join()
+    return agent
 
 
 def main_launcher():
-    agent_pipe, guardian_pipe = Pipe()
-
-    guardian = Process(target=run_guardian_process,
-                       args=(guardian_pipe, os.getpid()))
-    guardian.daemon = True
-    guardian.start()
+    # Owned here for the launcher's whole life: restarts and upgrades never
+    # close the port, so clients queue in the backlog instead of being refused.
+    listener = create_listener(runtime.agent_port())
+    listen_fd = listener.fileno()
+
+    heartbeat = Heartbeat.create()
+    atexit.register(heartbeat.unlink)
+    # API server processes read guardian metrics from the segment.
+    os.environ[HEARTBEAT_ENV] = heartbeat.path
+    # Written by the agent's sampler, read by every API worker.
+    live = LiveMetrics.create()
+    atexit.register(live.unlink)
+    os.environ[LIVE_METRICS_ENV] = live.path
+    # Every process of this launch sends the token with its Docker calls;
+    # the auth daemon trusts only requests that carry it.
+    docker_config = install_agent_credential()
+    atexit.register(shutil.rmtree, docker_config, True)
+
+    with startup.phase("guardian start"):
+        guardian = Process(target=run_guardian_process,
+                           args=(heartbeat, os.getpid()))
+        guardian.daemon = True
+        guardian.start()
+        heartbeat.register_guardian(guardian.pid)
+
+    upgrade = Event()
+    signal.signal(signal.SIGHUP, lambda *_: upgrade.set())
 
     while True:
-        agent = Process(target=run_agent_process, args=(agent_pipe,))
-        agent.start()
-        print(f"INFO: Launcher started main agent with PID: {agent.pid}")
-
-        agent.join()
-
-        if guardian.is_alive():
-            print(
-                "WARNING: Main agent process terminated unexpectedly. Restarting in 3 seconds...",
-                file=sys.stderr)
-            time.sleep(3)
+        agent, ready_fd = start_agent(heartbeat, listen_fd)
+        heartbeat.register_agent(agent.pid)
+        if startup.enabled():
+            with startup.phase("agent start to server ready"):
+                wait_ready(
+                    ready_fd,
+                    expected_ready(runtime.server_mode()),
+                    consts.HANDOFF_READY_TIMEOUT,
+                )
+            startup.report("launcher")
+            os.environ.pop(startup.PROFILE_ENV)
         else:
+            os.close(ready_fd)
+        started = time.monotonic()
+
+        while True:
+            agent.join(0.5)
+            if upgrade.is_set():
+                upgrade.clear()
+                print("INFO: SIGHUP received. Starting a new agent generation...")
+                upgraded = upgrade_agent(heartbeat, listen_fd, agent)
+                if upgraded is not agent:
+                    agent, started = upgraded, time.monotonic()
+            elif not agent.is_alive():
+                break
+
+        if not guardian.is_alive():
             print(
                 "CRITICAL: Guardian process is also dead. Shutting down launcher.",
                 file=sys.stderr)
             break
 
+        uptime = time.monotonic() - started
+        delay = 0 if uptime >= consts.AGENT_MIN_UPTIME else consts.AGENT_CRASH_BACKOFF
+        print(
+            f"WARNING: Main agent process terminated unexpectedly. "
+            f"Restarting in {delay} seconds...",
+            file=sys.stderr)
+        time.sleep(delay)
+
 
 if __name__ == "__main__":
     if "type=agent" in sys.argv:
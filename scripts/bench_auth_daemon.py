@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.security.auth_daemon import auth_daemon  # noqa: E402
+
+PAYLOAD = json.dumps(
+    {"RequestMethod": "GET", "RequestUri": "/v1.43/containers/json"}
+).encode()
+HTTP_REQUEST = (
+    b"POST / HTTP/1.1\r\nHost: auth\r\nContent-Type: application/json\r\n"
+    b"Content-Length: " + str(len(PAYLOAD)).encode() + b"\r\n\r\n" + PAYLOAD
+)
+
+
+async def _read_response(reader: asyncio.StreamReader) -> None:
+    head = await reader.readuntil(b"\r\n\r\n")
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            await reader.readexactly(int(line.split(b":", 1)[1]))
+            return
+
+
+async def keep_alive_client(path: str, requests: int, latencies: list) -> None:
+    reader, writer = await asyncio.open_unix_connection(path)
+    for _ in range(requests):
+        t0 = time.perf_counter_ns()
+        writer.write(HTTP_REQUEST)
+        await _read_response(reader)
+        latencies.append(time.perf_counter_ns() - t0)
+    writer.close()
+
+
+async def legacy_client(path: str, requests: int, latencies: list) -> None:
+    for _ in range(requests):
+        t0 = time.perf_counter_ns()
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(PAYLOAD)
+        await reader.read()
+        writer.close()
+        latencies.append(time.perf_counter_ns() - t0)
+
+
+async def load(path: str, client, connections: int, requests: int) -> None:
+    latencies: list[int] = []
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(client(path, requests, latencies) for _ in range(connections))
+    )
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] / 1000
+    print(
+        f"{client.__name__:<18} conns={connections:<4} "
+        f"{len(latencies) / elapsed:>10,.0f} req/s   p99={p99:.0f}us"
+    )
+
+
+def main() -> None:
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "agent.sock")
+    audit_path = os.path.join(workdir, "audit.log")
+
+    daemon = Process(target=auth_daemon, args=(path, audit_path), daemon=True)
+    daemon.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+
+    try:
+        asyncio.run(load(path, legacy_client, connections, requests))
+        asyncio.run(load(path, keep_alive_client, connections, requests))
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
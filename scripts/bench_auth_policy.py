@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.security.policy import DEFAULT_RULES, PolicyEngine  # noqa: E402
+
+LEGACY_FORBIDDEN = ["/exec", "/attach", "/cp", "/copy", "/commit", "/rename"]
+
+REQUESTS = [
+    ("GET", "/v1.43/containers/json?all=1", None),
+    ("GET", "/v1.43/containers/{cid}/json", None),
+    ("POST", "/v1.43/containers/{cid}/exec", None),
+    ("POST", "/v1.43/exec/{cid}/start", None),
+    ("POST", "/v1.43/containers/{cid}/attach?stream=1", None),
+    ("PUT", "/v1.43/containers/{cid}/archive?path=/tmp", None),
+    ("POST", "/v1.43/containers/{cid}/start", None),
+    ("GET", "/v1.43/images/json", None),
+    ("POST", "/v1.43/containers/create", {"HostConfig": {"Privileged": True}}),
+    ("POST", "/v1.43/containers/create", {"Image": "ubuntu", "HostConfig": {}}),
+]
+
+
+def legacy_check(method, uri, body):
+    uri = uri.lower()
+    for x in LEGACY_FORBIDDEN:
+        if x in uri:
+            return {"allow": False, "reason": f"forbidden: {x}"}
+    return {"allow": True, "reason": "ok"}
+
+
+def make_workload(n: int, containers: int) -> list[tuple[str, str, dict | None]]:
+    rnd = random.Random(42)
+    cids = [f"{rnd.getrandbits(256):064x}" for _ in range(containers)]
+    workload = []
+    for _ in range(n):
+        method, uri, body = rnd.choice(REQUESTS)
+        workload.append((method, uri.replace("{cid}", rnd.choice(cids)), body))
+    return workload
+
+
+def run(name, fn, workload) -> None:
+    latencies = []
+    started = time.perf_counter()
+    for method, uri, body in workload:
+        t0 = time.perf_counter_ns()
+        fn(method, uri, body)
+        latencies.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] / 1000
+    p99 = latencies[int(len(latencies) * 0.99)] / 1000
+    print(
+        f"{name:<16} {len(workload) / elapsed:>12,.0f} decisions/s"
+        f"   p50={p50:.2f}us   p99={p99:.2f}us"
+    )
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    containers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    workload = make_workload(n, containers)
+
+    engine = PolicyEngine(DEFAULT_RULES, trusted=("agent",))
+    uncached = PolicyEngine(DEFAULT_RULES, trusted=("agent",), cache_size=0)
+
+    run("legacy substring", legacy_check, workload)
+    run(
+        "engine uncached",
+        lambda m, u, b: uncached.decide("uid:1000", m, u, b),
+        workload,
+    )
+    run("engine cached", lambda m, u, b: engine.decide("uid:1000", m, u, b), workload)
+    print(engine.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import sys
+import timeit
+from dataclasses import asdict, fields, is_dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.client.models import (  # noqa: E402
+    ConfigurationData,
+    CreateHost,
+    InstanceStatus,
+    Location,
+    Stats,
+    UnitValue,
+)
+from src.server.models import CreateInstance  # noqa: E402
+from src.utils.dto import from_json, to_json  # noqa: E402
+
+
+def legacy_to_json(obj):
+    return asdict(obj)
+
+
+def legacy_from_json(cls, data):
+    kwargs = {}
+    for f in fields(cls):
+        value = data.get(f.name)
+        if value is None:
+            kwargs[f.name] = None
+            continue
+        ftype = f.type
+        origin = getattr(ftype, "__origin__", None)
+        if origin is list:
+            subtype = ftype.__args__[0]
+            kwargs[f.name] = [legacy_from_json(subtype, i) for i in value]
+        elif is_dataclass(ftype):
+            kwargs[f.name] = legacy_from_json(ftype, value)
+        else:
+            kwargs[f.name] = value
+    return cls(**kwargs)
+
+
+SAMPLES = {
+    "CreateInstance": CreateInstance(
+        image="pytorch/pytorch",
+        image_tag="2.3.0-cuda12.1-cudnn8-runtime",
+        storage_gb=100,
+        env_variables={f"VAR_{i}": str(i) for i in range(16)},
+        ports={"22": "auto", "8888": "auto", "6006": "auto"},
+        command="python train.py --epochs 10",
+        ssh_enabled=True,
+    ),
+    "Stats": Stats(
+        gpu_util=87.5,
+        cpu_util=35.0,
+        ram_util=61.2,
+        mem_util=70.1,
+        inet_in=123456,
+        inet_out=654321,
+        instance_status=InstanceStatus.running,
+    ),
+    "CreateHost": CreateHost(
+        gpu_name="NVIDIA A100-SXM4-80GB",
+        gpu_amount=8,
+        vram=80.0,
+        location=Location(city="Frankfurt", country="DE", region="HE"),
+        configuration=ConfigurationData(
+            ram=UnitValue(amount=1024),
+            disk=UnitValue(amount=15360),
+            cpu_name="AMD EPYC 7763",
+            vcpu=256,
+            cpu_cores=64,
+            cpu_freq=2.45,
+            ethernet_in=25.0,
+            ethernet_out=25.0,
+            max_cuda_version=12.4,
+        ),
+    ),
+}
+
+
+def main() -> None:
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    for name, obj in SAMPLES.items():
+        cls = type(obj)
+        payload = to_json(obj)
+        rows = [
+            ("to_json legacy", lambda: legacy_to_json(obj)),
+            ("to_json codec", lambda: to_json(obj)),
+            ("from_json legacy", lambda: legacy_from_json(cls, payload)),
+            ("from_json codec", lambda: from_json(cls, payload)),
+        ]
+        print(name)
+        for label, fn in rows:
+            elapsed = timeit.timeit(fn, number=number)
+            print(f"  {label:<18} {elapsed / number * 1e6:8.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
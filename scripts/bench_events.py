@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.service.events import EventBroker, encode_event  # noqa: E402
+
+
+def make_event(i: int) -> dict:
+    return {
+        "id": time.time_ns(),
+        "type": "sample" if i % 4 else "state",
+        "ts": time.time(),
+        "data": {"cpu_util": 12.5, "ram_util": 40.1, "seq": i},
+    }
+
+
+def per_client_encode(subscribers, events) -> float:
+    started = time.perf_counter()
+    for i in range(events):
+        event = make_event(i)
+        for subscriber in subscribers:
+            if subscriber.accepts(event["type"]):
+                subscriber.offer(encode_event(event))
+        for subscriber in subscribers:
+            subscriber.drain()
+    return time.perf_counter() - started
+
+
+def broker_fanout(broker, subscribers, events) -> float:
+    started = time.perf_counter()
+    for i in range(events):
+        broker.dispatch(make_event(i))
+        for subscriber in subscribers:
+            subscriber.drain()
+    return time.perf_counter() - started
+
+
+def slow_consumer_check(broker: EventBroker) -> None:
+    slow = broker.subscribe(maxlen=8)
+    for i in range(32):
+        broker.dispatch(make_event(i))
+    print(
+        f"slow consumer dropped: {slow.overflowed}, still subscribed: "
+        f"{slow in broker._subscribers}"
+    )
+
+
+def threaded_delivery(broker: EventBroker, n: int, events: int) -> float:
+    subscribers = [broker.subscribe(maxlen=events + 1) for _ in range(n)]
+    received = [0] * n
+
+    def consume(i: int) -> None:
+        while received[i] < events:
+            if subscribers[i].wait(1):
+                received[i] += len(subscribers[i].drain())
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    started = time.perf_counter()
+    for i in range(events):
+        broker.dispatch(make_event(i))
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    for subscriber in subscribers:
+        broker.unsubscribe(subscriber)
+    return elapsed
+
+
+def main() -> None:
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for n in (10, 100, 500):
+        broker = EventBroker()
+        subscribers = [
+            broker.subscribe(types=None if i % 2 else ["state"], maxlen=1024)
+            for i in range(n)
+        ]
+        baseline = per_client_encode(subscribers, events)
+        fanout = broker_fanout(broker, subscribers, events)
+        threaded = threaded_delivery(EventBroker(), n, events // 10)
+        print(
+            f"subscribers={n:<4} per-client encode {baseline / events * 1e6:8.1f} us/event"
+            f"   shared frame {fanout / events * 1e6:8.1f} us/event"
+            f"   threaded consumers {threaded / (events // 10) * 1e6:8.1f} us/event"
+        )
+    slow_consumer_check(EventBroker())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Time for the guardian to notice a frozen (SIGSTOP) or killed agent.
+
+Usage: bench_guardian.py [rounds] [deadline] [hang timeout]
+
+A fake agent beats the shared heartbeat; a guardian watches it with the
+given deadline and hang timeout. Each round freezes the agent with SIGSTOP
+and measures the time until the guardian counts a stall and until it
+reports the hang, or kills it with SIGKILL and measures the time until the
+exit is counted. A last case freezes the agent for longer than the
+deadline but shorter than the hang timeout: that must be counted as a
+stall and must not be reported.
+"""
+
+import multiprocessing
+import os
+import random
+import signal
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.service.guardian import Heartbeat, start_agent_heartbeat, watch  # noqa: E402
+from src.utils.scheduler import Scheduler  # noqa: E402
+
+Process = multiprocessing.get_context("fork").Process
+
+# Covers the agent's first beat after the guardian starts watching it.
+RESTART_GRACE = 5.0
+
+
+def agent(heartbeat: Heartbeat) -> None:
+    start_agent_heartbeat(heartbeat, lambda: os._exit(1), Scheduler().start())
+    while True:
+        time.sleep(1)
+
+
+def guardian(
+    heartbeat: Heartbeat, parent: int, deadline: float, hang_timeout: float, report
+) -> None:
+    def on_failure(reason: str) -> None:
+        report.send((time.monotonic_ns(), reason))
+
+    watch(
+        heartbeat,
+        parent,
+        on_failure,
+        deadline=deadline,
+        restart_grace=RESTART_GRACE,
+        hang_timeout=hang_timeout,
+    )
+
+
+def start(heartbeat: Heartbeat, deadline: float, hang_timeout: float, sender):
+    beating = Process(target=agent, args=(heartbeat,))
+    beating.start()
+    heartbeat.register_agent(beating.pid)
+    watcher = Process(
+        target=guardian,
+        args=(heartbeat, os.getpid(), deadline, hang_timeout, sender),
+    )
+    watcher.start()
+    # Past the guardian's boot grace: it has seen beats since it started.
+    beats = heartbeat.beats
+    while heartbeat.beats < beats + 3:
+        time.sleep(0.01)
+    time.sleep(random.uniform(0.3, 0.4))
+    return beating, watcher
+
+
+def stop(*processes) -> None:
+    for process in processes:
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+
+def wait_count(heartbeat: Heartbeat, field: str, timeout: float) -> int:
+    end = time.monotonic() + timeout
+    while not heartbeat.snapshot()[field]:
+        if time.monotonic() > end:
+            raise SystemExit(f"guardian did not count {field}")
+        time.sleep(0.001)
+    return time.monotonic_ns()
+
+
+def frozen(deadline: float, hang_timeout: float) -> tuple[float, float, str]:
+    heartbeat = Heartbeat.create()
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    try:
+        beating, watcher = start(heartbeat, deadline, hang_timeout, sender)
+        sent_at = time.monotonic_ns()
+        os.kill(beating.pid, signal.SIGSTOP)
+        stalled_at = wait_count(heartbeat, "stalls_detected", deadline * 5 + 5)
+        if not receiver.poll(hang_timeout * 5 + 5):
+            raise SystemExit("guardian did not report the hang")
+        detected_at, reason = receiver.recv()
+        stop(beating, watcher)
+        return (stalled_at - sent_at) / 1e6, (detected_at - sent_at) / 1e6, reason
+    finally:
+        heartbeat.unlink()
+
+
+def killed(deadline: float, hang_timeout: float) -> float:
+    heartbeat = Heartbeat.create()
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    try:
+        beating, watcher = start(heartbeat, deadline, hang_timeout, sender)
+        sent_at = time.monotonic_ns()
+        os.kill(beating.pid, signal.SIGKILL)
+        detected_at = wait_count(heartbeat, "exits_detected", 5)
+        beating.join()
+        stop(watcher)
+        return (detected_at - sent_at) / 1e6
+    finally:
+        heartbeat.unlink()
+
+
+def short_pause(deadline: float, hang_timeout: float) -> dict:
+    heartbeat = Heartbeat.create()
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    try:
+        beating, watcher = start(heartbeat, deadline, hang_timeout, sender)
+        os.kill(beating.pid, signal.SIGSTOP)
+        wait_count(heartbeat, "stalls_detected", deadline * 5 + 5)
+        time.sleep((hang_timeout - deadline) / 4)
+        os.kill(beating.pid, signal.SIGCONT)
+        if receiver.poll(hang_timeout * 2):
+            raise SystemExit(f"a short pause was reported: {receiver.recv()[1]}")
+        stop(beating, watcher)
+        return heartbeat.snapshot()
+    finally:
+        heartbeat.unlink()
+
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    deadline = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    hang_timeout = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+    print(
+        f"deadline {deadline * 1000:.0f} ms, "
+        f"hang timeout {hang_timeout * 1000:.0f} ms"
+    )
+
+    results = [frozen(deadline, hang_timeout) for _ in range(rounds)]
+    stalls = sorted(ms for ms, _, _ in results)
+    hangs = sorted(ms for _, ms, _ in results)
+    reasons = ", ".join(sorted({reason for _, _, reason in results}))
+    print(
+        f"SIGSTOP: stall counted after median {statistics.median(stalls):.1f} ms "
+        f"max {stalls[-1]:.1f} ms; reported after median "
+        f"{statistics.median(hangs):.1f} ms max {hangs[-1]:.1f} ms ({reasons})"
+    )
+
+    exits = sorted(killed(deadline, hang_timeout) for _ in range(rounds))
+    print(
+        f"SIGKILL: exit counted after median {statistics.median(exits):.1f} ms "
+        f"max {exits[-1]:.1f} ms"
+    )
+
+    snapshot = short_pause(deadline, hang_timeout)
+    print(
+        f"pause under the hang timeout: {snapshot['stalls_detected']} stall, "
+        f"{snapshot['hangs_detected']} hangs, not reported; "
+        f"max beat gap {snapshot['max_beat_gap_ms']:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Caller-side latency of one INFO call: synchronous handlers vs the queue."""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.chdir(tempfile.mkdtemp(prefix="bench-logging-"))
+console = sys.stdout
+sys.stdout = open(os.devnull, "w")
+
+from src.utils import xlogging  # noqa: E402
+
+
+def legacy_logger() -> logging.Logger:
+    logger = logging.getLogger("bench.legacy")
+    logger.setLevel("DEBUG")
+    logger.propagate = False
+    formatter = logging.Formatter(
+        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    for handler in (
+        logging.FileHandler(filename="legacy.txt", encoding="utf-8"),
+        logging.StreamHandler(stream=sys.stdout),
+    ):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def measure(log, number: int) -> tuple[float, float]:
+    samples = []
+    for i in range(number):
+        start = time.perf_counter_ns()
+        log(f"Collected stats tick {i}: cpu=12.5 ram=40.1")
+        samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    return sum(samples) / number / 1000, samples[int(number * 0.99)] / 1000
+
+
+def main() -> None:
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    legacy = legacy_logger()
+    queued = xlogging.get_logger("bench.queued")
+    backend = xlogging._get_backend()
+    handler = backend.handler
+    results = [("sync FileHandler + stdout", *measure(legacy.info, number))]
+
+    rate_filters = handler.filters[:]
+    handler.filters.clear()
+    results.append(("queue, no rate limit", *measure(queued.info, number)))
+    handler.filters.extend(rate_filters)
+    while not backend.queue.empty():
+        time.sleep(0.05)
+    results.append(("queue, rate limited", *measure(queued.info, number)))
+
+    for label, mean, p99 in results:
+        print(f"{label:<28} mean {mean:7.2f} us   p99 {p99:7.2f} us", file=console)
+    dropped = xlogging._AsyncQueueHandler.dropped
+    print(f"dropped on full queue: {dropped}", file=console)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Usage: bench_logs.py [size_mb]  (default 2048, i.e. a multi-GB log file)"""
+
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.service.logs import (  # noqa: E402
+    LogQuery,
+    parse_timestamp,
+    read_json_file,
+    read_local,
+)
+
+START_NS = 1_700_000_000 * 1_000_000_000
+STEP_NS = 1_000_000
+
+
+def _rfc3339(ns: int) -> str:
+    dt = datetime.fromtimestamp(ns // 1_000_000_000, tz=timezone.utc)
+    frac = f"{ns % 1_000_000_000:09d}".rstrip("0")
+    return dt.strftime("%Y-%m-%dT%H:%M:%S") + (f".{frac}" if frac else "") + "Z"
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _entry(ts: int, line: bytes) -> bytes:
+    proto = (
+        b"\x0a\x06stdout" + b"\x10" + _varint(ts) + b"\x1a" + _varint(len(line)) + line
+    )
+    size = struct.pack(">I", len(proto))
+    return size + proto + size
+
+
+def generate(directory: Path, size: int) -> tuple[Path, Path, int]:
+    json_path = directory / "container-json.log"
+    local_path = directory / "container.log"
+    count = 0
+    with open(json_path, "wb") as jf, open(local_path, "wb") as lf:
+        jbuf, lbuf = [], []
+        written = 0
+        while written < size:
+            ts = START_NS + count * STEP_NS
+            text = f"step {count} loss=0.{count % 9973:04d} lr=3e-4 " + "x" * 80
+            record = {"log": text + "\n", "stream": "stdout", "time": _rfc3339(ts)}
+            line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+            jbuf.append(line)
+            lbuf.append(_entry(ts, text.encode()))
+            written += len(line)
+            count += 1
+            if len(jbuf) >= 10_000:
+                jf.write(b"".join(jbuf))
+                lf.write(b"".join(lbuf))
+                jbuf, lbuf = [], []
+        jf.write(b"".join(jbuf))
+        lf.write(b"".join(lbuf))
+    return json_path, local_path, count
+
+
+def legacy_tail(path: Path, tail: int, since=None, until=None) -> bytes:
+    """What a streaming reader does: decode every record, keep the last N."""
+    keep: deque = deque(maxlen=tail)
+    with open(path, "rb") as f:
+        for line in f:
+            record = json.loads(line)
+            if since is not None or until is not None:
+                ts = parse_timestamp(record["time"])
+                if (since is not None and ts < since) or (
+                    until is not None and ts > until
+                ):
+                    continue
+            keep.append(record["log"].encode())
+    return b"".join(keep)
+
+
+def query_ns(seconds: float) -> int:
+    return round(seconds * 1e6) * 1000
+
+
+def _timed(fn, repeat: int = 3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    with tempfile.TemporaryDirectory(prefix="bench-logs-") as tmp:
+        started = time.perf_counter()
+        json_path, local_path, count = generate(Path(tmp), size_mb * 1024 * 1024)
+        print(
+            f"generated {count} records, json-file "
+            f"{os.path.getsize(json_path) / 2**20:.0f} MiB, local "
+            f"{os.path.getsize(local_path) / 2**20:.0f} MiB "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        middle = START_NS + (count // 2) * STEP_NS
+        since_s, until_s = middle / 1e9, (middle + 500 * STEP_NS) / 1e9
+        cases = [
+            ("tail=100", LogQuery(tail=100), {}),
+            (
+                "since/until window",
+                LogQuery(tail=None, since=since_s, until=until_s),
+                {"since": query_ns(since_s), "until": query_ns(until_s)},
+            ),
+        ]
+        for label, query, legacy_kw in cases:
+            print(label)
+            t_json, out_json = _timed(lambda: read_json_file(json_path, query))
+            t_local, out_local = _timed(lambda: read_local(local_path, query))
+            t_legacy, out_legacy = _timed(
+                lambda: legacy_tail(json_path, query.tail or count, **legacy_kw),
+                repeat=1,
+            )
+            assert out_json == out_legacy == out_local, label
+            print(f"  full scan        {t_legacy * 1e3:10.1f} ms")
+            print(f"  json-file seek   {t_json * 1e3:10.3f} ms")
+            print(f"  local seek       {t_local * 1e3:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
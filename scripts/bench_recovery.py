@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""Startup recovery against a fake Docker socket.
+
+Usage: bench_recovery.py [containers...]
+
+A unix socket server answers GET /containers/json with the given number of
+labelled containers (default 100, 1000 and 5000), two published ports each.
+The persisted state knows one of them, with a stale status and stale ports.
+Recovery must fix the record, lease every published port, ask Docker
+exactly once and stay well inside RECOVERY_TIMEOUT. Further cases: a lost
+record (the running container is adopted), a removed container (the record
+is cleared), Docker down (the record is left alone) and Docker hanging (the
+call gives up after the timeout). Created warm pool containers keep their
+port leases and do not count as orphans.
+"""
+
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import consts  # noqa: E402
+from src.service.recovery import recover  # noqa: E402
+from src.storage import state  # noqa: E402
+
+HANG_TIMEOUT = 0.5
+
+
+def container_id(i: int) -> str:
+    return f"{i:012d}".ljust(64, "f")
+
+
+def container(i: int, running: bool = True) -> dict:
+    ports = [
+        {"IP": ip, "PrivatePort": private, "PublicPort": public, "Type": "tcp"}
+        for ip, private, public in (
+            ("0.0.0.0", 22, 20000 + i),
+            ("::", 22, 20000 + i),
+            ("0.0.0.0", 8888, 40000 + i),
+        )
+    ]
+    return {
+        "Id": container_id(i),
+        "Created": 1_700_000_000 + i,
+        "State": "running" if running else "exited",
+        "Labels": {
+            consts.CONTAINER_LABEL: "1",
+            consts.CONTAINER_LABEL_INSTANCE: f"inst-{i}",
+        },
+        "Ports": ports if running else [],
+    }
+
+
+class FakeDocker(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, containers: list[dict], hang: bool = False):
+        self.body = json.dumps(containers).encode()
+        self.hang = hang
+        self.requests: list[str] = []
+        super().__init__(path, Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self.server.requests.append(self.path)
+        if self.server.hang:
+            time.sleep(HANG_TIMEOUT * 4)
+            return
+        url = urlsplit(self.path)
+        filters = json.loads(parse_qs(url.query)["filters"][0])
+        if url.path != "/containers/json" or filters != {
+            "label": [consts.CONTAINER_LABEL]
+        }:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def fresh_state(name: str, current: state.InstanceState) -> None:
+    # A new database per case; the store is re-created when the path changes.
+    state.STATE_DB_PATH = Path(f"{name}.db").resolve()
+    if current.status != "destroyed":
+        state.save_state(current)
+
+
+def check(ok: bool, message: str) -> None:
+    if not ok:
+        print(f"FAIL: {message}")
+        sys.exit(1)
+
+
+def many(count: int) -> float:
+    known = count // 2
+    fresh_state(
+        f"many-{count}",
+        state.InstanceState(
+            instance_id=f"inst-{known}",
+            container_id=container_id(known),
+            status="paused",
+            allocated_ports={"22": "1"},
+        ),
+    )
+    containers = [container(i) for i in range(count)]
+    docker = FakeDocker(f"docker-{count}.sock", containers)
+    report = recover(docker.server_address)
+    docker.shutdown()
+    docker.server_close()
+
+    current = state.get_current_state()
+    check(report["ok"], f"recovery failed: {report}")
+    check(len(docker.requests) == 1, f"{len(docker.requests)} Docker API calls")
+    check(current.status == "running", f"status {current.status}")
+    expected = {"22": str(20000 + known), "8888": str(40000 + known)}
+    check(current.allocated_ports == expected, f"ports {current.allocated_ports}")
+    check(len(state.leased_ports()) == 2 * count, "leases not restored")
+    check(report["orphans"] == count - 1, f"orphans {report['orphans']}")
+    check(
+        report["seconds"] < consts.RECOVERY_TIMEOUT,
+        f"{report['seconds']}s is over RECOVERY_TIMEOUT",
+    )
+    return report["seconds"]
+
+
+def lost_record() -> None:
+    fresh_state("lost", state.InstanceState())
+    containers = [container(1, running=False), container(2), container(3)]
+    docker = FakeDocker("docker-lost.sock", containers)
+    report = recover(docker.server_address)
+    docker.shutdown()
+    docker.server_close()
+    current = state.get_current_state()
+    check(report["adopted"], "running container was not adopted")
+    check(current.instance_id == "inst-3", f"adopted {current.instance_id}")
+    check(current.container_id == container_id(3), "wrong container adopted")
+
+
+def removed() -> None:
+    fresh_state(
+        "removed",
+        state.InstanceState(
+            instance_id="gone", container_id=container_id(999), status="running"
+        ),
+    )
+    docker = FakeDocker("docker-removed.sock", [container(1)])
+    # No label match: the record is checked by id, which fails here.
+    recover(docker.server_address)
+    docker.shutdown()
+    docker.server_close()
+    current = state.get_current_state()
+    check(current.status == "destroyed", "record of a removed container kept")
+
+
+def pooled() -> None:
+    fresh_state("pooled", state.InstanceState())
+    warm = {
+        "Id": container_id(50),
+        "Created": 1_700_000_050,
+        "State": "created",
+        "Labels": {
+            consts.CONTAINER_LABEL: "1",
+            consts.CONTAINER_LABEL_POOL: "spec",
+            consts.CONTAINER_LABEL_PORTS: json.dumps({"8888": "41000"}),
+        },
+        "Ports": [],
+    }
+    docker = FakeDocker("docker-pooled.sock", [warm])
+    report = recover(docker.server_address)
+    docker.shutdown()
+    docker.server_close()
+    check(report["orphans"] == 0, "warm pool container counted as an orphan")
+    check(state.leased_ports() == {41000}, "warm pool ports not leased")
+    check(state.get_current_state().status == "destroyed", "warm container adopted")
+
+
+def docker_down() -> None:
+    before = state.InstanceState(
+        instance_id="kept", container_id=container_id(7), status="running"
+    )
+    fresh_state("down", before)
+    report = recover("missing.sock")
+    check(not report["ok"], "recovery without Docker reported success")
+    check(state.get_current_state() == before, "state changed without Docker")
+
+
+def docker_hangs() -> float:
+    fresh_state("hang", state.InstanceState())
+    docker = FakeDocker("docker-hang.sock", [], hang=True)
+    started = time.monotonic()
+    report = recover(docker.server_address, timeout=HANG_TIMEOUT)
+    elapsed = time.monotonic() - started
+    docker.shutdown()
+    docker.server_close()
+    check(not report["ok"], "hanging Docker reported success")
+    check(elapsed < HANG_TIMEOUT * 2, f"gave up after {elapsed:.2f}s")
+    return elapsed
+
+
+def main() -> None:
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    os.chdir(tempfile.mkdtemp(prefix="bench-recovery-"))
+    for count in counts:
+        print(f"{count:>6} containers: recovered in {many(count) * 1000:.0f} ms")
+    lost_record()
+    removed()
+    pooled()
+    docker_down()
+    print(
+        f"Docker hanging: gave up after {docker_hangs() * 1000:.0f} ms "
+        f"(timeout {HANG_TIMEOUT * 1000:.0f} ms)"
+    )
+    print(
+        "lost record adopted, removed container cleared, warm pool leased, "
+        "Docker down: state kept"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Keeps /ping under load across a server upgrade and a crash restart.
+
+Usage: bench_restart.py [gunicorn|asgi] [--legacy]
+
+Every request opens a new connection, so a moment without a listener shows up
+as "connection refused". The sequence is: run for 2 s, upgrade (the new
+generation is started and ready before the old one drains), run for 2 s,
+SIGKILL the current generation and start a new one, run for 3 s.
+
+--legacy repeats it the old way: each generation binds the port itself, the
+old one must stop before the new one can bind, and a crash restart waits 3 s.
+"""
+
+import http.client
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src import consts  # noqa: E402
+from src.server.handoff import (  # noqa: E402
+    create_listener,
+    expected_ready,
+    run_server,
+    wait_ready,
+)
+from src.utils.ports import get_free_port  # noqa: E402
+
+Process = multiprocessing.get_context("fork").Process
+CLIENTS = 8
+
+
+def _client(port: int, stop, results) -> None:
+    errors: Counter = Counter()
+    ok, slowest = 0, 0.0
+    while not stop.is_set():
+        started = time.monotonic()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            conn.request("GET", "/ping")
+            error = None if conn.getresponse().status == 200 else "http error"
+        except OSError as e:
+            error = type(e).__name__
+        finally:
+            conn.close()
+        if error:
+            errors[error] += 1
+            time.sleep(0.01)
+        else:
+            ok += 1
+            slowest = max(slowest, time.monotonic() - started)
+    results.put((ok, slowest, errors))
+
+
+class Load:
+    """Clients run in their own processes: a fork of a process with open
+    client connections would hold those connections open in the child."""
+
+    def __init__(self, port: int) -> None:
+        self._stop = multiprocessing.Event()
+        self._results = multiprocessing.Queue()
+        self._clients = [
+            Process(target=_client, args=(port, self._stop, self._results))
+            for _ in range(CLIENTS)
+        ]
+        self.errors: Counter = Counter()
+        self.ok = 0
+        self.slowest = 0.0
+
+    def __enter__(self) -> "Load":
+        for client in self._clients:
+            client.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        for _ in self._clients:
+            ok, slowest, errors = self._results.get()
+            self.ok += ok
+            self.slowest = max(self.slowest, slowest)
+            self.errors.update(errors)
+        for client in self._clients:
+            client.join()
+
+
+def spawn(listen_fd: int) -> tuple[multiprocessing.Process, int]:
+    ready_r, ready_w = os.pipe()
+    generation = Process(target=run_server, args=(listen_fd, ready_w))
+    generation.start()
+    os.close(ready_w)
+    return generation, ready_r
+
+
+def ready(ready_fd: int) -> None:
+    mode = os.environ["QUDATA_SERVER_MODE"]
+    if not wait_ready(ready_fd, expected_ready(mode), consts.HANDOFF_READY_TIMEOUT):
+        raise SystemExit("server generation did not become ready")
+
+
+def handoff(port: int) -> Load:
+    listener = create_listener(port, "127.0.0.1")
+    current, ready_fd = spawn(listener.fileno())
+    ready(ready_fd)
+    with Load(port) as load:
+        time.sleep(2)
+        upgraded, ready_fd = spawn(listener.fileno())
+        ready(ready_fd)
+        current.terminate()
+        current.join()
+        current = upgraded
+
+        time.sleep(2)
+        os.kill(current.pid, signal.SIGKILL)
+        current.join()
+        current, ready_fd = spawn(listener.fileno())
+        os.close(ready_fd)
+        time.sleep(3)
+    current.terminate()
+    current.join()
+    return load
+
+
+def legacy_server(port: int) -> subprocess.Popen:
+    if os.environ["QUDATA_SERVER_MODE"] == "asgi":
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.server.asgi:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--no-access-log",
+        ]
+    else:
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-w",
+            str(consts.GUNICORN_WORKERS),
+            "-b",
+            f"127.0.0.1:{port}",
+            "src.server.server:app",
+        ]
+    server = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + consts.HANDOFF_READY_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            http.client.HTTPConnection("127.0.0.1", port, timeout=1).connect()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    raise SystemExit("legacy server did not come up")
+
+
+def legacy(port: int) -> Load:
+    server = legacy_server(port)
+    with Load(port) as load:
+        time.sleep(2)
+        server.terminate()
+        server.wait()
+        server = legacy_server(port)
+
+        time.sleep(2)
+        server.kill()
+        server.wait()
+        time.sleep(3)
+        server = legacy_server(port)
+        time.sleep(3)
+    server.terminate()
+    server.wait()
+    return load
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    os.environ["QUDATA_SERVER_MODE"] = args[0] if args else "gunicorn"
+    os.environ["PYTHONPATH"] = str(ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="bench-restart-"))
+    with open("server.log", "w") as log:
+        os.dup2(log.fileno(), sys.stderr.fileno())
+
+    is_legacy = "--legacy" in sys.argv
+    load = (legacy if is_legacy else handoff)(get_free_port())
+    errors = ", ".join(f"{k}={v}" for k, v in load.errors.items()) or "none"
+    print(
+        f"{'legacy' if is_legacy else 'handoff'} "
+        f"({os.environ['QUDATA_SERVER_MODE']}): {load.ok} ok, errors: {errors}, "
+        f"slowest ok {load.slowest * 1000:.0f} ms"
+    )
+    if load.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import psutil
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.server.handoff import create_listener, server_command  # noqa: E402
+from src.utils.ports import get_free_port  # noqa: E402
+
+PATHS = ["/ping", "/instances", "/instances?logs=true"]
+
+
+def tree_rss(pid: int) -> float:
+    proc = psutil.Process(pid)
+    procs = [proc] + proc.children(recursive=True)
+    return sum(p.memory_info().rss for p in procs) / 1024 / 1024
+
+
+async def wait_ready(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/ping")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not become ready")
+
+
+async def load(base_url: str, concurrency: int, requests: int) -> tuple[float, float]:
+    latencies: list[float] = []
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+
+        async def worker(n: int) -> None:
+            for i in range(requests):
+                t0 = time.perf_counter()
+                await client.get(PATHS[(n + i) % len(PATHS)])
+                latencies.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def bench(mode: str, concurrency_levels: list[int], requests: int) -> None:
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    listener = create_listener(port, "127.0.0.1")
+    server = subprocess.Popen(
+        server_command(mode, listener.fileno()),
+        cwd=ROOT,
+        pass_fds=[listener.fileno()],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(wait_ready(base_url))
+        idle_rss = tree_rss(server.pid)
+        for concurrency in concurrency_levels:
+            rps, p99 = asyncio.run(load(base_url, concurrency, requests))
+            print(
+                f"{mode:<9} conc={concurrency:<4} {rps:>8,.0f} req/s  "
+                f"p99={p99:7.1f}ms  rss idle={idle_rss:.0f}MiB "
+                f"loaded={tree_rss(server.pid):.0f}MiB"
+            )
+    finally:
+        server.terminate()
+        server.wait()
+        listener.close()
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    modes = sys.argv[2:] or ["gunicorn", "asgi"]
+    os.chdir(ROOT)
+    for mode in modes:
+        bench(mode, [1, 16, 64], requests)
+
+
+if __name__ == "__main__":
+    main()
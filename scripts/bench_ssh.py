@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Time from `docker run` to an SSH banner on the mapped port.
+
+Usage: bench_ssh.py [image] [--legacy]
+
+Needs docker and dropbear on the host and the image available locally.
+--legacy also measures the old apt-get + docker exec provisioning
+(needs network access from the container and a Debian-based image).
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.service.ssh_setup import ssh_run_args, wait_for_ssh  # noqa: E402
+from src.utils.ports import get_free_port  # noqa: E402
+from src.utils.system import run_command  # noqa: E402
+
+LEGACY_COMMANDS = [
+    "apt-get update -qq",
+    "DEBIAN_FRONTEND=noninteractive apt-get install -y -qq openssh-server",
+    "mkdir -p /var/run/sshd",
+]
+
+
+def _run(args: list[str]) -> str:
+    success, stdout, stderr = run_command(args)
+    if not success:
+        raise SystemExit(f"{' '.join(args[:3])} failed: {stderr}")
+    return stdout.strip()
+
+
+def bundle(image: str) -> float:
+    port = get_free_port()
+    options, command = ssh_run_args(image, "sleep infinity")
+    started = time.monotonic()
+    container = _run(
+        ["docker", "run", "-d", "--rm", "-p", f"{port}:22", *options, image, *command]
+    )
+    try:
+        if wait_for_ssh(port, timeout=30) is None:
+            raise SystemExit("sshd did not come up")
+        return time.monotonic() - started
+    finally:
+        run_command(["docker", "rm", "-f", container])
+
+
+def legacy(image: str) -> float:
+    port = get_free_port()
+    started = time.monotonic()
+    container = _run(
+        ["docker", "run", "-d", "--rm", "-p", f"{port}:22", image, "sleep", "infinity"]
+    )
+    try:
+        for cmd in LEGACY_COMMANDS:
+            _run(["docker", "exec", container, "sh", "-c", cmd])
+        _run(["docker", "exec", "-d", container, "/usr/sbin/sshd", "-D"])
+        if wait_for_ssh(port, timeout=60) is None:
+            raise SystemExit("sshd did not come up")
+        return time.monotonic() - started
+    finally:
+        run_command(["docker", "rm", "-f", container])
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    image = args[0] if args else "debian:bookworm-slim"
+    runs = 5
+
+    times = sorted(bundle(image) for _ in range(runs))
+    print(f"bundle  median {times[runs // 2]:.3f}s  max {times[-1]:.3f}s")
+    if "--legacy" in sys.argv:
+        elapsed = legacy(image)
+        print(f"legacy  {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Cold start: launcher import time and time to the first /ping 200.
+
+Usage: bench_startup.py [runs]
+
+Each run starts a fresh server generation on a new listening socket, the
+way the launcher does, and polls /ping until it answers 200. The memory
+column is the PSS of the whole server tree, so pages the workers share
+copy-on-write with the master are counted once.
+"""
+
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import psutil
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src import consts  # noqa: E402
+from src.server.handoff import create_listener, server_command  # noqa: E402
+from src.utils.ports import get_free_port  # noqa: E402
+
+
+def import_time() -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import main"],
+        env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def ping(port: int) -> bool:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        conn.request("GET", "/ping")
+        return conn.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+def tree_pss(pid: int) -> float:
+    proc = psutil.Process(pid)
+    procs = [proc] + proc.children(recursive=True)
+    return sum(p.memory_full_info().pss for p in procs) / 1024 / 1024
+
+
+def cold_start(mode: str) -> tuple[float, float]:
+    port = get_free_port()
+    listener = create_listener(port, "127.0.0.1")
+    env = dict(os.environ, QUDATA_SERVER_MODE=mode, PYTHONPATH=str(ROOT))
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        server_command(mode, listener.fileno()),
+        env=env,
+        pass_fds=[listener.fileno()],
+        stderr=subprocess.DEVNULL,
+    )
+    listener.close()
+    try:
+        deadline = started + consts.HANDOFF_READY_TIMEOUT
+        while not ping(port):
+            if time.perf_counter() > deadline or server.poll() is not None:
+                raise SystemExit(f"{mode} server did not answer /ping")
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        if mode == "gunicorn":
+            # Let every worker finish booting before measuring memory.
+            time.sleep(1)
+        return elapsed, tree_pss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    os.chdir(tempfile.mkdtemp(prefix="bench-startup-"))
+    imports = [import_time() for _ in range(runs)]
+    print(
+        f"launcher import (python -c 'import main'): "
+        f"median {statistics.median(imports) * 1000:.0f} ms"
+    )
+    for mode in consts.SERVER_MODES:
+        samples = [cold_start(mode) for _ in range(runs)]
+        first = statistics.median(s[0] for s in samples)
+        pss = statistics.median(s[1] for s in samples)
+        print(
+            f"{mode:<9} first /ping 200: median {first * 1000:.0f} ms, "
+            f"server tree PSS {pss:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.utils import tracing  # noqa: E402
+
+
+def nested() -> None:
+    with tracing.span("state.load"):
+        pass
+    with tracing.span("run_command", command="docker"):
+        pass
+
+
+def request(headers) -> None:
+    with tracing.start_trace("http GET /instances", headers, method="GET"):
+        nested()
+
+
+def main() -> None:
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    os.chdir(tempfile.mkdtemp(prefix="bench-tracing-"))
+
+    rows = [
+        ("baseline (no spans)", lambda: None),
+        ("span, no active trace", lambda: nested()),
+        ("request, not sampled", lambda: request({})),
+        ("request, sampled", lambda: request({"x-trace-id": "bench"})),
+    ]
+    for label, fn in rows:
+        elapsed = timeit.timeit(fn, number=number)
+        print(f"{label:<24} {elapsed / number * 1e6:8.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
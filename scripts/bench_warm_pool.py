@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Warm pool: time to a running container, and the cost of the port proxy.
+
+Usage: bench_warm_pool.py [rounds] [image:tag] [command]
+
+The policy check runs anywhere: a refill and a claim run against a recorded
+fake Docker CLI, each docker command is mapped to its Engine API route, and
+every route must pass the Docker policy for a principal that is not the
+agent, so that the pool does not rely on the agent's exemption.
+
+The proxy part runs anywhere: an echo server is reached directly and through
+PortProxy, with a new connection per request and over one connection.
+
+The Docker part needs a Docker host with the image already pulled (default
+alpine:3.20 running "sleep infinity"). Each round creates an instance
+through create_new_instance twice: cold, with no pool configured, and warm,
+after a refill has prepared one container; the instance is removed between
+rounds. The printed times are what create reports as time to running.
+"""
+
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.chdir(tempfile.mkdtemp(prefix="bench-warm-pool-"))
+CONFIG = Path("warm_pool.json").resolve()
+os.environ["QUDATA_WARM_POOL_CONFIG"] = str(CONFIG)
+os.environ["QUDATA_WARM_POOL_ENV_DIR"] = str(Path("env").resolve())
+
+from src import consts  # noqa: E402
+from src.security.policy import DEFAULT_RULES, PolicyEngine  # noqa: E402
+from src.server.models import CreateInstance  # noqa: E402
+from src.service import instances, warm_pool  # noqa: E402
+from src.service.port_proxy import PortProxy  # noqa: E402
+from src.storage import state  # noqa: E402
+from src.utils.ports import get_free_port  # noqa: E402
+from src.utils.system import run_command  # noqa: E402
+
+REQUESTS = 2000
+
+# docker CLI command -> the Engine API route it calls
+ROUTES = {
+    "create": ("POST", "/containers/create"),
+    "update": ("POST", "/containers/{id}/update"),
+    "start": ("POST", "/containers/{id}/start"),
+    "rm": ("DELETE", "/containers/{id}"),
+    "cp": ("PUT", "/containers/{id}/archive"),
+    "image": ("GET", "/images/{name}/json"),
+}
+
+
+def echo_server() -> int:
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def serve(conn: socket.socket) -> None:
+        with conn:
+            while data := conn.recv(65536):
+                conn.sendall(data)
+
+    def accept() -> None:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def round_trips(port: int, reconnect: bool) -> float:
+    """Mean microseconds per request."""
+    conn = socket.create_connection(("127.0.0.1", port))
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        if reconnect:
+            conn.close()
+            conn = socket.create_connection(("127.0.0.1", port))
+        conn.sendall(b"ping")
+        conn.recv(16)
+    conn.close()
+    return (time.perf_counter() - started) / REQUESTS * 1e6
+
+
+def bench_proxy() -> None:
+    target = echo_server()
+    proxy = PortProxy(get_free_port(), target)
+    for reconnect in (True, False):
+        direct = round_trips(target, reconnect)
+        proxied = round_trips(proxy.port, reconnect)
+        mode = "new connection" if reconnect else "kept connection"
+        print(f"{mode:>16}: direct {direct:.0f} us, via proxy {proxied:.0f} us")
+    proxy.close()
+
+
+def check_claim_policy() -> None:
+    engine = PolicyEngine(DEFAULT_RULES)
+    issued: list[list[str]] = []
+    created: dict[str, str] = {}
+
+    def docker(command: list[str]) -> tuple[bool, str, str]:
+        issued.append(command)
+        if command[1] == "create":
+            created["env"] = next(
+                arg.partition("=")[2]
+                for arg in command
+                if arg.startswith(f"{consts.CONTAINER_LABEL_ENV}=")
+            )
+            created["ports"] = next(
+                arg.partition("=")[2]
+                for arg in command
+                if arg.startswith(f"{consts.CONTAINER_LABEL_PORTS}=")
+            )
+            return True, "f" * 64, ""
+        return True, "", ""
+
+    def pooled() -> list[dict]:
+        labels = {
+            consts.CONTAINER_LABEL_POOL: spec.key,
+            consts.CONTAINER_LABEL_PORTS: created["ports"],
+            consts.CONTAINER_LABEL_ENV: created["env"],
+        }
+        return [{"Id": "f" * 64, "Created": 0, "Labels": labels}] if created else []
+
+    spec = warm_pool.PoolSpec("alpine", "3.20", ports=("8080",), command="true")
+    CONFIG.write_text(json.dumps([dict(asdict(spec), ports=list(spec.ports))]))
+    originals = (
+        warm_pool.run_command,
+        warm_pool._pool_containers,
+        warm_pool._entrypoint,
+        warm_pool._sweep_env_dirs,
+    )
+    warm_pool.run_command = docker
+    warm_pool._pool_containers = pooled
+    warm_pool._entrypoint = lambda spec: ([], ["true"])
+    warm_pool._sweep_env_dirs = lambda: None
+    try:
+        if warm_pool._create(spec) is None:
+            raise SystemExit("refill did not prepare a container")
+        params = CreateInstance(
+            image="alpine",
+            image_tag="3.20",
+            storage_gb=1,
+            command="true",
+            ports={"8080": "auto"},
+            env_variables={"BENCH": "it's 1"},
+        )
+        if warm_pool.claim(params, "1", "2", 0) is None:
+            raise SystemExit("claim failed")
+    finally:
+        (
+            warm_pool.run_command,
+            warm_pool._pool_containers,
+            warm_pool._entrypoint,
+            warm_pool._sweep_env_dirs,
+        ) = originals
+        CONFIG.unlink(missing_ok=True)
+
+    for command in issued:
+        method, route = ROUTES[command[1]]
+        decision = engine.decide("uid:1000", method, route)
+        print(f"policy: docker {command[1]:<6} {method} {route}: {decision['reason']}")
+        if not decision["allow"]:
+            raise SystemExit(f"the warm pool issues a forbidden route: {command}")
+    env_file = Path("env") / created["env"] / "env"
+    print(f"policy: env at claim in {env_file}: {env_file.read_text().strip()}")
+
+
+def remove_instance() -> None:
+    current = state.get_current_state()
+    if current.container_id:
+        run_command(["docker", "rm", "-f", current.container_id])
+    state.release_ports(current.instance_id)
+    state.clear_state()
+
+
+def create(image: str, tag: str, command: str) -> float:
+    params = CreateInstance(
+        image=image,
+        image_tag=tag,
+        storage_gb=1,
+        command=command,
+        ports={"8080": "auto"},
+        env_variables={"BENCH": "1"},
+    )
+    ok, _, err = instances.create_new_instance(params)
+    if not ok:
+        raise SystemExit(f"create failed: {err}")
+    history = state.instance_history(state.get_current_state().instance_id)
+    completed = next(e for e in history if e.get("stage") == "completed")
+    return completed["data"]["seconds"]
+
+
+def bench_docker(rounds: int, image: str, tag: str, command: str) -> None:
+    spec = {
+        "image": image,
+        "tag": tag,
+        "size": 1,
+        "ports": ["8080"],
+        "command": command,
+    }
+    cold, warm = [], []
+    for _ in range(rounds):
+        CONFIG.unlink(missing_ok=True)
+        cold.append(create(image, tag, command))
+        remove_instance()
+
+        CONFIG.write_text(json.dumps([spec]))
+        if warm_pool.refill()["created"] != 1:
+            raise SystemExit("refill did not prepare a container")
+        warm.append(create(image, tag, command))
+        remove_instance()
+    CONFIG.unlink(missing_ok=True)
+    print(
+        f"time to running, cold docker run: median "
+        f"{statistics.median(cold) * 1000:.0f} ms"
+    )
+    print(
+        f"time to running, warm pool hit:   median "
+        f"{statistics.median(warm) * 1000:.0f} ms"
+    )
+    print(f"stats: {json.dumps(warm_pool.stats())}")
+
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    name = sys.argv[2] if len(sys.argv) > 2 else "alpine:3.20"
+    image, _, tag = name.partition(":")
+    command = sys.argv[3] if len(sys.argv) > 3 else "sleep infinity"
+    check_claim_policy()
+    bench_proxy()
+    if shutil.which("docker") is None:
+        print("docker not found: skipping time to running")
+        return
+    bench_docker(rounds, image, tag or "latest", command)
+
+
+if __name__ == "__main__":
+    main()
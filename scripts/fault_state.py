@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Kills a writer mid-save over and over and checks the state after each kill.
+
+Usage: fault_state.py [rounds] [--legacy]
+
+Each round forks a child that saves states in a tight loop and SIGKILLs it
+after a random delay. The parent then opens the database with a fresh store:
+it must hold the instance written by the child and never go back a
+generation, and the history must have one transition per generation.
+--legacy runs the same loop against the old truncate-and-write state.json
+for comparison.
+"""
+
+import json
+import os
+import random
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.chdir(tempfile.mkdtemp(prefix="fault-state-"))
+
+from src.storage import state  # noqa: E402
+
+LEGACY_PATH = Path("legacy-state.json")
+PORTS = {str(port): str(port + 10000) for port in range(200)}
+
+
+def legacy_save(s: state.InstanceState) -> None:
+    with open(LEGACY_PATH, "w", encoding="utf-8") as f:
+        json.dump(asdict(s), f, indent=4)
+
+
+def legacy_load() -> tuple[state.InstanceState, int]:
+    try:
+        with open(LEGACY_PATH, encoding="utf-8") as f:
+            return state.InstanceState(**json.load(f)), 0
+    except (OSError, ValueError, TypeError):
+        return state.InstanceState(), 0
+
+
+def writer(legacy: bool) -> None:
+    i = 0
+    while True:
+        i += 1
+        s = state.InstanceState(
+            instance_id=f"inst-{i}",
+            container_id=f"{i:064x}",
+            status="running",
+            allocated_ports=PORTS,
+        )
+        if legacy:
+            legacy_save(s)
+        else:
+            state.get_state_store().put(s)
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    rounds = int(args[0]) if args else 200
+    legacy = "--legacy" in sys.argv
+    state.save_state(state.InstanceState(instance_id="inst-0", status="running"))
+
+    lost = regressions = 0
+    last_generation = 0
+    for _ in range(rounds):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                writer(legacy)
+            finally:
+                os._exit(1)
+        time.sleep(random.uniform(0.001, 0.02))
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+        if legacy:
+            loaded, generation = legacy_load()
+        else:
+            store = state.StateStore()
+            loaded, generation = store.get(), store.generation()
+        if loaded.instance_id is None:
+            lost += 1
+        if not legacy:
+            if generation < last_generation:
+                regressions += 1
+            last_generation = generation
+
+    gaps = 0
+    if not legacy:
+        conn = sqlite3.connect(state.STATE_DB_PATH)
+        count, top = conn.execute(
+            "SELECT count(*), max(generation) FROM transitions"
+        ).fetchone()
+        gaps = top - count
+    mode = "legacy" if legacy else "sqlite"
+    print(
+        f"{mode}: {rounds} kills, {lost} lost states, "
+        f"{regressions} generation regressions, {gaps} missing transitions"
+    )
+    if lost or regressions or gaps:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
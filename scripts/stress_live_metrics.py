@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Checks that live metrics readers never see a torn snapshot.
+
+Usage: stress_live_metrics.py [seconds] [readers]
+
+A writer process publishes snapshots in which every counter holds the same
+value, a thousand times a second, copying the payload in small chunks
+and yielding between them so that readers run in the middle of a write
+even on one CPU. Reader
+processes check every snapshot through the seqlock, and as a control also
+copy the segment without it. The seqlock path must report zero torn
+snapshots; the control shows that the writes really do interleave.
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.service import live_metrics  # noqa: E402
+from src.service.live_metrics import LiveMetrics  # noqa: E402
+
+CHUNK = 64
+TASKS = [f"task-{i}" for i in range(live_metrics.MAX_TASKS)]
+
+
+class ChunkedLiveMetrics(LiveMetrics):
+
+    def _copy(self, payload: bytes) -> None:
+        base = live_metrics._SEQ.size
+        for offset in range(0, len(payload), CHUNK):
+            self._mem[base + offset : base + offset + CHUNK] = payload[
+                offset : offset + CHUNK
+            ]
+            os.sched_yield()
+
+
+def snapshot_values(i: int) -> tuple[dict, dict]:
+    system = {
+        "cpu_util": float(i),
+        "ram_util": float(i),
+        "disk_util": float(i),
+        "load": (float(i),) * 3,
+        "ram_used": i,
+        "ram_total": i,
+    }
+    histogram = {"max_ms": float(i), "mean_ms": float(i)}
+    task = {
+        "runs": i,
+        "failures": i,
+        "skipped": i,
+        "overruns": i,
+        "lateness": histogram,
+        "duration": histogram,
+    }
+    return system, {name: task for name in TASKS}
+
+
+def consistent(snapshot: dict) -> bool:
+    system = snapshot["system"]
+    values = {
+        system["cpu_util"],
+        system["ram_util"],
+        system["disk_util"],
+        *system["load"],
+        system["ram_used"],
+        system["ram_total"],
+    }
+    for task in snapshot["scheduler"].values():
+        values.update(
+            (
+                task["runs"],
+                task["failures"],
+                task["overruns"],
+                task["duration_max_ms"],
+                task["lateness_mean_ms"],
+            )
+        )
+    # samples is bumped by publish itself: it runs one ahead of i.
+    values.add(snapshot["samples"] - 1)
+    return len(values) == 1
+
+
+def writer(path: str, stop) -> None:
+    segment = ChunkedLiveMetrics(path)
+    i = 0
+    while not stop.is_set():
+        # float32 fields hold integers exactly below 2**24.
+        i = (i + 1) % (1 << 24)
+        segment.publish(*snapshot_values(i))
+        # Far more often than the real sampler, but readers still get to
+        # see the segment at rest between writes.
+        time.sleep(0.001)
+
+
+def unprotected(segment: LiveMetrics) -> dict:
+    """The same decode, without the seqlock: a plain copy of the segment."""
+    return live_metrics._decode(
+        segment._mem[live_metrics._SEQ.size : live_metrics._SIZE]
+    )
+
+
+def reader(path: str, stop, results) -> None:
+    segment = LiveMetrics(path)
+    reads = torn = control = control_torn = stuck = 0
+    spent = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        snapshot = segment.read()
+        spent += time.perf_counter() - started
+        if snapshot is None:
+            stuck += 1
+        else:
+            reads += 1
+            torn += not consistent(snapshot)
+        raw = unprotected(segment)
+        if raw is not None and raw["samples"]:
+            control += 1
+            control_torn += not consistent(raw)
+    results.put((reads, torn, stuck, spent, control, control_torn))
+
+
+def main() -> None:
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    os.chdir(tempfile.mkdtemp(prefix="stress-live-metrics-"))
+    segment = LiveMetrics.create()
+    segment.publish(*snapshot_values(0))
+
+    context = multiprocessing.get_context("fork")
+    stop, results = context.Event(), context.Queue()
+    processes = [context.Process(target=writer, args=(segment.path, stop))] + [
+        context.Process(target=reader, args=(segment.path, stop, results))
+        for _ in range(readers)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(seconds)
+    stop.set()
+    totals = [0] * 6
+    for _ in range(readers):
+        totals = [a + b for a, b in zip(totals, results.get())]
+    for process in processes:
+        process.join()
+
+    number = 20_000
+    started = time.perf_counter()
+    for _ in range(number):
+        segment.read_raw()
+    raw_us = (time.perf_counter() - started) / number * 1e6
+    started = time.perf_counter()
+    for _ in range(number):
+        segment.read()
+    decoded_us = (time.perf_counter() - started) / number * 1e6
+    segment.unlink()
+
+    reads, torn, stuck, spent, control, control_torn = totals
+    print(
+        f"seqlock reads: {reads}, torn: {torn}, gave up: {stuck}, "
+        f"mean read under load {spent / max(reads + stuck, 1) * 1e6:.1f} us"
+    )
+    print(f"uncontended: copy {raw_us:.2f} us, copy + decode {decoded_us:.2f} us")
+    print(f"unprotected copies (control): {control}, torn: {control_torn}")
+    if torn:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
-from src.server.server import app as server_app
+def __getattr__(name: str):
+    # The server app is imported on first use, not with this module.
+    if name == "server_app":
+        from src.server.server import app
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def cli() -> None:
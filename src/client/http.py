@@ -5,6 +5,7 @@ import httpx
 
 from src import consts
 from src.storage.secure import get_agent_secret
+from src.utils.tracing import outgoing_headers, span
 
 
 class HttpClient:
@@ -23,9 +24,12 @@ class HttpClient:
         json: dict[str, Any] = None,
         params: dict[str, Any] = None,
     ) -> dict:
-        response = self._client.request(method, path, json=json, params=params)
-        response.raise_for_status()
-        return response.json()
+        with span("http.client", method=method, path=path):
+            response = self._client.request(
+                method, path, json=json, params=params, headers=outgoing_headers()
+            )
+            response.raise_for_status()
+            return response.json()
 
     def update_secret(self, secret: str) -> None:
         self._client.headers.update({consts.APP_HEADER_NAME: secret})
@@ -65,7 +65,7 @@ class IncidentType(Enum):
 
 @dataclass
 class Incident:
-    incident_type: str
+    incident_type: IncidentType
     timestamp: int
     instances_killed: bool
 
@@ -88,4 +88,4 @@ class Stats:
     inet_in: int = 0
     inet_out: int = 0
     instance_status_reason: Optional[str] = None
-    instance_status: Optional[str] = None
+    instance_status: Optional[InstanceStatus] = None
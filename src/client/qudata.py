@@ -1,3 +1,5 @@
+from typing import Optional
+
 from src.client.http import HttpClient
 from src.client.models import AgentResponse, CreateHost, Incident, InitAgent, Stats
 from src.storage.secure import set_agent_secret
@@ -6,8 +8,8 @@ from src.utils.dto import from_json, to_json
 
 class QudataClient:
 
-    def __init__(self, http_client: HttpClient = HttpClient()):
-        self._client = http_client
+    def __init__(self, http_client: Optional[HttpClient] = None):
+        self._client = http_client or HttpClient()
 
     def ping(self) -> bool:
         resp = self._client.get("/ping")
@@ -3,14 +3,139 @@ from typing import Final
 API_BASE_URL: Final[str] = "https://internal.qudata.ai/v0"
 APP_HEADER_NAME: Final[str] = "X-Agent-Secret"
 
+AGENT_PORT: Final[int] = 8000
+SERVER_MODES: Final[tuple[str, ...]] = ("gunicorn", "asgi")
+GUNICORN_WORKERS: Final[int] = 3
+# The launcher owns the listening socket; requests that arrive while a
+# server generation restarts wait here instead of being refused.
+LISTEN_BACKLOG: Final[int] = 1024
+# A new generation must have its workers up within this time before the
+# old one is told to drain.
+HANDOFF_READY_TIMEOUT: Final[float] = 30.0
+# An agent that crashes sooner than this after start is restarted with a
+# delay, so a crash loop does not spin.
+AGENT_MIN_UPTIME: Final[float] = 10.0
+AGENT_CRASH_BACKOFF: Final[float] = 3.0
+ASGI_EXECUTOR_WORKERS: Final[int] = 16
+# Every open stream under gunicorn holds one of its few sync workers. There
+# /events and GET /instances/logs?follow=true answer 503 with this
+# Retry-After and GET /instances ignores ?wait= (a plain poll; If-None-Match
+# still spares the body). Event subscribers, followed logs and long-polls
+# need QUDATA_SERVER_MODE=asgi.
+SYNC_STREAM_RETRY_AFTER: Final[int] = 30
+LONG_POLL_MAX_WAIT: Final[float] = 25.0
+SSE_HEARTBEAT_INTERVAL: Final[float] = 15.0
+LOGS_FOLLOW_POLL_INTERVAL: Final[float] = 0.25
+LOGS_RUNNING_CHECK_INTERVAL: Final[float] = 2.0
+
+# Expensive routes may hold at most this many workers in total (running or
+# queued), so one worker is always left for /ping and /emergency.
+ADMISSION_SEATS: Final[int] = GUNICORN_WORKERS - 1
+# lane -> (concurrent requests, queued requests)
+ADMISSION_LANES: Final[dict[str, tuple[int, int]]] = {
+    "create": (1, 1),
+    "manage": (1, 1),
+    "logs": (1, 1),
+    "ssh": (1, 2),
+    "poll": (256, 0),
+    "events": (1, 0),
+    "follow": (1, 0),
+}
+# An ASGI long-poll waits on the event loop and holds no worker, so its lane
+# is wide and takes no seat.
+ADMISSION_SEATLESS_LANES: Final[frozenset[str]] = frozenset({"poll"})
+ADMISSION_MAX_WAIT: Final[float] = 5.0
+ADMISSION_RETRY_AFTER: Final[int] = 2
+
+# Guardian watchdog: the agent beats every interval. No beat for the deadline
+# is a stall, counted in the metrics; only no beat for the hang timeout means
+# the agent hung and the instance self-destructs. A short hang timeout stops
+# a hung agent sooner but also destroys renters' instances on a GC pause, a
+# swap storm or a loaded host; a long one leaves a hung agent unwatched for
+# longer. After an exit the launcher gets the grace period to start a new
+# agent, and the new agent gets it again until its first beat. The deadline
+# and the hang timeout can be overridden, see runtime.
+GUARDIAN_BEAT_INTERVAL: Final[float] = 0.1
+GUARDIAN_DEADLINE: Final[float] = 1.0
+GUARDIAN_HANG_TIMEOUT: Final[float] = 10.0
+GUARDIAN_RESTART_GRACE: Final[float] = 10.0
+
+# Periodic jobs of the agent process share one scheduler; every job has at
+# most one run in flight, so keep at least as many workers as jobs.
+SCHEDULER_WORKERS: Final[int] = 8
+SCHEDULER_REPORT_INTERVAL: Final[float] = 300.0
+STATS_INTERVAL: Final[float] = 15.0
+STATS_JITTER: Final[float] = 1.0
+# Host resources sampled by the agent into shared memory for the API workers.
+LIVE_METRICS_INTERVAL: Final[float] = 1.0
+
+# /health/ready re-checks at most this often per worker. /health/deep only
+# serves the result of the agent's background run (GPU container smoke test,
+# driver, disk), never the probe itself.
+HEALTH_READY_TTL: Final[float] = 2.0
+HEALTH_DOCKER_TIMEOUT: Final[float] = 2.0
+HEALTH_DEEP_INTERVAL: Final[float] = 600.0
+HEALTH_DEEP_DELAY: Final[float] = 10.0
+HEALTH_DEEP_DEADLINE: Final[float] = 300.0
+HEALTH_MIN_FREE_DISK: Final[float] = 10.0
+GPU_CHECK_IMAGE: Final[str] = "nvidia/cuda:12.4.1-base-ubuntu22.04"
+
+# Containers started by the agent carry these labels; at startup the agent
+# lists them in one Docker API call and reconciles them with its state
+# before it reports ready. The call is the only wait, bounded by the timeout.
+CONTAINER_LABEL: Final[str] = "io.qudata.agent"
+CONTAINER_LABEL_INSTANCE: Final[str] = "io.qudata.instance_id"
+CONTAINER_LABEL_SSH: Final[str] = "io.qudata.ssh"
+# JSON {container port: host port}; a created container has no published
+# ports in the container list yet.
+CONTAINER_LABEL_PORTS: Final[str] = "io.qudata.ports"
+RECOVERY_TIMEOUT: Final[float] = 5.0
+
+# Optional warm pool: for images listed in the config file the agent keeps
+# created, stopped containers and starts one on create instead of running a
+# new one. The background refill creates at most a batch per run, and only
+# while the pool is under its cap, the host is not busy and the disk is not
+# short (HEALTH_MIN_FREE_DISK). The config path can be overridden, see runtime.
+WARM_POOL_CONFIG_PATH: Final[str] = "/etc/qudata/warm_pool.json"
+CONTAINER_LABEL_POOL: Final[str] = "io.qudata.pool"
+# Each pooled container bind-mounts its own directory under this one, named
+# by the label, for the renter's env written at claim time.
+WARM_POOL_ENV_DIR: Final[str] = "/var/lib/qudata/env"
+CONTAINER_LABEL_ENV: Final[str] = "io.qudata.env"
+WARM_POOL_INTERVAL: Final[float] = 30.0
+WARM_POOL_DELAY: Final[float] = 15.0
+WARM_POOL_MAX_CONTAINERS: Final[int] = 4
+WARM_POOL_REFILL_BATCH: Final[int] = 1
+WARM_POOL_MAX_CPU: Final[float] = 80.0
+WARM_POOL_STATS_WINDOW: Final[float] = 86400.0
+# Host ports a renter asked for that differ from the pooled container's are
+# served by a TCP proxy in the agent, re-synced from the state this often.
+# One thread serves all proxied connections, at most this many at a time
+# (two file descriptors each); more wait in the listen backlog.
+PORT_PROXY_INTERVAL: Final[float] = 0.5
+PORT_PROXY_MAX_CONNECTIONS: Final[int] = 256
+
 KATAGUARD_SOCK_PATH: Final[str] = "/run/kataguard/agent.sock"
-DOCKER_FORBIDDEN_CMDS: Final[list[str]] = [
-    "/exec",
-    "/attach",
-    "/cp",
-    "/copy",
-    "/commit",
-    "/rename",
+DOCKER_PLUGIN_SPEC_PATH: Final[str] = "/etc/docker/plugins/kataguard.spec"
+DOCKER_FORBIDDEN_ROUTES: Final[list[tuple[str, str, str]]] = [
+    ("POST", "/containers/{id}/exec", "exec"),
+    ("*", "/exec/{id}/start", "exec"),
+    ("*", "/exec/{id}/resize", "exec"),
+    ("*", "/exec/{id}/json", "exec"),
+    ("*", "/containers/{id}/attach", "attach"),
+    ("*", "/containers/{id}/attach/ws", "attach"),
+    ("*", "/containers/{id}/archive", "cp"),
+    ("*", "/containers/{id}/copy", "copy"),
+    ("POST", "/commit", "commit"),
+    ("POST", "/containers/{id}/rename", "rename"),
 ]
 
+# Host-cached sshd bundle and the authorized_keys directory, bind-mounted
+# read-only into instances that have SSH enabled.
+SSHD_BUNDLE_DIR: Final[str] = "/var/lib/qudata/sshd"
+SSHD_BUNDLE_MOUNT: Final[str] = "/opt/qudata/ssh"
+SSH_KEYS_DIR: Final[str] = "/var/lib/qudata/ssh"
+
+AUDIT_LOG_PATH: Final[str] = "/var/log/kataguard/agent/audit.log"
+
 INSTALL_REPORT_PATH: Final[str] = "/var/log/kataguard/agent/report.json"
@@ -2,12 +2,53 @@ import os
 import socket
 from functools import lru_cache
 
-from src.utils.ports import get_free_port
+from src import consts
 
 
 @lru_cache
 def agent_port() -> int:
-    return get_free_port()
+    try:
+        return int(os.environ.get("QUDATA_AGENT_PORT", consts.AGENT_PORT))
+    except ValueError:
+        return consts.AGENT_PORT
+
+
+@lru_cache
+def server_mode() -> str:
+    mode = os.environ.get("QUDATA_SERVER_MODE", consts.SERVER_MODES[0]).lower()
+    return mode if mode in consts.SERVER_MODES else consts.SERVER_MODES[0]
+
+
+@lru_cache
+def guardian_deadline() -> float:
+    try:
+        deadline = float(
+            os.environ.get("QUDATA_GUARDIAN_DEADLINE", consts.GUARDIAN_DEADLINE)
+        )
+    except ValueError:
+        return consts.GUARDIAN_DEADLINE
+    return max(deadline, 2 * consts.GUARDIAN_BEAT_INTERVAL)
+
+
+@lru_cache
+def guardian_hang_timeout() -> float:
+    try:
+        timeout = float(
+            os.environ.get("QUDATA_GUARDIAN_HANG_TIMEOUT", consts.GUARDIAN_HANG_TIMEOUT)
+        )
+    except ValueError:
+        return consts.GUARDIAN_HANG_TIMEOUT
+    return max(timeout, guardian_deadline())
+
+
+@lru_cache
+def warm_pool_config() -> str:
+    return os.environ.get("QUDATA_WARM_POOL_CONFIG", consts.WARM_POOL_CONFIG_PATH)
+
+
+@lru_cache
+def warm_pool_env_dir() -> str:
+    return os.environ.get("QUDATA_WARM_POOL_ENV_DIR", consts.WARM_POOL_ENV_DIR)
 
 
 @lru_cache
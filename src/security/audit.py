@@ -0,0 +1,311 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import IO, Iterator, Optional
+
+from src import consts
+
+GENESIS_HASH = "0" * 64
+
+
+@dataclass
+class AuditRecord:
+    ts: float
+    principal: str
+    method: Optional[str]
+    uri: str
+    allow: bool
+    reason: str
+
+
+class AuditLog:
+    """Append-only, hash-chained JSONL log fed from a non-blocking queue.
+
+    ``record`` only appends to a deque; a writer thread drains it in batches,
+    assigns sequence numbers and chains every line to the previous one with
+    sha256 so that edits or gaps are detectable with ``verify``.
+    """
+
+    def __init__(
+        self,
+        path: str = consts.AUDIT_LOG_PATH,
+        max_bytes: int = 64 * 1024 * 1024,
+        backup_count: int = 10,
+        compress: bool = True,
+        batch_size: int = 512,
+        flush_interval: float = 0.5,
+        queue_size: int = 65536,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.dropped = 0
+
+        self._queue: deque[AuditRecord] = deque()
+        self._stopped = threading.Event()
+        self._seq, self._prev, self._keep = _tail_state(path)
+        self._file: Optional[IO[str]] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "AuditLog":
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        torn = 0
+        if self._keep is not None:
+            torn = os.path.getsize(self.path) - self._keep
+            os.truncate(self.path, self._keep)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() and not _ends_with_newline(self.path):
+            self._file.write("\n")
+        if torn:
+            reason = f"discarded {torn} bytes of a torn record"
+            logging.warning("Audit log %s: %s", self.path, reason)
+            self._file.write(self._break_line(reason))
+            self._file.flush()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def record(
+        self,
+        principal: str,
+        method: Optional[str],
+        uri: str,
+        allow: bool,
+        reason: str,
+    ) -> None:
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._queue.append(
+            AuditRecord(time.time(), principal, method, uri, allow, reason)
+        )
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self._drain()
+        self._drain()
+        self._file.close()
+
+    def _drain(self) -> None:
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            self._write(batch)
+
+    def _write(self, batch: list[AuditRecord]) -> None:
+        lines = []
+        for record in batch:
+            self._seq += 1
+            entry = {"seq": self._seq, **asdict(record), "prev": self._prev}
+            line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False)
+            self._prev = hashlib.sha256(line.encode()).hexdigest()
+            lines.append(line + "\n")
+        if self.dropped:
+            lines.append(self._dropped_line())
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _dropped_line(self) -> str:
+        self._seq += 1
+        entry = {"seq": self._seq, "ts": time.time(), "dropped": self.dropped}
+        entry["prev"] = self._prev
+        self.dropped = 0
+        line = json.dumps(entry, separators=(",", ":"))
+        self._prev = hashlib.sha256(line.encode()).hexdigest()
+        return line + "\n"
+
+    def _break_line(self, reason: str) -> str:
+        """Starts a new chain segment after the last intact record."""
+        self._seq += 1
+        entry = {"seq": self._seq, "ts": time.time(), "break": reason}
+        entry["prev"] = self._prev
+        line = json.dumps(entry, separators=(",", ":"))
+        self._prev = hashlib.sha256(line.encode()).hexdigest()
+        return line + "\n"
+
+    def _rotate(self) -> None:
+        self._file.close()
+        suffix = ".gz" if self.compress else ""
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}{suffix}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}{suffix}")
+        if self.compress:
+            with open(self.path, "rb") as f_in, gzip.open(
+                f"{self.path}.1.gz", "wb"
+            ) as f_out:
+                while chunk := f_in.read(1024 * 1024):
+                    f_out.write(chunk)
+            os.unlink(self.path)
+        else:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+
+def _seq(line: bytes) -> Optional[int]:
+    try:
+        seq = json.loads(line)["seq"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    return seq if isinstance(seq, int) else None
+
+
+def _last_record(name: str) -> tuple[Optional[tuple[int, str]], int]:
+    """The last intact record (seq, hash) and the offset just after it.
+
+    A crash can leave the last line torn; such lines are skipped. For a
+    compressed file the offset is not used.
+    """
+    if name.endswith(".gz"):
+        last = None
+        try:
+            for line in _read_lines(name):
+                seq = _seq(line.encode())
+                if seq is not None:
+                    last = seq, hashlib.sha256(line.encode()).hexdigest()
+        except (OSError, EOFError, ValueError):
+            pass
+        return last, 0
+    size = os.path.getsize(name)
+    window = 64 * 1024
+    while True:
+        start = max(0, size - window)
+        with open(name, "rb") as f:
+            f.seek(start)
+            lines = f.read().split(b"\n")
+        offsets, pos = [], start
+        for line in lines:
+            offsets.append(pos)
+            pos += len(line) + 1
+        # Without the start of the file the first piece may be cut.
+        first = 1 if start else 0
+        for line, offset in reversed(list(zip(lines, offsets))[first:]):
+            seq = _seq(line) if line.strip() else None
+            if seq is not None:
+                end = min(size, offset + len(line) + 1)
+                return (seq, hashlib.sha256(line).hexdigest()), end
+        if not start:
+            return None, 0
+        window = size
+
+
+def _ends_with_newline(name: str) -> bool:
+    with open(name, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _tail_state(path: str) -> tuple[int, str, Optional[int]]:
+    """Seq and hash to chain from, and where to cut a torn active file."""
+    keep = None
+    for name in _log_files(path)[::-1]:
+        last, end = _last_record(name)
+        if name == path and end != os.path.getsize(path):
+            keep = end
+        if last is not None:
+            return last[0], last[1], keep
+    return 0, GENESIS_HASH, keep
+
+
+def _log_files(path: str) -> list[str]:
+    """Rotated files oldest first, then the active file."""
+    directory = os.path.dirname(path) or "."
+    base = os.path.basename(path)
+    rotated = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            index = name[len(base) + 1 :].removesuffix(".gz")
+            if name.startswith(base + ".") and index.isdigit():
+                rotated.append((int(index), os.path.join(directory, name)))
+    files = [name for _, name in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def _read_lines(name: str) -> Iterator[str]:
+    opener = gzip.open if name.endswith(".gz") else open
+    with opener(name, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                yield line
+
+
+def query(
+    path: str = consts.AUDIT_LOG_PATH,
+    principal: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    allow: Optional[bool] = None,
+) -> Iterator[dict]:
+    for name in _log_files(path):
+        for line in _read_lines(name):
+            entry = json.loads(line)
+            if "dropped" in entry or "break" in entry:
+                continue
+            if principal is not None and entry.get("principal") != principal:
+                continue
+            if since is not None and entry["ts"] < since:
+                continue
+            if until is not None and entry["ts"] > until:
+                continue
+            if allow is not None and entry["allow"] != allow:
+                continue
+            yield entry
+
+
+def verify(path: str = consts.AUDIT_LOG_PATH) -> tuple[bool, Optional[int]]:
+    """Checks sequence numbers and the hash chain; returns the first bad seq."""
+    prev, seq = None, None
+    for name in _log_files(path):
+        for line in _read_lines(name):
+            entry = json.loads(line)
+            if prev is not None and (entry["prev"] != prev or entry["seq"] != seq + 1):
+                return False, entry["seq"]
+            prev = hashlib.sha256(line.encode()).hexdigest()
+            seq = entry["seq"]
+    return True, None
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Query the auth daemon audit log")
+    parser.add_argument("--path", default=consts.AUDIT_LOG_PATH)
+    parser.add_argument("--principal", help="e.g. agent, uid:1000, tls:alice")
+    parser.add_argument("--since", type=float, help="unix timestamp")
+    parser.add_argument("--until", type=float, help="unix timestamp")
+    parser.add_argument("--verdict", choices=["allow", "deny"])
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        ok, seq = verify(args.path)
+        print("ok" if ok else f"chain broken at seq {seq}")
+        return 0 if ok else 1
+
+    allow = None if args.verdict is None else args.verdict == "allow"
+    for entry in query(args.path, args.principal, args.since, args.until, allow):
+        sys.stdout.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,108 @@
+import asyncio
+import base64
 import json
 import logging
 import os
-import selectors
+import re
 import socket
 import struct
+import time
+from typing import Optional
 
-from src import consts, runtime
+from src import consts
+from src.security.audit import AuditLog
+from src.security.credentials import AGENT_PRINCIPAL, principal
+from src.security.jsonscan import BodyTooLarge, FieldScanner
+from src.security.policy import DEFAULT_RULES, PolicyEngine
 
-sel = selectors.DefaultSelector()
+MAX_HEADER_SIZE = 64 * 1024
+MAX_BODY_SIZE = 16 * 1024 * 1024
+MAX_INSPECT_SIZE = 1024 * 1024
+B64_CHUNK_SIZE = 4 * 16 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+IDLE_TIMEOUT = 60
+
+_STRUCTURAL = re.compile(rb'[][{}"]')
+_STRING_END = re.compile(rb'["\\]')
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+_engine: Optional[PolicyEngine] = None
+_audit: Optional[AuditLog] = None
+# Inode of the socket this daemon bound; during an agent handoff the next
+# generation's daemon rebinds the path, and it must not be unlinked here.
+_socket_inode: Optional[int] = None
+
+
+class ProtocolError(Exception):
+
+    def __init__(self, status: int, reason: str) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class _JsonFramer:
+    """Finds where a bare JSON document ends as its bytes arrive.
+
+    Each byte is looked at once, and only brackets, quotes and escapes are
+    tracked, so the document is parsed a single time once it is complete.
+    """
+
+    def __init__(self) -> None:
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._size = 0
+
+    def feed(self, data: bytes) -> Optional[int]:
+        """Returns the end offset within ``data`` once the document closed."""
+        i, n = 0, len(data)
+        while i < n:
+            if self._escape:
+                self._escape = False
+                i += 1
+            elif self._in_string:
+                match = _STRING_END.search(data, i)
+                if match is None:
+                    break
+                i = match.end()
+                if match.group() == b'"':
+                    self._in_string = False
+                else:
+                    self._escape = True
+            else:
+                match = _STRUCTURAL.search(data, i)
+                if match is None:
+                    break
+                i = match.end()
+                c = match.group()
+                if c == b'"':
+                    self._in_string = True
+                elif c in (b"{", b"["):
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth <= 0:
+                        return i
+        self._size += n
+        if self._size > MAX_BODY_SIZE:
+            raise ProtocolError(413, "body too large")
+        return None
+
+
+def get_engine() -> PolicyEngine:
+    global _engine
+    if _engine is None:
+        _engine = PolicyEngine(DEFAULT_RULES, trusted=(AGENT_PRINCIPAL,))
+    return _engine
 
 
 def get_creds(conn):
@@ -18,75 +113,297 @@ def get_creds(conn):
     return pid, uid, gid
 
 
-def check(req, uid):
-    uri = (req.get("RequestUri") or req.get("uri") or "").lower()
-    if uid == runtime.agent_pid():
-        return {"allow": True, "reason": "trusted uid"}
-    for x in consts.DOCKER_FORBIDDEN_CMDS:
-        if x in uri:
-            return {"allow": False, "reason": f"forbidden: {x}"}
-    return {"allow": True, "reason": "ok"}
+def inspect_body(encoded: str, fields) -> dict:
+    if len(encoded) * 3 // 4 > MAX_INSPECT_SIZE + 2:
+        raise BodyTooLarge(f"body exceeds {MAX_INSPECT_SIZE} bytes")
+    scanner = FieldScanner(fields, max_size=MAX_INSPECT_SIZE)
+    for i in range(0, len(encoded), B64_CHUNK_SIZE):
+        scanner.feed(base64.b64decode(encoded[i : i + B64_CHUNK_SIZE], validate=True))
+    return scanner.close()
+
 
+def _request_uri(req) -> str:
+    return req.get("RequestURI") or req.get("RequestUri") or req.get("uri") or ""
 
-def handle(conn):
+
+def check(req, who):
+    uri = _request_uri(req)
+    method = req.get("RequestMethod") or req.get("method")
+    engine = get_engine()
+    body = None
+    if engine.needs_body(who, method, uri):
+        raw = req.get("RequestBody")
+        if isinstance(raw, dict):
+            body = raw
+        elif raw:
+            try:
+                body = inspect_body(raw, engine.body_fields)
+            except BodyTooLarge:
+                return {"allow": False, "reason": "request body too large"}
+            except ValueError:
+                return {"allow": False, "reason": "malformed request body"}
+    return engine.decide(who, method, uri, body)
+
+
+async def _read_body(reader: asyncio.StreamReader, length: int) -> bytes:
+    if length > MAX_BODY_SIZE:
+        raise ProtocolError(413, "body too large")
+    chunks = []
+    remaining = length
+    while remaining:
+        chunk = await asyncio.wait_for(
+            reader.read(min(remaining, READ_CHUNK_SIZE)), IDLE_TIMEOUT
+        )
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"".join(chunks), length)
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+async def _read_headers(
+    reader: asyncio.StreamReader, prefix: bytes = b""
+) -> Optional[bytes]:
     try:
-        pid, uid, gid = get_creds(conn)
-        data = conn.recv(16384)
-        if not data:
-            return
-        try:
-            req = json.loads(data.decode())
-        except:
-            conn.sendall(b'{"allow":false,"reason":"bad json"}')
-            return
-        res = check(req, uid)
-        conn.sendall(json.dumps(res).encode())
-        logging.info(
-            "uid=%s %s %s -> %s",
-            uid,
+        return prefix + await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not (prefix + e.partial).strip():
+            return None
+        raise
+    except asyncio.LimitOverrunError:
+        raise ProtocolError(431, "headers too large")
+
+
+def _parse_headers(raw: bytes) -> tuple[str, str, str, dict[str, str]]:
+    lines = raw.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise ProtocolError(400, "bad request line")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+def _keep_alive(version: str, headers: dict[str, str]) -> bool:
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+def _http_response(status: int, payload: dict, keep_alive: bool) -> bytes:
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    reason = HTTP_REASONS.get(status, "Error")
+    head = (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+def _legacy_response(payload: dict) -> bytes:
+    return json.dumps(payload).encode()
+
+
+def decide(req: dict, uid: Optional[int]) -> dict:
+    who = principal(req, uid)
+    res = check(req, who)
+    if _audit is not None:
+        _audit.record(
+            who,
             req.get("RequestMethod"),
-            req.get("RequestUri"),
+            _request_uri(req),
             res["allow"],
+            res["reason"],
         )
+    return res
+
+
+def plugin_activate(req: dict, uid: int) -> dict:
+    return {"Implements": ["authz"]}
+
+
+def authz_request(req: dict, uid: int) -> dict:
+    # The peer is dockerd: the caller is named by the request itself.
+    res = decide(req, None)
+    return {"Allow": res["allow"], "Msg": res["reason"]}
+
+
+def authz_response(req: dict, uid: int) -> dict:
+    return {"Allow": True}
+
+
+ROUTES = {
+    "/": decide,
+    "/Plugin.Activate": plugin_activate,
+    "/AuthZPlugin.AuthZReq": authz_request,
+    "/AuthZPlugin.AuthZRes": authz_response,
+}
+
+
+def dispatch(path: str, body: bytes, uid: int) -> tuple[int, dict]:
+    handler = ROUTES.get(path)
+    if handler is None:
+        return 404, {"Allow": False, "Err": f"unknown endpoint {path}"}
+    try:
+        req = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return 400, {"allow": False, "Allow": False, "reason": "bad json"}
+    if not isinstance(req, dict):
+        return 400, {"allow": False, "Allow": False, "reason": "bad json"}
+    return 200, handler(req, uid)
+
+
+def write_plugin_spec(path: str) -> None:
+    try:
+        os.makedirs(os.path.dirname(consts.DOCKER_PLUGIN_SPEC_PATH), exist_ok=True)
+        with open(consts.DOCKER_PLUGIN_SPEC_PATH, "w", encoding="utf-8") as f:
+            f.write(f"unix://{path}\n")
+    except OSError as e:
+        logging.error("Failed to write plugin spec: %s", e)
+
+
+async def _handle_legacy(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, uid: int, data: bytes
+) -> None:
+    framer = _JsonFramer()
+    chunks = []
+    end = framer.feed(data)
+    while end is None:
+        chunks.append(data)
+        data = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE), IDLE_TIMEOUT)
+        if not data:
+            writer.write(_legacy_response({"allow": False, "reason": "bad json"}))
+            return
+        end = framer.feed(data)
+    chunks.append(data[:end])
+    try:
+        req = json.loads(b"".join(chunks))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        req = None
+    if not isinstance(req, dict):
+        writer.write(_legacy_response({"allow": False, "reason": "bad json"}))
+        return
+    writer.write(_legacy_response(decide(req, uid)))
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    keep_alive = True
+    legacy = False
+    try:
+        pid, uid, gid = get_creds(writer.get_extra_info("socket"))
+        first = await asyncio.wait_for(reader.read(1), IDLE_TIMEOUT)
+        if not first:
+            return
+        legacy = first in (b"{", b"[")
+        if legacy:
+            await _handle_legacy(reader, writer, uid, first)
+            await writer.drain()
+            return
+
+        prefix = first
+        while keep_alive:
+            raw = await asyncio.wait_for(_read_headers(reader, prefix), IDLE_TIMEOUT)
+            prefix = b""
+            if raw is None:
+                return
+            method, target, version, headers = _parse_headers(raw)
+            keep_alive = _keep_alive(version, headers)
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                raise ProtocolError(400, "bad content-length")
+            body = await _read_body(reader, length)
+            status, payload = dispatch(target.split("?", 1)[0], body, uid)
+            writer.write(_http_response(status, payload, keep_alive))
+            await writer.drain()
+    except ProtocolError as e:
+        payload = {"allow": False, "reason": e.reason}
+        if legacy:
+            writer.write(_legacy_response(payload))
+        else:
+            writer.write(_http_response(e.status, payload, False))
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
     except Exception as e:
+        payload = {"allow": False, "reason": "error"}
         try:
-            conn.sendall(b'{"allow":false,"reason":"error"}')
-        except:
+            if legacy:
+                writer.write(_legacy_response(payload))
+            else:
+                writer.write(_http_response(500, payload, False))
+        except Exception:
             pass
         logging.error("%s", e)
     finally:
-        conn.close()
+        try:
+            await writer.drain()
+        except Exception:
+            pass
+        writer.close()
+
+
+async def serve(path: str = consts.KATAGUARD_SOCK_PATH) -> asyncio.AbstractServer:
+    if os.path.exists(path):
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    server = await asyncio.start_unix_server(
+        handle, path=path, limit=MAX_HEADER_SIZE, backlog=1024
+    )
+    os.chmod(path, 0o660)
+    global _socket_inode
+    _socket_inode = os.stat(path).st_ino
+    return server
 
 
-def accept(sock):
-    conn, _ = sock.accept()
-    conn.setblocking(False)
-    sel.register(conn, selectors.EVENT_READ, read)
+async def _run(path: str) -> None:
+    server = await serve(path)
+    async with server:
+        await server.serve_forever()
 
 
-def read(conn):
-    sel.unregister(conn)
-    handle(conn)
+def wait_auth_daemon(
+    path: str = consts.KATAGUARD_SOCK_PATH, timeout: float = 5.0
+) -> bool:
+    """Whether a daemon accepts connections on ``path`` within ``timeout``"""
+    deadline = time.monotonic() + timeout
+    while True:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+                return True
+            except OSError:
+                pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.02)
 
 
-def auth_daemon() -> None:
-    if os.path.exists(consts.KATAGUARD_SOCK_PATH):
-        os.unlink(consts.KATAGUARD_SOCK_PATH)
-    os.makedirs(os.path.dirname(consts.KATAGUARD_SOCK_PATH), exist_ok=True)
-    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    s.bind(consts.KATAGUARD_SOCK_PATH)
-    os.chmod(consts.KATAGUARD_SOCK_PATH, 0o660)
-    s.listen(100)
-    s.setblocking(False)
-    sel.register(s, selectors.EVENT_READ, accept)
+def auth_daemon(
+    path: str = consts.KATAGUARD_SOCK_PATH,
+    audit_path: Optional[str] = consts.AUDIT_LOG_PATH,
+) -> None:
+    global _audit
+    if path == consts.KATAGUARD_SOCK_PATH:
+        write_plugin_spec(path)
+    if audit_path:
+        _audit = AuditLog(audit_path).start()
     try:
-        while True:
-            for key, _ in sel.select():
-                key.data(key.fileobj)
+        asyncio.run(_run(path))
     except KeyboardInterrupt:
         pass
     finally:
-        sel.close()
-        s.close()
-        if os.path.exists(consts.KATAGUARD_SOCK_PATH):
-            os.unlink(consts.KATAGUARD_SOCK_PATH)
+        if _audit is not None:
+            _audit.stop()
+        try:
+            if os.stat(path).st_ino == _socket_inode:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,99 @@
+import hmac
+import json
+import os
+import secrets
+import shutil
+import tempfile
+from typing import Any, Optional
+
+# Under the AuthZ plugin protocol the caller is always dockerd itself, so the
+# agent proves who it is with a per-launch token in a request header. The
+# Docker CLI sends it from the config's HttpHeaders, the agent's own Engine
+# API clients add it themselves; dockerd forwards it in RequestHeaders.
+AGENT_TOKEN_HEADER = "X-Qudata-Agent-Token"
+AGENT_TOKEN_ENV = "QUDATA_AGENT_TOKEN"
+AGENT_PRINCIPAL = "agent"
+
+
+def agent_token() -> Optional[str]:
+    return os.environ.get(AGENT_TOKEN_ENV) or None
+
+
+def docker_headers() -> dict[str, str]:
+    token = agent_token()
+    return {AGENT_TOKEN_HEADER: token} if token else {}
+
+
+def _header(headers: Any, name: str) -> Optional[str]:
+    if not isinstance(headers, dict):
+        return None
+    name = name.lower()
+    for key, value in headers.items():
+        if isinstance(key, str) and key.lower() == name:
+            return value if isinstance(value, str) else None
+    return None
+
+
+def is_agent(headers: Any) -> bool:
+    token = agent_token()
+    value = _header(headers, AGENT_TOKEN_HEADER)
+    if not token or value is None:
+        return False
+    return hmac.compare_digest(value.encode(), token.encode())
+
+
+def principal(req: dict, uid: Optional[int] = None) -> str:
+    """Who made a Docker request, for the policy and the audit log.
+
+    ``uid`` is the SO_PEERCRED uid of a client that talks to the daemon
+    directly; under the plugin protocol it is dockerd's and is not passed.
+    """
+    if is_agent(req.get("RequestHeaders")):
+        return AGENT_PRINCIPAL
+    user = req.get("User")
+    if isinstance(user, str) and user:
+        method = req.get("UserAuthNMethod") or "user"
+        return f"{str(method).lower()}:{user}"
+    return f"uid:{uid}" if uid is not None else "anonymous"
+
+
+def install_agent_credential() -> str:
+    """Creates the launch token and a Docker CLI config that sends it.
+
+    The caller's Docker config (registry auths, credential helpers) is
+    copied so that only the header is added. Child processes inherit both
+    through the environment.
+
+    Returns:
+        the config directory, to be removed when the launcher exits
+    """
+    token = secrets.token_urlsafe(32)
+    source = os.environ.get("DOCKER_CONFIG") or os.path.expanduser("~/.docker")
+    try:
+        with open(os.path.join(source, "config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    if not isinstance(config, dict):
+        config = {}
+    headers = config.get("HttpHeaders")
+    config["HttpHeaders"] = {
+        **(headers if isinstance(headers, dict) else {}),
+        AGENT_TOKEN_HEADER: token,
+    }
+
+    directory = tempfile.mkdtemp(prefix="qudata-docker-")
+    try:
+        fd = os.open(
+            os.path.join(directory, "config.json"),
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+            0o600,
+        )
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    os.environ[AGENT_TOKEN_ENV] = token
+    os.environ["DOCKER_CONFIG"] = directory
+    return directory
@@ -0,0 +1,274 @@
+import json
+from typing import Any, Iterable, Optional
+
+_WHITESPACE = frozenset(b" \t\r\n")
+_LITERAL_END = frozenset(b" \t\r\n,]}")
+
+_OBJECT = 0
+_ARRAY = 1
+
+_EXPECT_KEY = 0
+_EXPECT_COLON = 1
+_EXPECT_VALUE = 2
+_EXPECT_NEXT = 3
+
+# Path segment for every element of an array, as in "Mounts[].Type".
+_ELEMENT = "[]"
+
+
+class ScanError(ValueError):
+    pass
+
+
+class BodyTooLarge(ScanError):
+    pass
+
+
+class _Frame:
+    __slots__ = ("kind", "path", "key", "state", "empty")
+
+    def __init__(self, kind: int, path: Optional[tuple[str, ...]]) -> None:
+        self.kind = kind
+        self.path = path
+        self.key: Optional[str] = None
+        self.state = _EXPECT_KEY if kind == _OBJECT else _EXPECT_VALUE
+        self.empty = True
+
+
+class FieldScanner:
+    """Incremental JSON reader that keeps only the requested dotted fields.
+
+    Chunks are fed as they arrive; no object tree is built for the rest of
+    the document. Scalars are kept as-is, objects and arrays are reduced to
+    whether they are non-empty. Keys match case-insensitively, the same way
+    Go's encoding/json (and therefore dockerd) decodes them.
+
+    A field like "Binds[]" or "Mounts[].Type" collects the scalar value of
+    every array element, in order, into a list.
+    """
+
+    def __init__(
+        self, fields: Iterable[str], max_size: int = 1024 * 1024, max_depth: int = 64
+    ) -> None:
+        self._names = {}
+        for name in fields:
+            parts = tuple(name.replace(_ELEMENT, "." + _ELEMENT).split("."))
+            self._names[tuple(part.lower() for part in parts)] = parts
+        self._wanted = set(self._names)
+        self._prefixes = {w[:i] for w in self._wanted for i in range(len(w) + 1)}
+        self._max_size = max_size
+        self._max_depth = max_depth
+        self._size = 0
+        self._stack: list[_Frame] = []
+        self._root_done = False
+
+        self._in_string = False
+        self._escape = False
+        self._capture: Optional[bytearray] = None
+        self._string_is_key = False
+        self._string_path: Optional[tuple[str, ...]] = None
+
+        self._literal: Optional[bytearray] = None
+        self._literal_path: Optional[tuple[str, ...]] = None
+
+        self.values: dict[tuple[str, ...], Any] = {}
+
+    def _value_path(self) -> Optional[tuple[str, ...]]:
+        if not self._stack:
+            return ()
+        frame = self._stack[-1]
+        if frame.path is None:
+            return None
+        if frame.kind == _ARRAY:
+            path = frame.path + (_ELEMENT,)
+        elif frame.key is None:
+            return None
+        else:
+            path = frame.path + (frame.key,)
+        return path if path in self._prefixes else None
+
+    def _begin_value(self) -> Optional[tuple[str, ...]]:
+        if not self._stack:
+            if self._root_done:
+                raise ScanError("trailing data after document")
+            return ()
+        frame = self._stack[-1]
+        if frame.state != _EXPECT_VALUE:
+            raise ScanError("unexpected value")
+        self._mark_non_empty(frame)
+        return self._value_path()
+
+    def _mark_non_empty(self, frame: _Frame) -> None:
+        if frame.empty:
+            frame.empty = False
+            if frame.path in self._wanted and _ELEMENT not in frame.path:
+                self.values[frame.path] = True
+
+    def _end_value(self) -> None:
+        if not self._stack:
+            self._root_done = True
+            return
+        self._stack[-1].state = _EXPECT_NEXT
+
+    def _store(self, path: Optional[tuple[str, ...]], value: Any) -> None:
+        if path is not None and path in self._wanted:
+            if _ELEMENT in path:
+                self.values.setdefault(path, []).append(value)
+            else:
+                self.values[path] = value
+
+    def _finish_string(self) -> None:
+        raw = self._capture
+        self._capture = None
+        if self._string_is_key:
+            frame = self._stack[-1]
+            frame.key = None if raw is None else json.loads(b'"' + raw + b'"').lower()
+            frame.state = _EXPECT_COLON
+            return
+        if raw is not None:
+            self._store(self._string_path, json.loads(b'"' + raw + b'"'))
+        self._end_value()
+
+    def _finish_literal(self) -> None:
+        raw = bytes(self._literal)
+        self._literal = None
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            raise ScanError(f"bad literal {raw[:32]!r}")
+        self._store(self._literal_path, value)
+        self._end_value()
+
+    def _scan_string(self, data: bytes, i: int) -> int:
+        n = len(data)
+        start = i
+        while i < n:
+            c = data[i]
+            if self._escape:
+                self._escape = False
+            elif c == 0x5C:  # backslash
+                self._escape = True
+            elif c == 0x22:  # quote
+                if self._capture is not None:
+                    self._capture += data[start:i]
+                self._in_string = False
+                self._finish_string()
+                return i + 1
+            else:
+                j = data.find(b'"', i)
+                k = data.find(b"\\", i)
+                stop = min(x for x in (j, k, n) if x >= 0)
+                i = stop
+                continue
+            i += 1
+        if self._capture is not None:
+            self._capture += data[start:i]
+        return i
+
+    def feed(self, data: bytes) -> None:
+        self._size += len(data)
+        if self._size > self._max_size:
+            raise BodyTooLarge(f"body exceeds {self._max_size} bytes")
+
+        i, n = 0, len(data)
+        while i < n:
+            if self._in_string:
+                i = self._scan_string(data, i)
+                continue
+
+            c = data[i]
+            if self._literal is not None:
+                if c in _LITERAL_END:
+                    self._finish_literal()
+                    continue
+                self._literal.append(c)
+                i += 1
+                continue
+
+            if c in _WHITESPACE:
+                i += 1
+                continue
+
+            frame = self._stack[-1] if self._stack else None
+
+            if c == 0x22:  # quote
+                if frame is not None and frame.state == _EXPECT_KEY:
+                    self._mark_non_empty(frame)
+                    self._string_is_key = True
+                    self._capture = bytearray() if frame.path is not None else None
+                else:
+                    path = self._begin_value()
+                    self._string_is_key = False
+                    self._string_path = path
+                    self._capture = bytearray() if path in self._wanted else None
+                self._in_string = True
+                i += 1
+            elif c in (0x7B, 0x5B):  # { [
+                path = self._begin_value()
+                if len(self._stack) >= self._max_depth:
+                    raise ScanError("document nested too deeply")
+                kind = _OBJECT if c == 0x7B else _ARRAY
+                self._stack.append(_Frame(kind, path))
+                if path in self._wanted and _ELEMENT not in path:
+                    self.values[path] = False
+                i += 1
+            elif c in (0x7D, 0x5D):  # } ]
+                kind = _OBJECT if c == 0x7D else _ARRAY
+                if frame is None or frame.kind != kind:
+                    raise ScanError("unbalanced brackets")
+                if frame.state != _EXPECT_NEXT and not frame.empty:
+                    raise ScanError("unexpected end of container")
+                self._stack.pop()
+                self._end_value()
+                i += 1
+            elif c == 0x3A:  # :
+                if frame is None or frame.state != _EXPECT_COLON:
+                    raise ScanError("unexpected ':'")
+                frame.state = _EXPECT_VALUE
+                i += 1
+            elif c == 0x2C:  # ,
+                if frame is None or frame.state != _EXPECT_NEXT:
+                    raise ScanError("unexpected ','")
+                frame.state = _EXPECT_KEY if frame.kind == _OBJECT else _EXPECT_VALUE
+                frame.key = None
+                i += 1
+            else:
+                self._literal_path = self._begin_value()
+                self._literal = bytearray()
+
+    def close(self) -> dict[str, Any]:
+        if self._literal is not None:
+            self._finish_literal()
+        if self._in_string or self._stack or not self._root_done:
+            raise ScanError("truncated document")
+        return self.result()
+
+    def result(self) -> dict[str, Any]:
+        body: dict[str, Any] = {}
+        for path, value in self.values.items():
+            if not path:
+                continue
+            path = self._names[path]
+            if _ELEMENT in path:
+                # One element per value, holding only this field.
+                i = path.index(_ELEMENT)
+                path, tail = path[:i], path[i + 1 :]
+                value = [_nest(tail, item) for item in value]
+            node = body
+            for part in path[:-1]:
+                node = node.setdefault(part, {})
+                if not isinstance(node, dict):
+                    break
+            else:
+                known = node.get(path[-1])
+                if isinstance(known, list) and isinstance(value, list):
+                    known.extend(value)
+                else:
+                    node[path[-1]] = value
+        return body
+
+
+def _nest(path: tuple[str, ...], value: Any) -> Any:
+    for part in reversed(path):
+        value = {part: value}
+    return value
@@ -0,0 +1,243 @@
+from dataclasses import dataclass, field
+from typing import Any, Final, Iterable, Optional
+
+from src import consts
+
+ANY: Final[object] = object()
+WILDCARD: Final[str] = "*"
+# In a body field name, "Mounts[].Type" is the Type of every Mounts element;
+# the rule matches if any element does.
+ELEMENT: Final[str] = "[]"
+
+
+@dataclass(frozen=True)
+class Prefix:
+    """Expected body value: a string starting with ``prefix``"""
+
+    prefix: str
+
+
+def field_parts(name: str) -> tuple[str, ...]:
+    return tuple(name.replace(ELEMENT, "." + ELEMENT).split("."))
+
+
+def _matches(value: Any, expected: Any) -> bool:
+    if isinstance(value, list):
+        return any(_matches(item, expected) for item in value)
+    if expected is ANY:
+        return bool(value)
+    if isinstance(expected, Prefix):
+        return isinstance(value, str) and value.startswith(expected.prefix)
+    return value == expected
+
+
+@dataclass(frozen=True)
+class Rule:
+    method: str
+    path: str
+    reason: str
+    body: dict[str, Any] = field(default_factory=dict)
+    # The body field names split once, not on every decision.
+    _fields: tuple[tuple[tuple[str, ...], Any], ...] = field(
+        init=False, repr=False, compare=False, default=()
+    )
+
+    def __post_init__(self) -> None:
+        fields = tuple((field_parts(name), v) for name, v in self.body.items())
+        object.__setattr__(self, "_fields", fields)
+
+    def matches_body(self, body: Optional[dict[str, Any]]) -> bool:
+        if not self._fields:
+            return True
+        if not body:
+            return False
+        for parts, expected in self._fields:
+            value = _lookup(body, parts)
+            if value is None or not _matches(value, expected):
+                return False
+        return True
+
+
+@dataclass
+class _Node:
+    children: dict[str, "_Node"] = field(default_factory=dict)
+    rules: dict[str, list[Rule]] = field(default_factory=dict)
+
+
+def _lookup(body: Any, parts: tuple[str, ...]) -> Any:
+    value: Any = body
+    for i, part in enumerate(parts):
+        if part == ELEMENT:
+            if not isinstance(value, list):
+                return None
+            return [_lookup(item, parts[i + 1 :]) for item in value]
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def lookup_field(body: dict[str, Any], name: str) -> Any:
+    return _lookup(body, field_parts(name))
+
+
+def _is_api_version(version: str) -> bool:
+    # v1.43 without the "v": digits separated by single dots.
+    return (
+        version.replace(".", "").isdigit()
+        and version[0] != "."
+        and version[-1] != "."
+        and ".." not in version
+    )
+
+
+def normalize_path(uri: str) -> str:
+    path = uri.partition("?")[0].lower()
+    if path.startswith("/v"):
+        end = path.find("/", 2)
+        if end > 2 and _is_api_version(path[2:end]):
+            path = path[end:]
+    if len(path) > 1 and path[-1] == "/":
+        path = path.rstrip("/")
+    return path or "/"
+
+
+def _segments(path: str) -> list[str]:
+    return [s for s in path.split("/") if s]
+
+
+def _template_segments(template: str) -> list[str]:
+    return [
+        WILDCARD if s.startswith("{") and s.endswith("}") else s.lower()
+        for s in _segments(template)
+    ]
+
+
+class PolicyEngine:
+
+    def __init__(
+        self,
+        rules: Iterable[Rule],
+        trusted: Iterable[str] = (),
+        cache_size: int = 4096,
+    ) -> None:
+        self._root = _Node()
+        self._trusted = frozenset(trusted)
+        self.body_fields: frozenset[str] = frozenset()
+        for rule in rules:
+            self._add(rule)
+        # The rules depend only on the method and the normalized path, so
+        # query strings, API versions and callers share one entry. Normalizing
+        # costs more than the lookup itself, so the raw path (query cut off)
+        # maps to the same entry and a hit does not normalize again.
+        self._cache: dict[tuple[str, str], tuple[Rule, ...]] = {}
+        self._raw: dict[tuple[Optional[str], str], tuple[Rule, ...]] = {}
+        self._cache_size = cache_size
+        self._misses = 0
+
+    def _add(self, rule: Rule) -> None:
+        node = self._root
+        for segment in _template_segments(rule.path):
+            node = node.children.setdefault(segment, _Node())
+        node.rules.setdefault(rule.method.upper(), []).append(rule)
+        if rule.body:
+            self.body_fields = self.body_fields | frozenset(rule.body)
+
+    def _match(
+        self, node: _Node, segments: list[str], i: int, method: str
+    ) -> list[Rule]:
+        if i == len(segments):
+            if method == WILDCARD:
+                return [rule for rules in node.rules.values() for rule in rules]
+            return node.rules.get(method, []) + node.rules.get(WILDCARD, [])
+        found = []
+        child = node.children.get(segments[i])
+        if child is not None:
+            found.extend(self._match(child, segments, i + 1, method))
+        child = node.children.get(WILDCARD)
+        if child is not None:
+            found.extend(self._match(child, segments, i + 1, method))
+        return found
+
+    def _remember(self, cache: dict, key: tuple, rules: tuple[Rule, ...]) -> None:
+        if not self._cache_size:
+            return
+        if len(cache) >= self._cache_size:
+            # Oldest first: dicts keep insertion order.
+            del cache[next(iter(cache))]
+        cache[key] = rules
+
+    def _rules(self, method: Optional[str], uri: str) -> tuple[Rule, ...]:
+        raw = (method, uri.partition("?")[0])
+        rules = self._raw.get(raw)
+        if rules is None:
+            key = ((method or WILDCARD).upper(), normalize_path(raw[1]))
+            rules = self._cache.get(key)
+            if rules is None:
+                self._misses += 1
+                rules = tuple(self._match(self._root, _segments(key[1]), 0, key[0]))
+                self._remember(self._cache, key, rules)
+            self._remember(self._raw, raw, rules)
+        return rules
+
+    def cache_info(self) -> dict[str, int]:
+        return {
+            "misses": self._misses,
+            "size": len(self._cache),
+            "raw_size": len(self._raw),
+            "maxsize": self._cache_size,
+        }
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+        self._raw.clear()
+
+    def needs_body(self, principal: str, method: str, uri: str) -> bool:
+        if principal in self._trusted:
+            return False
+        return any(rule.body for rule in self._rules(method, uri))
+
+    def decide(
+        self,
+        principal: str,
+        method: str,
+        uri: str,
+        body: Optional[dict[str, Any]] = None,
+    ) -> dict[str, Any]:
+        if principal in self._trusted:
+            return {"allow": True, "reason": f"trusted {principal}"}
+        for rule in self._rules(method, uri):
+            if rule.matches_body(body):
+                return {"allow": False, "reason": f"forbidden: {rule.reason}"}
+        return {"allow": True, "reason": "ok"}
+
+
+DEFAULT_RULES: Final[list[Rule]] = [
+    Rule(method, path, reason)
+    for method, path, reason in consts.DOCKER_FORBIDDEN_ROUTES
+] + [
+    Rule("POST", "/containers/create", "privileged", {"HostConfig.Privileged": True}),
+    Rule("POST", "/containers/create", "host pid", {"HostConfig.PidMode": "host"}),
+    Rule("POST", "/containers/create", "host ipc", {"HostConfig.IpcMode": "host"}),
+    Rule("POST", "/containers/create", "cap add", {"HostConfig.CapAdd": ANY}),
+    Rule("POST", "/containers/create", "devices", {"HostConfig.Devices": ANY}),
+    Rule(
+        "POST",
+        "/containers/create",
+        "device requests",
+        {"HostConfig.DeviceRequests": ANY},
+    ),
+    # -v /src:/dst; a named volume (name:/dst) does not start with "/".
+    Rule(
+        "POST",
+        "/containers/create",
+        "host mount",
+        {"HostConfig.Binds[]": Prefix("/")},
+    ),
+    Rule(
+        "POST",
+        "/containers/create",
+        "host mount",
+        {"HostConfig.Mounts[].Type": "bind"},
+    ),
+]
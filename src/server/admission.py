@@ -0,0 +1,263 @@
+import asyncio
+import fcntl
+import json
+import os
+import random
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+from src import consts, runtime
+from src.utils.xlogging import get_logger
+
+logger = get_logger(__name__)
+
+ADMISSION_DIR = Path("admission")
+ADMISSION_POLL_INTERVAL = 0.05
+
+# Never limited: the control plane relies on these to reach a busy host.
+RESERVED_PATHS = frozenset(
+    {
+        "/ping",
+        "/emergency",
+        "/metrics",
+        "/health/live",
+        "/health/ready",
+        "/health/deep",
+    }
+)
+
+
+class Rejected(Exception):
+
+    def __init__(self, status: int, lane: str, retry_after: int) -> None:
+        super().__init__(f"{lane}: rejected with {status}")
+        self.status = status
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+def classify(method: str, path: str, params: dict[str, Any]) -> Optional[str]:
+    if path in RESERVED_PATHS:
+        return None
+    if path == "/instances":
+        if method == "POST":
+            return "create"
+        if method in ("PUT", "PATCH", "DELETE"):
+            return "manage"
+        if method == "GET":
+            if str(params.get("logs", "")).lower() in ("true", "1", "yes", "on"):
+                return "logs"
+            # Only ASGI honours ?wait=; under gunicorn it is a plain poll.
+            if (
+                params.get("wait") not in (None, "", "0")
+                and runtime.server_mode() == "asgi"
+            ):
+                return "poll"
+        return None
+    if path == "/instances/logs" and method == "GET":
+        return "follow"
+    if path == "/ssh" and method in ("POST", "PUT", "DELETE"):
+        return "ssh"
+    if path == "/events" and method == "GET":
+        return "events"
+    return None
+
+
+def _try_lock(path: Path) -> Optional[int]:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+
+class SlotPool:
+    """Counting semaphore shared by all workers: one flock'ed file per slot.
+
+    The kernel drops the lock when a worker dies, so a killed gunicorn worker
+    never leaks capacity.
+    """
+
+    def __init__(self, name: str, size: int, directory: Path = ADMISSION_DIR):
+        self.name = name
+        self.size = size
+        self._paths = [directory / f"{name}.{i}.slot" for i in range(size)]
+
+    def try_acquire(self) -> Optional[int]:
+        if not self.size:
+            return None
+        offset = random.randrange(self.size)
+        for i in range(self.size):
+            fd = _try_lock(self._paths[(offset + i) % self.size])
+            if fd is not None:
+                return fd
+        return None
+
+    def in_use(self) -> int:
+        busy = 0
+        for path in self._paths:
+            fd = _try_lock(path)
+            if fd is None:
+                busy += 1
+            else:
+                os.close(fd)
+        return busy
+
+
+def _release(fd: Optional[int]) -> None:
+    if fd is not None:
+        os.close(fd)
+
+
+class Ticket:
+    __slots__ = ("lane", "seat", "slot", "queued", "deadline")
+
+    def __init__(self, lane: str, seat: Optional[int]) -> None:
+        self.lane = lane
+        self.seat: Optional[int] = seat
+        self.slot: Optional[int] = None
+        self.queued: Optional[int] = None
+        self.deadline = 0.0
+
+    @property
+    def admitted(self) -> bool:
+        return self.slot is not None
+
+    def release(self) -> None:
+        for fd in (self.slot, self.queued, self.seat):
+            _release(fd)
+        self.slot = self.queued = self.seat = None
+
+
+class Admission:
+
+    def __init__(
+        self,
+        seats: int = consts.ADMISSION_SEATS,
+        lanes: Optional[dict[str, tuple[int, int]]] = None,
+        max_wait: float = consts.ADMISSION_MAX_WAIT,
+        retry_after: int = consts.ADMISSION_RETRY_AFTER,
+        directory: Path = ADMISSION_DIR,
+        seatless: frozenset[str] = consts.ADMISSION_SEATLESS_LANES,
+    ) -> None:
+        lanes = consts.ADMISSION_LANES if lanes is None else lanes
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.seatless = seatless
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.seats = SlotPool("seats", seats, directory)
+        self.lanes = {
+            name: (
+                SlotPool(name, limit, directory),
+                SlotPool(f"{name}.queue", queue, directory),
+            )
+            for name, (limit, queue) in lanes.items()
+        }
+
+    def _begin(self, lane: str) -> Ticket:
+        seat = None
+        if lane not in self.seatless:
+            seat = self.seats.try_acquire()
+            if seat is None:
+                raise self._reject(503, lane)
+        ticket = Ticket(lane, seat)
+        running, queue = self.lanes[lane]
+        ticket.slot = running.try_acquire()
+        if ticket.admitted:
+            return ticket
+        ticket.queued = queue.try_acquire()
+        if ticket.queued is None:
+            ticket.release()
+            raise self._reject(429, lane)
+        ticket.deadline = time.monotonic() + self.max_wait
+        return ticket
+
+    def _poll(self, ticket: Ticket) -> bool:
+        ticket.slot = self.lanes[ticket.lane][0].try_acquire()
+        if ticket.admitted:
+            _release(ticket.queued)
+            ticket.queued = None
+            return True
+        if time.monotonic() >= ticket.deadline:
+            ticket.release()
+            raise self._reject(503, ticket.lane)
+        return False
+
+    def acquire(self, lane: str) -> Ticket:
+        ticket = self._begin(lane)
+        while not ticket.admitted and not self._poll(ticket):
+            time.sleep(ADMISSION_POLL_INTERVAL)
+        return ticket
+
+    async def acquire_async(self, lane: str) -> Ticket:
+        ticket = self._begin(lane)
+        while not ticket.admitted and not self._poll(ticket):
+            await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+        return ticket
+
+    def _reject(self, status: int, lane: str) -> Rejected:
+        self._count_rejection(lane, status)
+        return Rejected(status, lane, self.retry_after)
+
+    def _count_rejection(self, lane: str, status: int) -> None:
+        path = self.directory / "rejected.json"
+        try:
+            with open(path, "a+", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    counters = json.loads(f.read() or "{}")
+                except json.JSONDecodeError:
+                    counters = {}
+                key = f"{lane}.{status}"
+                counters[key] = counters.get(key, 0) + 1
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(counters))
+        except OSError as e:
+            logger.error(f"Failed to count admission rejection: {e}")
+
+    def snapshot(self) -> dict[str, Any]:
+        try:
+            rejected = json.loads((self.directory / "rejected.json").read_text())
+        except (OSError, json.JSONDecodeError):
+            rejected = {}
+        lanes = {}
+        for name, (running, queue) in self.lanes.items():
+            lanes[name] = {
+                "limit": running.size,
+                "active": running.in_use(),
+                "queue_size": queue.size,
+                "queued": queue.in_use(),
+                "rejected_429": rejected.get(f"{name}.429", 0),
+                "rejected_503": rejected.get(f"{name}.503", 0),
+            }
+        return {
+            "seats": {"limit": self.seats.size, "in_use": self.seats.in_use()},
+            "lanes": lanes,
+        }
+
+
+@lru_cache
+def get_admission() -> Admission:
+    return Admission()
+
+
+def release_after(stream, ticket: Ticket):
+    try:
+        yield from stream
+    finally:
+        ticket.release()
+
+
+async def release_after_async(stream, ticket: Ticket):
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        ticket.release()
@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from src.utils import startup
+
+startup.install()
+
+import falcon.asgi  # noqa: E402
+
+from src import consts  # noqa: E402
+from src.server.admission import get_admission  # noqa: E402
+from src.server.handoff import notify_ready  # noqa: E402
+from src.server.middlewares import (  # noqa: E402
+    AsyncAdmissionMiddleware,
+    AsyncJSONMiddleware,
+    AsyncTracingMiddleware,
+)
+from src.server.resources import (  # noqa: E402
+    AsyncEventsResource,
+    AsyncInstanceLogsResource,
+    HealthLiveResource,
+    ManageInstancesResource,
+    PingResource,
+)
+from src.server.server import ROUTES  # noqa: E402
+from src.storage.state import wait_for_state_change  # noqa: E402
+
+HTTP_METHODS = ("get", "post", "put", "patch", "delete", "head", "options")
+
+# Resources that never block are served directly on the event loop.
+INLINE_RESOURCES = (PingResource, HealthLiveResource)
+
+executor = ThreadPoolExecutor(
+    max_workers=consts.ASGI_EXECUTOR_WORKERS, thread_name_prefix="agent-blocking"
+)
+
+
+def _inline(responder: Callable) -> Callable:
+    async def on_request(req, resp, **kwargs) -> None:
+        responder(req, resp, **kwargs)
+
+    return on_request
+
+
+def _offloaded(responder: Callable) -> Callable:
+    async def on_request(req, resp, **kwargs) -> None:
+        loop = asyncio.get_running_loop()
+        # run_in_executor does not carry contextvars; copy them so spans
+        # opened in the worker thread attach to the request's trace.
+        context = contextvars.copy_context()
+        await loop.run_in_executor(
+            executor,
+            functools.partial(context.run, responder, req, resp, **kwargs),
+        )
+
+    return on_request
+
+
+class AsyncResource:
+    """Exposes a sync resource's responders as coroutines.
+
+    Blocking responders (docker, keyring, filesystem) run on the bounded
+    executor so that one slow call does not hold the event loop.
+    """
+
+    def __init__(self, resource: Any) -> None:
+        wrap = _inline if isinstance(resource, INLINE_RESOURCES) else _offloaded
+        for method in HTTP_METHODS:
+            responder = getattr(resource, f"on_{method}", None)
+            if responder is not None:
+                setattr(self, f"on_{method}", wrap(responder))
+
+
+class AsyncManageInstancesResource(AsyncResource):
+    """GET ?wait= waits for a state change on the event loop.
+
+    Only the answer runs on the executor, so waiting long-polls do not hold
+    its threads.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(ManageInstancesResource())
+        self._answer = self.__dict__.pop("on_get")
+
+    async def on_get(self, req, resp) -> None:
+        wait = req.get_param_as_float("wait", min_value=0)
+        if wait:
+            await wait_for_state_change(
+                req.get_param_as_int("since"), min(wait, consts.LONG_POLL_MAX_WAIT)
+            )
+        await self._answer(req, resp)
+
+
+# Routes with a native async implementation instead of the wrapped sync one.
+ASYNC_RESOURCES = {
+    "/events": AsyncEventsResource,
+    "/instances": AsyncManageInstancesResource,
+    "/instances/logs": AsyncInstanceLogsResource,
+}
+
+
+class ReadinessMiddleware:
+    """Tells the launcher this generation accepts requests (lifespan startup)."""
+
+    async def process_startup(self, scope: dict, event: dict) -> None:
+        startup.report("asgi server")
+        notify_ready()
+
+
+app = falcon.asgi.App()
+
+app.add_middleware(ReadinessMiddleware())
+app.add_middleware(AsyncTracingMiddleware())
+# Native async streams do not hold a worker thread.
+app.add_middleware(
+    AsyncAdmissionMiddleware(get_admission(), exempt=("events", "follow"))
+)
+app.add_middleware(AsyncJSONMiddleware())
+
+for path, resource in ROUTES:
+    native = ASYNC_RESOURCES.get(path)
+    app.add_route(path, native() if native else AsyncResource(resource()))
@@ -0,0 +1,17 @@
+from src.server.handoff import notify_ready
+from src.utils import startup
+
+startup.install()
+
+# The app is imported once in the master and shared copy-on-write by the
+# workers. Code upgrades start a new generation (SIGHUP to the launcher),
+# so there is no need for gunicorn's in-place reload.
+preload_app = True
+
+
+def when_ready(server) -> None:
+    startup.report("gunicorn master")
+
+
+def post_worker_init(worker) -> None:
+    notify_ready()
@@ -0,0 +1,124 @@
+import ctypes
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Optional
+
+from src import consts, runtime
+
+READY_FD_ENV = "QUDATA_READY_FD"
+
+_PR_SET_PDEATHSIG = 1
+
+
+def create_listener(port: int, host: str = "0.0.0.0") -> socket.socket:
+    """The launcher's listening socket, inherited by every server generation.
+
+    While no generation is accepting, connections wait in the backlog
+    instead of being refused.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(consts.LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def server_command(mode: str, listen_fd: int) -> list[str]:
+    if mode == "asgi":
+        return [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.server.asgi:app",
+            "--fd",
+            str(listen_fd),
+            "--workers",
+            "1",
+            "--no-access-log",
+        ]
+    return [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "-w",
+        str(consts.GUNICORN_WORKERS),
+        "-b",
+        f"fd://{listen_fd}",
+        "-c",
+        "python:src.server.gunicorn_conf",
+        "--chdir",
+        ".",
+        "src.server.server:app",
+    ]
+
+
+def expected_ready(mode: str) -> int:
+    return consts.GUNICORN_WORKERS if mode == "gunicorn" else 1
+
+
+def notify_ready() -> None:
+    """Called once per worker when it is about to accept requests."""
+    fd = os.environ.get(READY_FD_ENV)
+    if not fd:
+        return
+    try:
+        os.set_blocking(int(fd), False)
+        os.write(int(fd), b"r")
+    except (OSError, ValueError):
+        # Nobody is waiting any more (the launcher closed its end).
+        pass
+
+
+def _die_with_parent() -> Callable[[], None]:
+    libc = ctypes.CDLL(None, use_errno=True)
+
+    def preexec() -> None:
+        libc.prctl(_PR_SET_PDEATHSIG, signal.SIGTERM)
+
+    return preexec
+
+
+def run_server(listen_fd: int, ready_fd: Optional[int] = None) -> int:
+    """Runs one server generation on the inherited socket until it exits.
+
+    SIGTERM is forwarded so the server drains in-flight requests; if this
+    process is killed, the server gets SIGTERM from the kernel.
+    """
+    env = dict(os.environ)
+    pass_fds = [listen_fd]
+    if ready_fd is not None:
+        env[READY_FD_ENV] = str(ready_fd)
+        pass_fds.append(ready_fd)
+    server = subprocess.Popen(
+        server_command(runtime.server_mode(), listen_fd),
+        env=env,
+        pass_fds=pass_fds,
+        preexec_fn=_die_with_parent(),
+    )
+    signal.signal(signal.SIGTERM, lambda *_: server.send_signal(signal.SIGTERM))
+    return server.wait()
+
+
+def wait_ready(ready_fd: int, expected: int, timeout: float) -> int:
+    """Counts worker readiness notifications; returns how many arrived."""
+    deadline = time.monotonic() + timeout
+    ready = 0
+    try:
+        while ready < expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([ready_fd], [], [], remaining)[0]:
+                break
+            data = os.read(ready_fd, 64)
+            if not data:
+                # Every write end is closed: the generation died.
+                break
+            ready += len(data)
+    finally:
+        os.close(ready_fd)
+    return ready
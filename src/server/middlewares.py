@@ -1,9 +1,20 @@
 import json
+from typing import Optional
 
 import falcon
+import falcon.asgi
 
 from src import consts
+from src.server.admission import (
+    Admission,
+    Rejected,
+    classify,
+    release_after,
+    release_after_async,
+)
 from src.storage.secure import get_agent_secret
+from src.utils import tracing
+from src.utils.dto import dumps, loads
 
 
 class JSONMiddleware:
@@ -18,7 +29,8 @@ class JSONMiddleware:
             try:
                 body = req.bounded_stream.read()
                 if body:
-                    req.context["json"] = json.loads(body.decode("utf-8"))
+                    with tracing.span("json.parse", size=len(body)):
+                        req.context["json"] = loads(body)
                 else:
                     req.context["json"] = None
             except json.JSONDecodeError:
@@ -35,12 +47,8 @@ class JSONMiddleware:
         req_succeeded: bool,
     ):
         if "result" in resp.context:
-            resp.text = json.dumps(
-                resp.context["result"],
-                ensure_ascii=False,
-                indent=None,
-                separators=(",", ":"),
-            )
+            with tracing.span("json.dump"):
+                resp.text = dumps(resp.context["result"])
             resp.content_type = "application/json; charset=utf-8"
 
         if not req_succeeded and resp.status >= falcon.HTTP_400:
@@ -55,6 +63,97 @@ class JSONMiddleware:
                 resp.content_type = "application/json; charset=utf-8"
 
 
+class TracingMiddleware:
+    """Opens the root span of a request; registered first so it wraps the rest."""
+
+    def process_request(self, req: falcon.Request, resp: falcon.Response):
+        root = tracing.start_trace(
+            f"http {req.method} {req.path}",
+            {
+                "traceparent": req.get_header("traceparent"),
+                "x-trace-id": req.get_header(tracing.TRACE_HEADER),
+            },
+            method=req.method,
+            path=req.path,
+        )
+        req.context["trace"] = root.__enter__()
+
+    def process_response(
+        self,
+        req: falcon.Request,
+        resp: falcon.Response,
+        resource,
+        req_succeeded: bool,
+    ):
+        root = req.context.get("trace")
+        if not isinstance(root, tracing.Span):
+            return
+        root.attrs["status"] = resp.status
+        if resource is not None:
+            root.attrs["resource"] = type(resource).__name__
+        resp.set_header(tracing.TRACE_HEADER, root.trace_id)
+        if tracing.SERVER_TIMING:
+            resp.set_header("Server-Timing", tracing.server_timing(root))
+        root.__exit__(None, None, None)
+
+
+def _rejection_error(e: Rejected) -> falcon.HTTPError:
+    description = f"Too many concurrent '{e.lane}' requests, retry later."
+    if e.status == 429:
+        return falcon.HTTPTooManyRequests(
+            title="Too Many Requests",
+            description=description,
+            retry_after=e.retry_after,
+        )
+    return falcon.HTTPServiceUnavailable(
+        title="Service Unavailable",
+        description=description,
+        retry_after=e.retry_after,
+    )
+
+
+class AdmissionMiddleware:
+    """Caps concurrent expensive requests across all workers.
+
+    The ticket is held until the response is sent; for streamed bodies it is
+    released when the stream closes.
+    """
+
+    def __init__(self, admission: Admission, exempt: tuple[str, ...] = ()) -> None:
+        self._admission = admission
+        self._exempt = exempt
+
+    def _lane(self, req) -> Optional[str]:
+        lane = classify(req.method, req.path, req.params)
+        if lane in self._exempt or lane not in self._admission.lanes:
+            return None
+        return lane
+
+    def process_request(self, req: falcon.Request, resp: falcon.Response):
+        lane = self._lane(req)
+        if lane is None:
+            return
+        try:
+            req.context["admission"] = self._admission.acquire(lane)
+        except Rejected as e:
+            raise _rejection_error(e)
+
+    def process_response(
+        self,
+        req: falcon.Request,
+        resp: falcon.Response,
+        resource,
+        req_succeeded: bool,
+    ):
+        ticket = req.context.get("admission")
+        if ticket is None:
+            return
+        if resp.stream is not None:
+            resp.stream = release_after(resp.stream, ticket)
+        else:
+            ticket.release()
+
+
 class AuthMiddleware:
 
     def process_request(self, req: falcon.Request, resp: falcon.Response):
@@ -66,3 +165,80 @@ class AuthMiddleware:
             raise falcon.HTTPUnauthorized(
                 title="Unauthorized",
             )
+
+
+class AsyncJSONMiddleware(JSONMiddleware):
+
+    async def process_request(
+        self, req: falcon.asgi.Request, resp: falcon.asgi.Response
+    ):
+        if req.content_length in (None, 0):
+            req.context["json"] = None
+            return
+
+        content_type = (req.content_type or "").lower()
+        if "application/json" in content_type:
+            try:
+                body = await req.stream.read()
+                with tracing.span("json.parse", size=len(body)):
+                    req.context["json"] = loads(body) if body else None
+            except json.JSONDecodeError:
+                # TODO: log, but unreachable
+                pass
+        else:
+            req.context["json"] = None
+
+    async def process_response(
+        self,
+        req: falcon.asgi.Request,
+        resp: falcon.asgi.Response,
+        resource,
+        req_succeeded: bool,
+    ):
+        super().process_response(req, resp, resource, req_succeeded)
+
+
+class AsyncTracingMiddleware(TracingMiddleware):
+
+    async def process_request(
+        self, req: falcon.asgi.Request, resp: falcon.asgi.Response
+    ):
+        super().process_request(req, resp)
+
+    async def process_response(
+        self,
+        req: falcon.asgi.Request,
+        resp: falcon.asgi.Response,
+        resource,
+        req_succeeded: bool,
+    ):
+        super().process_response(req, resp, resource, req_succeeded)
+
+
+class AsyncAdmissionMiddleware(AdmissionMiddleware):
+
+    async def process_request(
+        self, req: falcon.asgi.Request, resp: falcon.asgi.Response
+    ):
+        lane = self._lane(req)
+        if lane is None:
+            return
+        try:
+            req.context["admission"] = await self._admission.acquire_async(lane)
+        except Rejected as e:
+            raise _rejection_error(e)
+
+    async def process_response(
+        self,
+        req: falcon.asgi.Request,
+        resp: falcon.asgi.Response,
+        resource,
+        req_succeeded: bool,
+    ):
+        ticket = req.context.get("admission")
+        if ticket is None:
+            return
+        if resp.stream is not None:
+            resp.stream = release_after_async(resp.stream, ticket)
+        else:
+            ticket.release()
@@ -1,20 +1,39 @@
+import asyncio
 import os
 import signal
 import threading
-from dataclasses import asdict
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
 
 import falcon
 from falcon import Request, Response
 
+from src import consts
+from src.server.admission import get_admission
 from src.server.models import CreateInstance, ManageInstance
-from src.service import instances
-from src.service.ssh_keys import add_ssh_pubkey
+from src.service import health, instances, logs, warm_pool
+from src.service.events import Subscriber, get_broker
+from src.service.guardian import heartbeat_metrics
+from src.service.live_metrics import live_metrics
+from src.service.ssh_keys import (
+    InvalidKey,
+    add_ssh_pubkey,
+    list_ssh_keys,
+    sync_ssh_keys,
+)
 from src.storage import state as state_manager
-from src.utils.dto import from_json
+from src.utils.dto import from_json, to_json
 from src.utils.xlogging import get_logger
 
 logger = get_logger(__name__)
 
+# Blocking follower reads of the async log streams.
+_log_readers = ThreadPoolExecutor(
+    max_workers=consts.ASGI_EXECUTOR_WORKERS, thread_name_prefix="agent-logs"
+)
+
 
 class PingResource:
 
@@ -23,40 +42,129 @@ class PingResource:
         resp.context["result"] = {"ok": True, "data": None}
 
 
+class HealthLiveResource:
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        resp.status = falcon.HTTP_200
+        resp.context["result"] = {"ok": True, "data": health.liveness()}
+
+
+class HealthReadyResource:
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        ready, checks = health.readiness()
+        resp.status = falcon.HTTP_200 if ready else falcon.HTTP_503
+        resp.context["result"] = {"ok": ready, "data": checks}
+
+
+class HealthDeepResource:
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        report = health.deep_health()
+        if report is None:
+            resp.status = falcon.HTTP_503
+            resp.context["result"] = {"ok": False, "data": {"status": "pending"}}
+            return
+        resp.status = falcon.HTTP_200 if report["ok"] else falcon.HTTP_503
+        resp.context["result"] = {"ok": report["ok"], "data": report}
+
+
 class AddSSHResource:
 
+    def on_get(self, req: Request, resp: Response) -> None:
+        resp.status = falcon.HTTP_200
+        resp.context["result"] = {"ok": True, "data": list_ssh_keys()}
+
     def on_post(self, req: Request, resp: Response) -> None:
         try:
             ssh_pubkey = req.context["json"]["ssh_pubkey"]
-            add_ssh_pubkey(ssh_pubkey)
+            if not add_ssh_pubkey(ssh_pubkey):
+                raise falcon.HTTPBadRequest(
+                    title="Invalid request",
+                    description="Invalid SSH public key.",
+                )
             resp.status = falcon.HTTP_200
             resp.context["result"] = {"ok": True, "data": None}
-        except (KeyError, TypeError):
+        except (KeyError, TypeError, AttributeError):
             raise falcon.HTTPBadRequest(
                 title="Invalid request",
                 description="Missing 'ssh_pubkey' field.",
             )
+        except falcon.HTTPError:
+            raise
         except Exception as e:
             logger.error(f"Failed to add SSH key: {e}")
             raise falcon.HTTPInternalServerError(
                 title="Internal Error",
-                description="Could not process SSH key.",
+                description="Could not save SSH key.",
+            )
+
+    def on_put(self, req: Request, resp: Response) -> None:
+        """Bulk sync: ``keys`` replaces the whole set, ``add``/``remove``
+        apply a diff; either way the file is written once."""
+        body = req.context.get("json")
+        if not isinstance(body, dict) or not {"keys", "add", "remove"} & set(body):
+            raise falcon.HTTPBadRequest(
+                title="Invalid request",
+                description="Expected 'keys' or 'add'/'remove' lists.",
+            )
+        try:
+            diff = sync_ssh_keys(
+                add=body.get("add") or (),
+                remove=body.get("remove") or (),
+                replace=body.get("keys"),
+            )
+            resp.status = falcon.HTTP_200
+            resp.context["result"] = {"ok": True, "data": diff}
+        except (InvalidKey, AttributeError, TypeError) as e:
+            raise falcon.HTTPBadRequest(title="Invalid request", description=str(e))
+        except Exception as e:
+            logger.error(f"Failed to sync SSH keys: {e}")
+            raise falcon.HTTPInternalServerError(
+                title="Internal Error",
+                description="Could not sync SSH keys.",
             )
 
 
 class ManageInstancesResource:
 
     def on_get(self, req: Request, resp: Response) -> None:
-        state = state_manager.get_current_state()
-        response_data = asdict(state)
+        # ?wait= is not honoured here: under gunicorn a long-poll would hold
+        # a sync worker, so it is a plain poll (a conditional GET still saves
+        # the body); under ASGI the wait is awaited before this runs.
+        with_logs = req.get_param_as_bool("logs")
+        with_stats = req.get_param_as_bool("stats")
+
+        version = state_manager.get_state_version()
+        resp.set_header("X-State-Version", str(version))
+        if not with_logs and not with_stats:
+            resp.etag = f'"{version}"'
+            if any(tag == str(version) for tag in req.if_none_match or ()):
+                resp.status = falcon.HTTP_304
+                return
 
-        if req.get_param_as_bool("logs") and state.container_id:
-            success, logs, err = instances.get_instance_logs(state.container_id)
+        state = state_manager.get_current_state()
+        response_data = to_json(state)
+
+        if with_logs and state.container_id:
+            success, logs, err = instances.get_instance_logs(
+                state.container_id,
+                tail=req.get_param_as_int("tail", min_value=0, default=100),
+                since=req.get_param_as_float("logs_since"),
+                until=req.get_param_as_float("logs_until"),
+                max_bytes=req.get_param_as_int("max_bytes", min_value=1),
+            )
             if success:
                 response_data["logs"] = logs
             else:
                 response_data["logs_error"] = err
 
+        if with_stats:
+            live = live_metrics()
+            response_data["stats"] = (
+                dict(live["system"], age_ms=live["age_ms"]) if live else None
+            )
+
         resp.status = falcon.HTTP_200
         resp.context["result"] = {"ok": True, "data": response_data}
 
@@ -131,3 +239,294 @@ class EmergencyResource:
             "ok": True,
             "message": "Emergency self-destruct sequence initiated.",
         }
+
+
+class InstanceHistoryResource:
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        instance_id = (
+            req.get_param("instance_id")
+            or state_manager.get_current_state().instance_id
+        )
+        if not instance_id:
+            raise falcon.HTTPBadRequest(
+                title="Invalid request",
+                description="Missing 'instance_id' and no active instance.",
+            )
+        history = state_manager.instance_history(
+            instance_id,
+            since=req.get_param_as_float("since"),
+            until=req.get_param_as_float("until"),
+            limit=req.get_param_as_int(
+                "limit",
+                min_value=1,
+                max_value=10_000,
+                default=state_manager.HISTORY_DEFAULT_LIMIT,
+            ),
+        )
+        resp.status = falcon.HTTP_200
+        resp.context["result"] = {
+            "ok": True,
+            "data": {"instance_id": instance_id, "history": history},
+        }
+
+
+class MetricsResource:
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        resp.status = falcon.HTTP_200
+        resp.context["result"] = {
+            "ok": True,
+            "data": {
+                "admission": get_admission().snapshot(),
+                "guardian": heartbeat_metrics(),
+                "live": live_metrics(),
+                "warm_pool": warm_pool.stats(),
+            },
+        }
+
+
+def _event_filters(req: Request) -> dict:
+    types = [
+        t.strip()
+        for value in req.get_param_as_list("types") or ()
+        for t in value.split(",")
+        if t.strip()
+    ]
+    buffer = req.get_param_as_int("buffer", min_value=1, max_value=4096)
+    filters = {"types": types or None}
+    if buffer:
+        filters["maxlen"] = buffer
+    return filters
+
+
+def _prepare_event_stream(resp: Response) -> None:
+    resp.status = falcon.HTTP_200
+    resp.content_type = "text/event-stream"
+    resp.set_header("Cache-Control", "no-cache")
+    resp.set_header("X-Accel-Buffering", "no")
+
+
+class EventsResource:
+    """Event streams are served under ASGI only.
+
+    A stream would hold one of the few gunicorn sync workers for its whole
+    life, so in that mode clients are told to come back later.
+    """
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        raise falcon.HTTPServiceUnavailable(
+            title="Event streams need the ASGI server",
+            description="Start the agent with QUDATA_SERVER_MODE=asgi.",
+            retry_after=consts.SYNC_STREAM_RETRY_AFTER,
+        )
+
+
+class AsyncEventsResource:
+
+    async def on_get(self, req: Request, resp: Response) -> None:
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        subscriber = get_broker().subscribe(
+            notify=lambda: loop.call_soon_threadsafe(ready.set), **_event_filters(req)
+        )
+        _prepare_event_stream(resp)
+        resp.stream = self._stream(subscriber, ready)
+
+    @staticmethod
+    async def _stream(subscriber: Subscriber, ready: asyncio.Event):
+        try:
+            yield b"retry: 1000\n\n"
+            while not subscriber.overflowed:
+                try:
+                    await asyncio.wait_for(ready.wait(), consts.SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                ready.clear()
+                frames = subscriber.drain()
+                if frames:
+                    yield b"".join(frames)
+        finally:
+            get_broker().unsubscribe(subscriber)
+
+
+class _LogStream:
+    """Framing (plain text or SSE) and optional gzip for a followed log."""
+
+    def __init__(
+        self, follower, container_id: str, follow: bool, sse: bool, gzip: bool
+    ) -> None:
+        self.follower = follower
+        self.container_id = container_id
+        self.follow = follow
+        self.sse = sse
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        self._last_output = time.monotonic()
+        self._next_running_check = 0.0
+        self._running = True
+
+    def _compress(self, data: bytes) -> bytes:
+        if self._compressor is None:
+            return data
+        # Sync flush so every chunk reaches the viewer without waiting for more.
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def start(self) -> bytes:
+        return self._compress(b"retry: 1000\n\n" if self.sse else b"")
+
+    def encode(self, chunk: bytes) -> bytes:
+        self._last_output = time.monotonic()
+        if not self.sse:
+            return self._compress(chunk)
+        # A lone CR ends an SSE line as well: no data line may contain one.
+        lines = chunk.rstrip(b"\r\n").splitlines() or [b""]
+        frame = b"".join(b"data: " + line + b"\n" for line in lines)
+        if self.follower.last_ts is not None:
+            frame = b"id: %d\n" % self.follower.last_ts + frame
+        return self._compress(frame + b"\n")
+
+    def idle(self) -> bytes:
+        if time.monotonic() - self._last_output < consts.SSE_HEARTBEAT_INTERVAL:
+            return b""
+        self._last_output = time.monotonic()
+        return self._compress(b": heartbeat\n\n" if self.sse else b"")
+
+    def should_continue(self) -> bool:
+        if not self.follow or self.follower.done:
+            return False
+        now = time.monotonic()
+        if now >= self._next_running_check:
+            self._next_running_check = now + consts.LOGS_RUNNING_CHECK_INTERVAL
+            self._running = logs.container_running(self.container_id)
+        return self._running
+
+    def finish(self) -> bytes:
+        return self._compressor.flush() if self._compressor is not None else b""
+
+    def close(self) -> None:
+        self.follower.close()
+
+
+def _accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether gzip has a non-zero q-value, given or through ``*``."""
+    weights = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = item.split(";")
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+
+def _open_log_stream(req: Request, resp: Response) -> _LogStream:
+    state = state_manager.get_current_state()
+    if not state.container_id:
+        raise falcon.HTTPNotFound(
+            title="Not Found", description="No container is running."
+        )
+
+    since = req.get_param_as_float("since")
+    since_ns = None if since is None else round(since * 1e6) * 1000
+    last_event_id = req.get_header("Last-Event-ID")
+    if last_event_id and last_event_id.isdigit():
+        since_ns = int(last_event_id) + 1
+    tail = req.get_param_as_int("tail", min_value=0, default=100)
+    sse = req.get_param("format") == "sse" or "text/event-stream" in (
+        req.get_header("Accept") or ""
+    )
+    gzip = _accepts_gzip(req.get_header("Accept-Encoding"))
+
+    try:
+        follower = logs.open_follower(state.container_id, since_ns, tail)
+    except Exception as e:
+        logger.error(f"Failed to open logs of {state.container_id[:12]}: {e}")
+        raise falcon.HTTPInternalServerError(
+            title="Internal Error", description="Could not open container logs."
+        )
+
+    if sse:
+        _prepare_event_stream(resp)
+    else:
+        resp.status = falcon.HTTP_200
+        resp.content_type = "text/plain; charset=utf-8"
+        resp.set_header("Cache-Control", "no-cache")
+        resp.set_header("X-Accel-Buffering", "no")
+    if gzip:
+        resp.set_header("Content-Encoding", "gzip")
+        resp.append_header("Vary", "Accept-Encoding")
+
+    follow = req.get_param_as_bool("follow", default=False)
+    return _LogStream(follower, state.container_id, follow, sse, gzip)
+
+
+class InstanceLogsResource:
+    """Logs are pulled from the follower only as fast as the client reads
+    them, so a slow viewer holds at most one block in memory.
+
+    Under gunicorn a followed log would hold one of the few sync workers,
+    like an event stream: ?follow=true is refused and the current logs are
+    served without following.
+    """
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        if req.get_param_as_bool("follow", default=False):
+            raise falcon.HTTPServiceUnavailable(
+                title="Following logs needs the ASGI server",
+                description="Start the agent with QUDATA_SERVER_MODE=asgi, "
+                "or read the logs without follow=true.",
+                retry_after=consts.SYNC_STREAM_RETRY_AFTER,
+            )
+        resp.stream = self._stream(_open_log_stream(req, resp))
+
+    @staticmethod
+    def _stream(stream: _LogStream):
+        try:
+            yield stream.start()
+            while chunk := stream.follower.read():
+                yield stream.encode(chunk)
+            yield stream.finish()
+        finally:
+            stream.close()
+
+
+class AsyncInstanceLogsResource:
+
+    async def on_get(self, req: Request, resp: Response) -> None:
+        loop = asyncio.get_running_loop()
+        stream = await loop.run_in_executor(_log_readers, _open_log_stream, req, resp)
+        resp.stream = self._stream(stream)
+
+    @staticmethod
+    async def _stream(stream: _LogStream):
+        pending: Optional[Future] = None
+        try:
+            yield stream.start()
+            while True:
+                pending = _log_readers.submit(stream.follower.read)
+                chunk = await asyncio.wrap_future(pending)
+                if chunk:
+                    yield stream.encode(chunk)
+                    continue
+                if not stream.should_continue():
+                    break
+                heartbeat = stream.idle()
+                if heartbeat:
+                    yield heartbeat
+                await asyncio.sleep(consts.LOGS_FOLLOW_POLL_INTERVAL)
+            yield stream.finish()
+        finally:
+            # A read still running after a disconnect returns within its
+            # timeout; the follower is closed once it has.
+            if pending is not None and not pending.done():
+                pending.add_done_callback(lambda _: stream.close())
+            else:
+                stream.close()
@@ -1,21 +1,48 @@
 from falcon import App
 
-from src.server.middlewares import AuthMiddleware, JSONMiddleware
+from src.server.admission import get_admission
+from src.server.middlewares import (
+    AdmissionMiddleware,
+    AuthMiddleware,
+    JSONMiddleware,
+    TracingMiddleware,
+)
 from src.server.resources import (
     AddSSHResource,
     EmergencyResource,
+    EventsResource,
+    HealthDeepResource,
+    HealthLiveResource,
+    HealthReadyResource,
+    InstanceHistoryResource,
+    InstanceLogsResource,
     ManageInstancesResource,
+    MetricsResource,
     PingResource,
     ShutdownResource,
 )
 
+ROUTES = [
+    ("/ping", PingResource),
+    ("/health/live", HealthLiveResource),
+    ("/health/ready", HealthReadyResource),
+    ("/health/deep", HealthDeepResource),
+    ("/ssh", AddSSHResource),
+    ("/instances", ManageInstancesResource),
+    ("/instances/logs", InstanceLogsResource),
+    ("/instances/history", InstanceHistoryResource),
+    ("/shutdown", ShutdownResource),
+    ("/emergency", EmergencyResource),
+    ("/events", EventsResource),
+    ("/metrics", MetricsResource),
+]
+
 app = App()
 
+app.add_middleware(TracingMiddleware())
+app.add_middleware(AdmissionMiddleware(get_admission()))
 app.add_middleware(JSONMiddleware())
 # app.add_middleware(AuthMiddleware())
 
-app.add_route("/ping", PingResource())
-app.add_route("/ssh", AddSSHResource())
-app.add_route("/instances", ManageInstancesResource())
-app.add_route("/shutdown", ShutdownResource())
-app.add_route("/emergency", EmergencyResource())
+for path, resource in ROUTES:
+    app.add_route(path, resource())
@@ -0,0 +1,29 @@
+"""Docker Engine API calls over the unix socket, without spawning the CLI"""
+
+import json
+from typing import Any, Optional
+
+from src import consts
+from src.security.credentials import docker_headers
+from src.service.logs import DOCKER_SOCK_PATH
+
+
+def list_containers(
+    filters: Optional[dict[str, list[str]]] = None,
+    sock_path: str = DOCKER_SOCK_PATH,
+    timeout: float = consts.RECOVERY_TIMEOUT,
+) -> list[dict[str, Any]]:
+    """The agent's containers (by default all with its label), stopped included"""
+    import httpx
+
+    params = {
+        "all": "1",
+        "filters": json.dumps(filters or {"label": [consts.CONTAINER_LABEL]}),
+    }
+    transport = httpx.HTTPTransport(uds=sock_path)
+    with httpx.Client(
+        transport=transport, timeout=timeout, headers=docker_headers()
+    ) as client:
+        response = client.get("http://docker/containers/json", params=params)
+        response.raise_for_status()
+    return response.json()
@@ -0,0 +1,150 @@
+"""Fan-out of agent events to subscribers (SSE)"""
+
+import json
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Optional
+
+import psutil
+
+from src.service.live_metrics import live_metrics
+from src.storage.events import JournalTail, next_event_id
+from src.utils.xlogging import get_logger
+
+logger = get_logger(__name__)
+
+POLL_INTERVAL = 0.2
+SAMPLE_INTERVAL = 5.0
+SUBSCRIBER_BUFFER = 256
+
+
+def encode_event(event: dict[str, Any]) -> bytes:
+    data = json.dumps(event["data"], separators=(",", ":"), ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n".encode()
+
+
+class Subscriber:
+
+    def __init__(
+        self,
+        types: Optional[Iterable[str]] = None,
+        maxlen: int = SUBSCRIBER_BUFFER,
+        notify: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.types = frozenset(types) if types else None
+        self.maxlen = maxlen
+        self.overflowed = False
+        self._buffer: deque[bytes] = deque()
+        self._ready = threading.Event()
+        self._notify = notify
+
+    def accepts(self, event_type: str) -> bool:
+        return self.types is None or event_type in self.types
+
+    def offer(self, frame: bytes) -> bool:
+        if len(self._buffer) >= self.maxlen:
+            self.overflowed = True
+            self._wake()
+            return False
+        self._buffer.append(frame)
+        self._wake()
+        return True
+
+    def _wake(self) -> None:
+        self._ready.set()
+        if self._notify is not None:
+            self._notify()
+
+    def wait(self, timeout: float) -> bool:
+        return self._ready.wait(timeout)
+
+    def drain(self) -> list[bytes]:
+        self._ready.clear()
+        frames = []
+        while self._buffer:
+            frames.append(self._buffer.popleft())
+        return frames
+
+
+class EventBroker:
+    """One thread per process tails the journal and hands frames to subscribers"""
+
+    def __init__(
+        self,
+        poll_interval: float = POLL_INTERVAL,
+        sample_interval: float = SAMPLE_INTERVAL,
+    ) -> None:
+        self.poll_interval = poll_interval
+        self.sample_interval = sample_interval
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._tail = JournalTail()
+
+    def subscribe(self, **kwargs) -> Subscriber:
+        subscriber = Subscriber(**kwargs)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def dispatch(self, event: dict[str, Any]) -> int:
+        frame = encode_event(event)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        delivered = 0
+        for subscriber in subscribers:
+            if not subscriber.accepts(event["type"]):
+                continue
+            if subscriber.offer(frame):
+                delivered += 1
+            else:
+                logger.warning("Dropping slow event subscriber")
+                self.unsubscribe(subscriber)
+        return delivered
+
+    def _sample(self) -> dict[str, Any]:
+        # The agent sampler's snapshot; without it (standalone server) sample here.
+        live = live_metrics()
+        if live:
+            data = {
+                "cpu_util": live["system"]["cpu_util"],
+                "ram_util": live["system"]["ram_util"],
+            }
+        else:
+            data = {
+                "cpu_util": psutil.cpu_percent(),
+                "ram_util": psutil.virtual_memory().percent,
+            }
+        return {
+            "id": next_event_id(),
+            "type": "sample",
+            "ts": time.time(),
+            "data": data,
+        }
+
+    def _run(self) -> None:
+        next_sample = time.monotonic()
+        while True:
+            try:
+                for event in self._tail.read_new():
+                    self.dispatch(event)
+                if self._subscribers and time.monotonic() >= next_sample:
+                    next_sample = time.monotonic() + self.sample_interval
+                    self.dispatch(self._sample())
+            except Exception as e:
+                logger.error(f"Event broker iteration failed: {e}")
+            time.sleep(self.poll_interval)
+
+
+@lru_cache
+def get_broker() -> EventBroker:
+    return EventBroker()
@@ -1,20 +1,23 @@
 import hashlib
 from functools import lru_cache
+from pathlib import Path
 
 from src.utils.system import run_command
 from src.utils.xlogging import get_logger
 
 logger = get_logger(__name__)
 
+MACHINE_ID_PATHS = (Path("/etc/machine-id"), Path("/var/lib/dbus/machine-id"))
 
-def _get_machine_id() -> str | None:
-    success, stdout, _ = run_command(["cat", "/etc/machine-id"])
-    if success and stdout:
-        return stdout.strip()
 
-    success, stdout, _ = run_command(["cat", "/var/lib/dbus/machine-id"])
-    if success and stdout:
-        return stdout.strip()
+def _get_machine_id() -> str | None:
+    for path in MACHINE_ID_PATHS:
+        try:
+            machine_id = path.read_text().strip()
+        except OSError:
+            continue
+        if machine_id:
+            return machine_id
 
     success, stdout, _ = run_command(["dmidecode", "-s", "baseboard-serial-number"])
     if success and stdout and "serial" in stdout.lower():
@@ -0,0 +1,330 @@
+"""Agent watchdog: a heartbeat in shared memory"""
+
+import mmap
+import os
+import select
+import struct
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from src import consts
+
+if TYPE_CHECKING:
+    from src.utils.scheduler import PeriodicTask, Scheduler
+
+HEARTBEAT_ENV = "QUDATA_HEARTBEAT_PATH"
+
+# beats, last_beat_ns, last_detect_latency_ns, max_beat_gap_ns,
+# agent_pid, guardian_pid, agent_state, hangs, exits, stalls
+_LAYOUT = struct.Struct("<QQQQIIIIII")
+_SIZE = 64
+_BEATS, _LAST_BEAT, _LATENCY, _MAX_GAP = 0, 8, 16, 24
+_AGENT_PID, _GUARDIAN_PID, _AGENT_STATE, _HANGS, _EXITS = 32, 36, 40, 44, 48
+_STALLS = 52
+
+AGENT_STARTING, AGENT_RUNNING, AGENT_STOPPED, AGENT_FAILED = range(4)
+_STATE_NAMES = ("starting", "running", "stopped", "failed")
+
+
+class Heartbeat:
+    """
+    Segment shared by the launcher, the agent and the guardian
+
+    Every field has one writer: the agent writes the beat counter and time,
+    the guardian its own metrics. The eventfd wakes the guardian on every
+    beat. Inherited across fork.
+    """
+
+    def __init__(self, path: str, eventfd: Optional[int] = None) -> None:
+        self.path = path
+        self.eventfd = eventfd
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self._mem = mmap.mmap(fd, _SIZE)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def create(cls) -> "Heartbeat":
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, path = tempfile.mkstemp(prefix="qudata-heartbeat-", dir=directory)
+        try:
+            os.ftruncate(fd, _SIZE)
+        finally:
+            os.close(fd)
+        return cls(path, os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC))
+
+    def _get(self, offset: int, fmt: str = "Q") -> int:
+        return struct.unpack_from(f"<{fmt}", self._mem, offset)[0]
+
+    def _set(self, offset: int, value: int, fmt: str = "Q") -> None:
+        struct.pack_into(f"<{fmt}", self._mem, offset, value)
+
+    def register_agent(self, pid: int) -> None:
+        """The launcher names the agent the guardian watches"""
+        self._set(_AGENT_STATE, AGENT_STARTING, "I")
+        self._set(_AGENT_PID, pid, "I")
+
+    def beat(self) -> None:
+        self._set(_LAST_BEAT, time.monotonic_ns())
+        self._set(_BEATS, self._get(_BEATS) + 1)
+        if self.eventfd is not None:
+            try:
+                os.eventfd_write(self.eventfd, 1)
+            except BlockingIOError:
+                pass
+
+    def set_agent_state(self, state: int) -> None:
+        # A draining generation must not overwrite the current one's state.
+        if self.agent_pid == os.getpid():
+            self._set(_AGENT_STATE, state, "I")
+
+    def register_guardian(self, pid: int) -> None:
+        self._set(_GUARDIAN_PID, pid, "I")
+
+    @property
+    def beats(self) -> int:
+        return self._get(_BEATS)
+
+    @property
+    def last_beat_ns(self) -> int:
+        return self._get(_LAST_BEAT)
+
+    @property
+    def agent_pid(self) -> int:
+        return self._get(_AGENT_PID, "I")
+
+    @property
+    def agent_state(self) -> int:
+        return self._get(_AGENT_STATE, "I")
+
+    @property
+    def guardian_pid(self) -> int:
+        return self._get(_GUARDIAN_PID, "I")
+
+    def snapshot(self) -> dict[str, Any]:
+        (
+            beats,
+            last_beat,
+            latency,
+            max_gap,
+            agent_pid,
+            guardian_pid,
+            state,
+            hangs,
+            exits,
+            stalls,
+        ) = _LAYOUT.unpack_from(self._mem)
+        return {
+            "beats": beats,
+            "since_last_beat_ms": (
+                round((time.monotonic_ns() - last_beat) / 1e6, 3) if beats else None
+            ),
+            "agent_pid": agent_pid,
+            "agent_state": _STATE_NAMES[state] if state < len(_STATE_NAMES) else state,
+            "guardian_pid": guardian_pid,
+            "stalls_detected": stalls,
+            "hangs_detected": hangs,
+            "exits_detected": exits,
+            "last_detect_latency_ms": round(latency / 1e6, 3),
+            "max_beat_gap_ms": round(max_gap / 1e6, 3),
+        }
+
+    def close(self) -> None:
+        self._mem.close()
+
+    def unlink(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _pidfd(pid: int) -> Optional[int]:
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        raise
+    except OSError:
+        # No pidfd in this kernel: the caller polls _alive on a timer.
+        return None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # "pid (comm) S ...": a zombie is already dead.
+            return f.read().rsplit(b")", 1)[1].split()[0] != b"Z"
+    except (OSError, IndexError):
+        return False
+
+
+def start_agent_heartbeat(
+    heartbeat: Heartbeat,
+    on_guardian_lost: Callable[[], None],
+    scheduler: "Scheduler",
+    interval: float = consts.GUARDIAN_BEAT_INTERVAL,
+) -> "PeriodicTask":
+    """Beats on the scheduler while the guardian is alive"""
+    guardian_pid = heartbeat.guardian_pid
+    guardian_fd = _pidfd(guardian_pid) if guardian_pid else None
+    lost = False
+
+    def guardian_gone() -> bool:
+        if guardian_fd is not None:
+            return bool(select.select([guardian_fd], [], [], 0)[0])
+        return bool(guardian_pid) and not _alive(guardian_pid)
+
+    def pulse() -> None:
+        nonlocal lost
+        if lost:
+            return
+        heartbeat.beat()
+        if guardian_gone():
+            lost = True
+            on_guardian_lost()
+
+    return scheduler.add("guardian-heartbeat", pulse, interval, deadline=interval)
+
+
+def watch(
+    heartbeat: Heartbeat,
+    parent_pid: int,
+    on_failure: Callable[[str], None],
+    deadline: float = consts.GUARDIAN_DEADLINE,
+    restart_grace: float = consts.GUARDIAN_RESTART_GRACE,
+    interval: float = consts.GUARDIAN_BEAT_INTERVAL,
+    hang_timeout: float = consts.GUARDIAN_HANG_TIMEOUT,
+) -> str:
+    """
+    Guardian loop: waits on the beat eventfd and the agent/launcher pidfds
+
+    No beat for longer than ``deadline`` is counted as a stall; a hang, which
+    calls ``on_failure``, is no beat for ``hang_timeout``. Until its first
+    beat (imports, recovery) a new agent has ``restart_grace``. An exit is
+    the agent's pidfd becoming readable. If the launcher does not start a
+    new agent within ``restart_grace``, ``on_failure`` is called.
+
+    Returns:
+        why the loop ended
+    """
+    heartbeat.register_guardian(os.getpid())
+    deadline_ns = int(deadline * 1e9)
+    hang_ns = max(int(hang_timeout * 1e9), deadline_ns)
+    grace_ns = int(restart_grace * 1e9)
+
+    poller = select.poll()
+    if heartbeat.eventfd is not None:
+        poller.register(heartbeat.eventfd, select.POLLIN)
+    parent_fd = _pidfd(parent_pid)
+    if parent_fd is not None:
+        poller.register(parent_fd, select.POLLIN)
+    polling = heartbeat.eventfd is None or parent_fd is None
+
+    agent_pid, agent_fd, exited_pid = 0, None, 0
+    booting = stalled = False
+    beats, last_beat = heartbeat.beats, heartbeat.last_beat_ns
+    seen_at = time.monotonic_ns()
+    lost_at: Optional[int] = seen_at
+
+    def detected(counter: int, now: int) -> None:
+        heartbeat._set(_LATENCY, now - heartbeat.last_beat_ns)
+        heartbeat._set(counter, heartbeat._get(counter, "I") + 1, "I")
+
+    while True:
+        now = time.monotonic_ns()
+        if agent_pid:
+            if booting:
+                timeout_ns = seen_at + grace_ns - now
+            else:
+                timeout_ns = seen_at + (hang_ns if stalled else deadline_ns) - now
+        else:
+            timeout_ns = lost_at + grace_ns - now
+        if polling or (agent_pid and agent_fd is None):
+            timeout_ns = min(timeout_ns, int(interval * 1e9))
+        ready = {fd for fd, _ in poller.poll(max(0, timeout_ns) // 1_000_000 + 1)}
+        now = time.monotonic_ns()
+
+        if heartbeat.eventfd in ready:
+            try:
+                os.eventfd_read(heartbeat.eventfd)
+            except BlockingIOError:
+                pass
+        if parent_fd is not None:
+            if parent_fd in ready:
+                return "launcher exited"
+        elif not _alive(parent_pid):
+            return "launcher exited"
+
+        registered = heartbeat.agent_pid
+        if registered and registered not in (agent_pid, exited_pid):
+            # Handoff or restart: the launcher made another agent current.
+            if agent_fd is not None:
+                poller.unregister(agent_fd)
+                os.close(agent_fd)
+            try:
+                agent_fd = _pidfd(registered)
+            except ProcessLookupError:
+                registered, agent_fd = 0, None
+            if registered:
+                agent_pid, lost_at, seen_at = registered, None, now
+                booting = True
+                # The pause across a restart is not a beat gap.
+                beats, last_beat = heartbeat.beats, heartbeat.last_beat_ns
+                if agent_fd is not None:
+                    poller.register(agent_fd, select.POLLIN)
+                ready.discard(agent_fd)
+
+        if agent_pid and (
+            agent_fd in ready if agent_fd is not None else not _alive(agent_pid)
+        ):
+            if agent_fd is not None:
+                poller.unregister(agent_fd)
+                os.close(agent_fd)
+            exited_pid, agent_pid, agent_fd, lost_at = agent_pid, 0, None, now
+            if heartbeat.agent_state == AGENT_FAILED:
+                return "agent failed"
+            detected(_EXITS, now)
+            if grace_ns <= 0:
+                on_failure("agent exited")
+                return "agent exited"
+
+        count = heartbeat.beats
+        if count != beats:
+            beat_at = heartbeat.last_beat_ns
+            if beats and agent_pid and beat_at - last_beat > heartbeat._get(_MAX_GAP):
+                heartbeat._set(_MAX_GAP, beat_at - last_beat)
+            beats, last_beat, seen_at = count, beat_at, now
+            booting = stalled = False
+        elif agent_pid and now - seen_at >= (grace_ns if booting else hang_ns):
+            detected(_HANGS, now)
+            on_failure("agent unresponsive")
+            return "agent unresponsive"
+        elif agent_pid and not booting and not stalled:
+            if now - seen_at >= deadline_ns:
+                stalled = True
+                detected(_STALLS, now)
+
+        if not agent_pid and now - lost_at >= grace_ns:
+            on_failure("agent exited and was not restarted")
+            return "agent exited and was not restarted"
+
+
+_attached: Optional[Heartbeat] = None
+
+
+def heartbeat_metrics() -> Optional[dict[str, Any]]:
+    """Guardian metrics for the API server processes (path from the env)"""
+    global _attached
+    path = os.environ.get(HEARTBEAT_ENV)
+    if not path:
+        return None
+    if _attached is None or _attached.path != path:
+        try:
+            _attached = Heartbeat(path)
+        except OSError as e:
+            print(f"WARNING: heartbeat segment unavailable: {e}", file=sys.stderr)
+            return None
+    return _attached.snapshot()
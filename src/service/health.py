@@ -1,15 +1,38 @@
-"""Проверка и восстановление состояния агента"""
+"""Agent health checks and state recovery"""
 
-from src.service.instances import check_container_exists
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from src import consts
+from src.service.guardian import heartbeat_metrics
+from src.service.instances import STORAGE_PATH, check_container_exists
+from src.service.logs import DOCKER_SOCK_PATH
+from src.service.system_check import check_command, check_docker_nvidia
 from src.storage.state import clear_state, get_current_state, save_state
 from src.utils.system import run_command
 from src.utils.xlogging import get_logger
 
+if TYPE_CHECKING:
+    from src.utils.scheduler import PeriodicTask, Scheduler
+
 logger = get_logger(__name__)
 
+HEALTH_FILE_PATH = Path("health.json")
+
+_started = time.monotonic()
+_ready_lock = threading.Lock()
+_ready_cache: Optional[tuple[float, bool, dict[str, Any]]] = None
+
 
 def sync_state_with_docker() -> None:
-    """Синхронизирует состояние агента с реальным состоянием Docker"""
+    """Syncs the agent's state with the actual Docker state"""
     state = get_current_state()
     
     if state.status == "destroyed":
@@ -21,7 +44,7 @@ def sync_state_with_docker() -> None:
         clear_state()
         return
     
-    # Проверяем существование контейнера
+    # Check that the container exists
     if not check_container_exists(state.container_id):
         logger.warning(
             f"Container {state.container_id[:12]} in state but not found in Docker, "
@@ -30,7 +53,7 @@ def sync_state_with_docker() -> None:
         clear_state()
         return
     
-    # Проверяем статус контейнера в Docker
+    # Check the container's status in Docker
     success, output, _ = run_command(
         ["docker", "inspect", "--format", "{{.State.Status}}", state.container_id]
     )
@@ -39,7 +62,7 @@ def sync_state_with_docker() -> None:
         docker_status = output.strip().lower()
         logger.info(f"Container {state.container_id[:12]} Docker status: {docker_status}")
         
-        # Синхронизируем статус
+        # Sync the status
         if docker_status == "running" and state.status != "running":
             logger.info(f"Updating state from '{state.status}' to 'running'")
             state.status = "running"
@@ -57,10 +80,163 @@ def sync_state_with_docker() -> None:
 
 
 def check_docker_running() -> bool:
-    """Проверяет, что Docker daemon запущен"""
+    """Checks that the Docker daemon is running"""
     success, _, _ = run_command(["docker", "info"])
     if not success:
         logger.error("Docker daemon is not running or not accessible")
         return False
     return True
 
+
+def liveness() -> dict[str, Any]:
+    """The process only: if it answers, it is alive"""
+    return {"pid": os.getpid(), "uptime": round(time.monotonic() - _started, 3)}
+
+
+def _docker_ping() -> tuple[bool, str]:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(consts.HEALTH_DOCKER_TIMEOUT)
+            sock.connect(DOCKER_SOCK_PATH)
+            sock.sendall(b"GET /_ping HTTP/1.0\r\nHost: docker\r\n\r\n")
+            status_line = sock.recv(256).split(b"\r\n", 1)[0].decode(errors="replace")
+    except OSError as e:
+        return False, f"{DOCKER_SOCK_PATH}: {e}"
+    return " 200 " in f"{status_line} ", status_line
+
+
+def _state_consistent() -> tuple[bool, str]:
+    state = get_current_state()
+    if state.status != "destroyed" and not state.container_id:
+        return False, f"status '{state.status}' without a container"
+    return True, state.status
+
+
+def _agent_running() -> tuple[Optional[bool], str]:
+    guardian = heartbeat_metrics()
+    if guardian is None:
+        # The server runs without the launcher.
+        return None, "no heartbeat segment"
+    return guardian["agent_state"] == "running", guardian["agent_state"]
+
+
+def _result(check: Callable[[], tuple[Optional[bool], str]]) -> dict[str, Any]:
+    started = time.monotonic()
+    try:
+        ok, detail = check()
+    except Exception as e:
+        ok, detail = False, f"{type(e).__name__}: {e}"
+    return {
+        "ok": ok,
+        "detail": detail,
+        "checked_at": time.time(),
+        "duration_ms": round((time.monotonic() - started) * 1000, 3),
+    }
+
+
+READY_CHECKS = {
+    "docker": _docker_ping,
+    "state": _state_consistent,
+    "agent": _agent_running,
+}
+
+
+def readiness() -> tuple[bool, dict[str, Any]]:
+    """Docker, state and agent; the result is cached for HEALTH_READY_TTL"""
+    global _ready_cache
+    with _ready_lock:
+        now = time.monotonic()
+        if _ready_cache is None or now - _ready_cache[0] >= consts.HEALTH_READY_TTL:
+            checks = {name: _result(check) for name, check in READY_CHECKS.items()}
+            ready = all(c["ok"] is not False for c in checks.values())
+            _ready_cache = (now, ready, checks)
+        return _ready_cache[1], _ready_cache[2]
+
+
+def _docker_info() -> tuple[bool, str]:
+    success, output, err = run_command(
+        ["docker", "info", "--format", "{{.ServerVersion}}"]
+    )
+    return success, output if success else err
+
+
+def _nvidia_driver() -> tuple[bool, str]:
+    if not check_command("nvidia-smi"):
+        return False, "nvidia-smi not found"
+    success, output, err = run_command(
+        ["nvidia-smi", "--query-gpu=name,driver_version", "--format=csv,noheader"]
+    )
+    return success, output if success else err
+
+
+def _gpu_container() -> tuple[Optional[bool], str]:
+    if not (check_command("docker") and check_command("nvidia-smi")):
+        return None, "skipped: no docker or NVIDIA driver"
+    if check_docker_nvidia():
+        return True, consts.GPU_CHECK_IMAGE
+    return False, f"nvidia-smi failed in {consts.GPU_CHECK_IMAGE}"
+
+
+def _disk() -> tuple[bool, str]:
+    path = STORAGE_PATH if STORAGE_PATH.exists() else Path(".")
+    usage = shutil.disk_usage(path)
+    free = usage.free / usage.total * 100
+    return (
+        free >= consts.HEALTH_MIN_FREE_DISK,
+        f"{free:.1f}% free ({usage.free // 2**30} GiB) on {path.resolve()}",
+    )
+
+
+DEEP_CHECKS = {
+    "docker_info": _docker_info,
+    "nvidia_driver": _nvidia_driver,
+    "gpu_container": _gpu_container,
+    "disk": _disk,
+}
+
+
+def run_deep_checks() -> dict[str, Any]:
+    """Expensive checks; the result goes to HEALTH_FILE_PATH for all workers"""
+    started = time.monotonic()
+    checks = {name: _result(check) for name, check in DEEP_CHECKS.items()}
+    report = {
+        "ok": all(c["ok"] is not False for c in checks.values()),
+        "checked_at": time.time(),
+        "duration_ms": round((time.monotonic() - started) * 1000, 3),
+        "checks": checks,
+    }
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{HEALTH_FILE_PATH.name}.", dir=HEALTH_FILE_PATH.parent
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        os.replace(tmp_path, HEALTH_FILE_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    if not report["ok"]:
+        failed = [name for name, c in checks.items() if c["ok"] is False]
+        logger.warning(f"Deep health checks failed: {', '.join(failed)}")
+    return report
+
+
+def deep_health() -> Optional[dict[str, Any]]:
+    """The latest run_deep_checks result, without running the checks"""
+    try:
+        with open(HEALTH_FILE_PATH, encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    report["age"] = round(time.time() - report["checked_at"], 3)
+    return report
+
+
+def start_deep_checks(scheduler: "Scheduler") -> "PeriodicTask":
+    return scheduler.add(
+        "health-deep",
+        run_deep_checks,
+        consts.HEALTH_DEEP_INTERVAL,
+        deadline=consts.HEALTH_DEEP_DEADLINE,
+        delay=consts.HEALTH_DEEP_DELAY,
+    )
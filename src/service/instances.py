@@ -1,20 +1,36 @@
+import json
 import os
 import secrets
+import threading
 import time
 import uuid
-from dataclasses import asdict
 from pathlib import Path
 
+from src import consts
 from src.client.models import Incident, IncidentType
-from src.client.qudata import QudataClient
 from src.server.models import (
     CreateInstance,
     InstanceAction,
     InstanceCreated,
     ManageInstance,
 )
+from src.service import warm_pool
 from src.service.fingerprint import get_fingerprint
-from src.storage.state import InstanceState, clear_state, get_current_state, save_state
+from src.service.logs import LogQuery, read_logs
+from src.service.ssh_setup import ssh_run_args, wait_for_ssh
+from src.storage import events
+from src.storage.state import (
+    InstanceState,
+    clear_state,
+    get_current_state,
+    lease_ports,
+    leased_ports,
+    record_operation,
+    release_ports,
+    save_state,
+    set_port_proxies,
+)
+from src.utils.dto import to_json
 from src.utils.ports import get_free_port
 from src.utils.system import run_command
 from src.utils.xlogging import get_logger
@@ -32,6 +48,28 @@ def _shred_file(file_path: str):
         run_command(["shred", "-u", "-n", "1", file_path])
 
 
+def _progress(operation: str, stage: str, **data) -> None:
+    events.publish("operation", {"operation": operation, "stage": stage, **data})
+    record_operation(operation, stage, **data)
+
+
+def _report_ssh_ready(instance_id: str, port: int, operation: str) -> None:
+    waited = wait_for_ssh(port)
+    if waited is None:
+        logger.error(f"SSH did not come up on port {port}")
+        _progress(operation, "ssh_failed", instance_id=instance_id)
+    else:
+        _progress(operation, "ssh_ready", instance_id=instance_id, seconds=waited)
+
+
+def watch_ssh(instance_id: str, port: int, operation: str = "create") -> None:
+    threading.Thread(
+        target=_report_ssh_ready,
+        args=(instance_id, port, operation),
+        daemon=True,
+    ).start()
+
+
 def decrypt_dek(wrapped_dek: str) -> str | None:
     # TODO: This requires a full implementation in `secure.py`
     logger.warning(
@@ -42,63 +80,112 @@ def decrypt_dek(wrapped_dek: str) -> str | None:
     return None
 
 
-def create_new_instance(params: CreateInstance) -> tuple[bool, dict | None, str | None]:
-    state = get_current_state()
-    if state.status != "destroyed":
-        err = f"An instance '{state.instance_id}' already exists with status '{state.status}'. Please delete it first."
-        logger.error(err)
-        return False, None, err
-
-    logger.info(
-        f"Received request to create a new instance with image {params.image}:{params.image_tag}")
-    instance_id = str(uuid.uuid4())
-
-    logger.warning(
-        "SECURITY DISABLED: Running in 'vanilla Docker' mode. LUKS and Kata are bypassed.")
-
-    logger.info("Preparing to launch instance via standard Docker...")
-
-    cpu_cores = (params.env_variables or {}).pop("QUDATA_CPU_CORES", "1")
-    memory_gb = (params.env_variables or {}).pop("QUDATA_MEMORY_GB", "2")
-    gpu_count = (params.env_variables or {}).pop("QUDATA_GPU_COUNT", "0")
-
+def _run_container(
+    params: CreateInstance,
+    instance_id: str,
+    cpu_cores: str,
+    memory_gb: str,
+    gpu_count: str,
+) -> tuple[str | None, dict[str, str], str | None]:
     docker_command = [
         "docker", "run",
         "-d", "--rm",
         f"--cpus={cpu_cores}",
         f"--memory={memory_gb}g",
+        "--label", f"{consts.CONTAINER_LABEL}=1",
+        "--label", f"{consts.CONTAINER_LABEL_INSTANCE}={instance_id}",
     ]
 
     if int(gpu_count) > 0:
         docker_command.append(f"--gpus=count={gpu_count}")
 
+    # Ports of stopped containers bind fine, and nothing is bound until
+    # docker run: both have to be excluded from the scan by hand.
+    taken = leased_ports()
     allocated_ports = {}
     for container_port, host_port_def in (params.ports or {}).items():
-        host_port = str(
-            host_port_def if str(host_port_def).lower() != "auto" else get_free_port()
-        )
+        if str(host_port_def).lower() == "auto":
+            host_port = str(get_free_port(taken))
+        else:
+            host_port = str(host_port_def)
         docker_command.extend(["-p", f"{host_port}:{container_port}"])
         allocated_ports[container_port] = host_port
+        taken.add(int(host_port))
 
     for key, value in (params.env_variables or {}).items():
         if key == "QUDATA_WRAPPED_DEK": continue
         docker_command.extend(["-e", f"{key}={value}"])
 
     if params.ssh_enabled and "22" not in (params.ports or {}):
-        host_ssh_port = str(get_free_port())
+        host_ssh_port = str(get_free_port(taken))
         docker_command.extend(["-p", f"{host_ssh_port}:22"])
         allocated_ports["22"] = host_ssh_port
 
+    docker_command.extend(
+        ["--label", f"{consts.CONTAINER_LABEL_PORTS}={json.dumps(allocated_ports)}"]
+    )
+
     image_full_name = f"{params.image}:{params.image_tag}"
-    docker_command.append(image_full_name)
-    if params.command:
-        docker_command.extend(params.command.split())
+    if params.ssh_enabled:
+        try:
+            ssh_options, container_args = ssh_run_args(image_full_name, params.command)
+        except RuntimeError as e:
+            _progress("create", "failed", instance_id=instance_id, error=str(e))
+            return None, allocated_ports, f"Failed to prepare SSH: {e}"
+        docker_command.extend(["--label", f"{consts.CONTAINER_LABEL_SSH}=1"])
+        docker_command.extend(ssh_options)
+        docker_command.append(image_full_name)
+        docker_command.extend(container_args)
+    else:
+        docker_command.append(image_full_name)
+        if params.command:
+            docker_command.extend(params.command.split())
 
+    _progress("create", "docker_run", instance_id=instance_id)
     success, container_id, stderr = run_command(docker_command)
     if not success or not container_id:
-        return False, None, f"Failed to run Docker container: {stderr}"
+        _progress("create", "failed", instance_id=instance_id, error=stderr)
+        return None, allocated_ports, f"Failed to run Docker container: {stderr}"
+    return container_id.strip(), allocated_ports, None
+
+
+def create_new_instance(params: CreateInstance) -> tuple[bool, dict | None, str | None]:
+    state = get_current_state()
+    if state.status != "destroyed":
+        err = f"An instance '{state.instance_id}' already exists with status '{state.status}'. Please delete it first."
+        logger.error(err)
+        return False, None, err
+
+    logger.info(
+        f"Received request to create a new instance with image {params.image}:{params.image_tag}")
+    started = time.monotonic()
+    instance_id = str(uuid.uuid4())
+    _progress("create", "started", instance_id=instance_id, image=params.image)
+
+    logger.warning(
+        "SECURITY DISABLED: Running in 'vanilla Docker' mode. LUKS and Kata are bypassed.")
+
+    logger.info("Preparing to launch instance via standard Docker...")
+
+    cpu_cores = (params.env_variables or {}).pop("QUDATA_CPU_CORES", "1")
+    memory_gb = (params.env_variables or {}).pop("QUDATA_MEMORY_GB", "2")
+    gpu_count = (params.env_variables or {}).pop("QUDATA_GPU_COUNT", "0")
 
-    container_id = container_id.strip()
+    claimed = None
+    pool = "off"
+    if warm_pool.enabled():
+        claimed = warm_pool.claim(params, cpu_cores, memory_gb, int(gpu_count))
+        pool = "hit" if claimed else "miss"
+    if claimed:
+        container_id, allocated_ports, proxies = claimed
+        _progress("create", "warm_start", instance_id=instance_id)
+    else:
+        proxies = {}
+        container_id, allocated_ports, err = _run_container(
+            params, instance_id, cpu_cores, memory_gb, gpu_count
+        )
+        if container_id is None:
+            return False, None, err
     logger.info(f"Container '{container_id[:12]}' started successfully.")
 
     new_state = InstanceState(
@@ -109,10 +196,37 @@ def create_new_instance(params: CreateInstance) -> tuple[bool, dict | None, str
     )
     if not save_state(new_state):
         run_command(["docker", "rm", "-f", container_id])
+        _progress("create", "failed", instance_id=instance_id, error="state not saved")
         return False, None, "CRITICAL: Failed to save state after container creation. Rolled back."
 
+    # Proxied ports are leased twice: the renter's and the container's.
+    lease_ports(
+        {
+            instance_id: [int(port) for port in allocated_ports.values()]
+            + list(proxies.values())
+        }
+    )
+    if proxies:
+        set_port_proxies(instance_id, proxies)
+    _progress(
+        "create",
+        "completed",
+        instance_id=instance_id,
+        pool=pool,
+        seconds=round(time.monotonic() - started, 3),
+    )
+    if params.ssh_enabled:
+        watch_ssh(instance_id, int(allocated_ports["22"]))
     created_data = InstanceCreated(success=True, ports=allocated_ports)
-    return True, asdict(created_data), None
+    return True, to_json(created_data), None
+
+
+def check_container_exists(container_id: str) -> bool:
+    success, _, _ = run_command(
+        ["docker", "inspect", "--type", "container", "--format", "{{.Id}}",
+         container_id]
+    )
+    return success
 
 
 def manage_instance(params: ManageInstance) -> tuple[bool, str | None]:
@@ -130,6 +244,8 @@ def manage_instance(params: ManageInstance) -> tuple[bool, str | None]:
         return False, f"Unknown action: {params.action}"
 
     command, new_status = action_map[params.action]
+    action = params.action.value
+    _progress(action, "started", instance_id=state.instance_id)
 
     logger.info(
         f"Executing action '{params.action}' on container {state.container_id[:12]}..."
@@ -140,12 +256,14 @@ def manage_instance(params: ManageInstance) -> tuple[bool, str | None]:
         state.status = new_status
         save_state(state)
         logger.info(f"Action '{params.action}' completed successfully.")
+        _progress(action, "completed", instance_id=state.instance_id)
         return True, None
     else:
         err = f"Failed to execute action '{params.action}': {stderr}"
         logger.error(err)
         state.status = "error"
         save_state(state)
+        _progress(action, "failed", instance_id=state.instance_id, error=stderr)
         return False, err
 
 
@@ -161,30 +279,33 @@ def delete_instance() -> tuple[bool, str | None]:
 
 
 def get_instance_logs(
-    container_id: str, tail: int = 100
+    container_id: str,
+    tail: int | None = 100,
+    since: float | None = None,
+    until: float | None = None,
+    max_bytes: int | None = None,
 ) -> tuple[bool, str | None, str | None]:
     if not container_id:
         return False, None, "Container ID is missing."
 
     logger.info(f"Fetching logs for container {container_id[:12]}...")
-    command = ["docker", "logs", f"--tail={tail}", container_id]
-
-    success, stdout, stderr = run_command(command)
-
-    if success:
-        return True, stdout or stderr, None
-    else:
-        full_log_output = f"STDERR: {stderr}\nSTDOUT: {stdout}"
-        return False, None, full_log_output
+    query = LogQuery(tail=tail, max_bytes=max_bytes, since=since, until=until)
+    try:
+        return True, read_logs(container_id, query), None
+    except Exception as e:
+        logger.error(f"Failed to read logs for {container_id[:12]}: {e}")
+        return False, None, str(e)
 
 
 def emergency_self_destruct() -> None:
     state = get_current_state()
     logger.critical("--- STARTING (Simplified) SELF-DESTRUCT SEQUENCE ---")
+    _progress("self_destruct", "started", instance_id=state.instance_id)
     if state.container_id:
         logger.critical(
             f"Forcefully removing container {state.container_id[:12]}...")
         run_command(["docker", "rm", "-f", state.container_id])
+    release_ports(state.instance_id)
 
     logger.critical("Shredding agent's sensitive state...")
     clear_state()
@@ -199,6 +320,10 @@ def emergency_self_destruct() -> None:
         logger.error("Failed")
 
     try:
+        # The HTTP client (httpx, keyring) is only needed here; importing it
+        # lazily keeps it out of the API server's startup.
+        from src.client.qudata import QudataClient
+
         client = QudataClient()
         event = Incident(
             incident_type=IncidentType.privacy_corrupted,
@@ -210,4 +335,5 @@ def emergency_self_destruct() -> None:
     except Exception as e:
         logger.error(f"Failed to report about the incident: {e}")
 
+    _progress("self_destruct", "completed", instance_id=state.instance_id)
     logger.critical("----- SELF-DESTRUCT PROCEDURE COMPLETE -----")
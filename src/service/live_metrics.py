@@ -0,0 +1,228 @@
+"""Live agent metrics in shared memory: the agent writes, API workers read"""
+
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+from src import consts
+
+if TYPE_CHECKING:
+    from src.utils.scheduler import PeriodicTask, Scheduler
+
+LIVE_METRICS_ENV = "QUDATA_LIVE_METRICS_PATH"
+MAX_TASKS = 8
+
+# Seqlock: an odd value means a write is in progress.
+_SEQ = struct.Struct("<Q")
+# samples, sampled_at_ns, tasks
+_HEAD = struct.Struct("<QQI")
+# cpu, ram, disk, load1, load5, load15, ram_used, ram_total
+_SYSTEM = struct.Struct("<ddddddQQ")
+# name, runs, failures, skipped, overruns, lateness max/mean, duration max/mean
+_TASK = struct.Struct("<24sQIIIffff")
+_PAYLOAD = _HEAD.size + _SYSTEM.size + MAX_TASKS * _TASK.size
+_SIZE = _SEQ.size + _PAYLOAD
+_READ_ATTEMPTS = 100
+
+
+class LiveMetrics:
+    """
+    The sampler's latest snapshot in a fixed layout
+
+    Writers are serialized by flock on the segment file (two agents write
+    during a generation handoff). Readers never block: they copy the
+    snapshot and retry if the seqlock counter changed or is odd. Store order
+    in the mmap relies on x86 (TSO); Python cannot issue barriers.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+        self._mem = mmap.mmap(self._fd, _SIZE)
+
+    @classmethod
+    def create(cls) -> "LiveMetrics":
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, path = tempfile.mkstemp(prefix="qudata-metrics-", dir=directory)
+        try:
+            os.ftruncate(fd, _SIZE)
+        finally:
+            os.close(fd)
+        return cls(path)
+
+    def publish(self, system: dict[str, Any], tasks: dict[str, dict]) -> None:
+        payload = bytearray(_PAYLOAD)
+        offset = _HEAD.size + _SYSTEM.size
+        for name, task in list(tasks.items())[:MAX_TASKS]:
+            _TASK.pack_into(
+                payload,
+                offset,
+                name.encode(),
+                task["runs"],
+                task["failures"],
+                task["skipped"],
+                task["overruns"],
+                task["lateness"]["max_ms"],
+                task["lateness"]["mean_ms"] or 0.0,
+                task["duration"]["max_ms"],
+                task["duration"]["mean_ms"] or 0.0,
+            )
+            offset += _TASK.size
+        _SYSTEM.pack_into(
+            payload,
+            _HEAD.size,
+            system["cpu_util"],
+            system["ram_util"],
+            system["disk_util"],
+            *system["load"],
+            system["ram_used"],
+            system["ram_total"],
+        )
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            seq = _SEQ.unpack_from(self._mem)[0]
+            # A writer died mid-write and left the counter odd.
+            seq += seq & 1
+            samples = _HEAD.unpack_from(self._mem, _SEQ.size)[0]
+            _HEAD.pack_into(
+                payload, 0, samples + 1, time.time_ns(), min(len(tasks), MAX_TASKS)
+            )
+            _SEQ.pack_into(self._mem, 0, seq + 1)
+            self._copy(payload)
+            _SEQ.pack_into(self._mem, 0, seq + 2)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _copy(self, payload: bytes) -> None:
+        self._mem[_SEQ.size : _SIZE] = payload
+
+    def read_raw(self) -> Optional[bytes]:
+        """A consistent copy of the snapshot, or None if a writer is stuck mid-write"""
+        for _ in range(_READ_ATTEMPTS):
+            before = _SEQ.unpack_from(self._mem)[0]
+            if not before & 1:
+                payload = self._mem[_SEQ.size : _SIZE]
+                if _SEQ.unpack_from(self._mem)[0] == before:
+                    return payload
+            os.sched_yield()
+        return None
+
+    def read(self) -> Optional[dict[str, Any]]:
+        payload = self.read_raw()
+        return _decode(payload) if payload is not None else None
+
+    def close(self) -> None:
+        self._mem.close()
+        os.close(self._fd)
+
+    def unlink(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _decode(payload: bytes) -> Optional[dict[str, Any]]:
+    samples, sampled_at_ns, count = _HEAD.unpack_from(payload)
+    if not samples:
+        return None
+    cpu, ram, disk, load1, load5, load15, ram_used, ram_total = _SYSTEM.unpack_from(
+        payload, _HEAD.size
+    )
+    scheduler = {}
+    offset = _HEAD.size + _SYSTEM.size
+    for _ in range(count):
+        (
+            name,
+            runs,
+            failures,
+            skipped,
+            overruns,
+            late_max,
+            late_mean,
+            duration_max,
+            duration_mean,
+        ) = _TASK.unpack_from(payload, offset)
+        offset += _TASK.size
+        scheduler[name.rstrip(b"\0").decode()] = {
+            "runs": runs,
+            "failures": failures,
+            "skipped": skipped,
+            "overruns": overruns,
+            "lateness_max_ms": round(late_max, 3),
+            "lateness_mean_ms": round(late_mean, 3),
+            "duration_max_ms": round(duration_max, 3),
+            "duration_mean_ms": round(duration_mean, 3),
+        }
+    return {
+        "samples": samples,
+        "sampled_at": sampled_at_ns / 1e9,
+        "age_ms": round((time.time_ns() - sampled_at_ns) / 1e6, 3),
+        "system": {
+            "cpu_util": round(cpu, 2),
+            "ram_util": round(ram, 2),
+            "ram_used": ram_used,
+            "ram_total": ram_total,
+            "disk_util": round(disk, 2),
+            "load": [round(load1, 2), round(load5, 2), round(load15, 2)],
+        },
+        "scheduler": scheduler,
+    }
+
+
+def sample_system() -> dict[str, Any]:
+    # Agent only; the launcher does not need psutil.
+    import psutil
+
+    memory = psutil.virtual_memory()
+    return {
+        # No interval: usage since the previous call, i.e. over the sampler period.
+        "cpu_util": psutil.cpu_percent(),
+        "ram_util": memory.percent,
+        "ram_used": memory.used,
+        "ram_total": memory.total,
+        "disk_util": psutil.disk_usage("/").percent,
+        "load": os.getloadavg(),
+    }
+
+
+_attached: Optional[LiveMetrics] = None
+
+
+def get_live_metrics() -> Optional[LiveMetrics]:
+    """The launcher's segment (path from the env)"""
+    global _attached
+    path = os.environ.get(LIVE_METRICS_ENV)
+    if not path:
+        return None
+    if _attached is None or _attached.path != path:
+        try:
+            _attached = LiveMetrics(path)
+        except OSError as e:
+            print(f"WARNING: live metrics segment unavailable: {e}", file=sys.stderr)
+            return None
+    return _attached
+
+
+def live_metrics() -> Optional[dict[str, Any]]:
+    segment = get_live_metrics()
+    return segment.read() if segment is not None else None
+
+
+def start_sampler(scheduler: "Scheduler") -> Optional["PeriodicTask"]:
+    """Publishes host resources and scheduler counters every LIVE_METRICS_INTERVAL"""
+    segment = get_live_metrics()
+    if segment is None:
+        return None
+    return scheduler.add(
+        "live-metrics",
+        lambda: segment.publish(sample_system(), scheduler.snapshot()),
+        consts.LIVE_METRICS_INTERVAL,
+        deadline=consts.LIVE_METRICS_INTERVAL,
+    )
@@ -0,0 +1,649 @@
+"""Container logs read straight from the logging driver's file"""
+
+import abc
+import json
+import os
+import socket
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, Optional
+from urllib.parse import urlencode
+
+from src.security.credentials import docker_headers
+from src.utils.tracing import span
+from src.utils.xlogging import get_logger
+
+logger = get_logger(__name__)
+
+DOCKER_CONTAINERS_DIR = Path("/var/lib/docker/containers")
+DOCKER_SOCK_PATH = "/var/run/docker.sock"
+BLOCK_SIZE = 64 * 1024
+# Largest local-driver frame we accept when resynchronising mid-file.
+MAX_FRAME_SIZE = 1024 * 1024
+ENGINE_TIMEOUT = 30.0
+# A followed Engine stream is read in steps of this long at most.
+ENGINE_FOLLOW_TIMEOUT = 1.0
+
+
+class LogQuery:
+    __slots__ = ("tail", "max_bytes", "since", "until")
+
+    def __init__(
+        self,
+        tail: Optional[int] = 100,
+        max_bytes: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> None:
+        self.tail = tail
+        self.max_bytes = max_bytes
+        # Microsecond rounding: a float unix time cannot hold exact nanoseconds.
+        self.since = None if since is None else round(since * 1e6) * 1000
+        self.until = None if until is None else round(until * 1e6) * 1000
+
+
+def parse_timestamp(value: str) -> int:
+    """RFC3339Nano (``2024-05-01T10:00:00.123456789Z``) to unix nanoseconds."""
+    seconds, _, frac = value.rstrip("Z").partition(".")
+    dt = datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()) * 1_000_000_000 + int((frac or "0")[:9].ljust(9, "0"))
+
+
+def _trim(chunks: list[bytes], max_bytes: Optional[int]) -> bytes:
+    data = b"".join(chunks)
+    if max_bytes is not None and len(data) > max_bytes:
+        data = data[-max_bytes:]
+    return data
+
+
+# json-file driver: one JSON record per line, oldest first.
+
+
+def _lines_backward(f: BinaryIO, end: int, start: int = 0) -> Iterator[bytes]:
+    """Yields complete lines of ``f[start:end]`` from the last one backwards."""
+    position = end
+    rest = b""
+    while position > start:
+        size = min(BLOCK_SIZE, position - start)
+        position -= size
+        f.seek(position)
+        block = f.read(size) + rest
+        lines = block.split(b"\n")
+        rest = lines.pop(0)
+        for line in reversed(lines):
+            if line:
+                yield line
+    if rest:
+        yield rest
+
+
+def _record_time(record: Any) -> Optional[int]:
+    """The record's time in unix nanoseconds, or None if it has none."""
+    try:
+        return parse_timestamp(record["time"])
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return None
+
+
+def _record_at(f: BinaryIO, offset: int, end: int) -> tuple[int, Optional[int]]:
+    """
+    First record with a time starting at or after ``offset``; returns (its
+    start, time), or (end, None). Unreadable or timeless records are skipped.
+    """
+    if offset:
+        f.seek(offset - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    start = f.tell()
+    while start < end:
+        line = f.readline()
+        if not line:
+            break
+        try:
+            ts = _record_time(json.loads(line))
+        except json.JSONDecodeError:
+            ts = None
+        if ts is not None:
+            return start, ts
+        start += len(line)
+    return end, None
+
+
+def _bisect(f: BinaryIO, size: int, ts: int, inclusive: bool) -> int:
+    """Offset of the first record with time >= ts (> ts unless inclusive)."""
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, record_ts = _record_at(f, mid, size)
+        if record_ts is None:
+            hi = mid
+            continue
+        if record_ts < ts or (not inclusive and record_ts == ts):
+            lo = start + 1
+        else:
+            hi = mid
+    return _record_at(f, lo, size)[0]
+
+
+def read_json_file(path: Path, query: LogQuery) -> bytes:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = _bisect(f, size, query.since, True) if query.since else 0
+        end = _bisect(f, size, query.until, False) if query.until else size
+
+        chunks: list[bytes] = []
+        total = 0
+        for line in _lines_backward(f, end, start):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            chunk = str(record.get("log", "")).encode()
+            # Docker splits long lines into 16K records; only the last part
+            # of a line ends with a newline.
+            if chunk.endswith(b"\n") or not chunks:
+                if query.tail is not None and len(chunks) >= query.tail:
+                    break
+                if query.max_bytes is not None and total >= query.max_bytes:
+                    break
+                chunks.append(chunk)
+            else:
+                chunks[-1] = chunk + chunks[-1]
+            total += len(chunk)
+        chunks.reverse()
+        return _trim(chunks, query.max_bytes)
+
+
+# local driver: [uint32 size][protobuf LogEntry][uint32 size] per entry.
+
+
+def _varint(buf: bytes, i: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, i
+        shift += 7
+
+
+def decode_log_entry(buf: bytes) -> tuple[int, bytes, bool]:
+    """Minimal LogEntry decoder: (time_nano, line, partial)."""
+    ts, line, partial = 0, b"", False
+    i = 0
+    while i < len(buf):
+        key, i = _varint(buf, i)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, i = _varint(buf, i)
+            if field == 2:
+                ts = value
+            elif field == 4:
+                partial = bool(value)
+        elif wire == 2:
+            length, i = _varint(buf, i)
+            if field == 3:
+                line = buf[i : i + length]
+            i += length
+        elif wire == 1:
+            i += 8
+        elif wire == 5:
+            i += 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire}")
+    return ts, line, partial
+
+
+def _entries_backward(
+    f: BinaryIO, end: int, start: int = 0
+) -> Iterator[tuple[int, bytes, bool]]:
+    position = end
+    while position - start >= 8:
+        f.seek(position - 4)
+        (length,) = struct.unpack(">I", f.read(4))
+        position -= length + 8
+        if position < start:
+            return
+        f.seek(position + 4)
+        yield decode_log_entry(f.read(length))
+
+
+def _frame_at(buf: bytes, i: int) -> Optional[int]:
+    """End of a plausible frame starting at ``buf[i]``, if there is one."""
+    if i + 8 > len(buf):
+        return None
+    (length,) = struct.unpack_from(">I", buf, i)
+    end = i + length + 8
+    if not 0 < length <= MAX_FRAME_SIZE or end > len(buf):
+        return None
+    if buf[i + 4] not in (0x0A, 0x10):
+        return None
+    if struct.unpack_from(">I", buf, end - 4)[0] != length:
+        return None
+    return end
+
+
+def _sync_local(f: BinaryIO, offset: int, size: int) -> Optional[int]:
+    """Offset of the first frame at or after ``offset``.
+
+    The format has no sync marker, so a position counts as a frame start
+    only when two consecutive frames there have matching length prefixes.
+    """
+    if offset == 0:
+        return 0 if size else None
+    # Frames are usually small, so try a short window before a full one.
+    for window in (BLOCK_SIZE, 2 * MAX_FRAME_SIZE + 16):
+        f.seek(offset)
+        buf = f.read(window)
+        for i in range(len(buf) - 8):
+            end = _frame_at(buf, i)
+            if end is None:
+                continue
+            if offset + end == size or _frame_at(buf, end) is not None:
+                return offset + i
+        if offset + len(buf) >= size:
+            break
+    return None
+
+
+def _bisect_local(f: BinaryIO, size: int, ts: int, inclusive: bool) -> int:
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = _sync_local(f, mid, size)
+        if start is None:
+            hi = mid
+            continue
+        f.seek(start)
+        (length,) = struct.unpack(">I", f.read(4))
+        record_ts = decode_log_entry(f.read(length))[0]
+        if record_ts < ts or (not inclusive and record_ts == ts):
+            lo = start + 1
+        else:
+            hi = mid
+    start = _sync_local(f, lo, size)
+    return size if start is None else start
+
+
+def read_local(path: Path, query: LogQuery) -> bytes:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = _bisect_local(f, size, query.since, True) if query.since else 0
+        end = _bisect_local(f, size, query.until, False) if query.until else size
+        chunks: list[bytes] = []
+        total = 0
+        for ts, line, partial in _entries_backward(f, end, start):
+            chunk = line if partial else line + b"\n"
+            if partial and chunks:
+                chunks[-1] = chunk + chunks[-1]
+            else:
+                if query.tail is not None and len(chunks) >= query.tail:
+                    break
+                if query.max_bytes is not None and total >= query.max_bytes:
+                    break
+                chunks.append(chunk)
+            total += len(chunk)
+        chunks.reverse()
+        return _trim(chunks, query.max_bytes)
+
+
+# Engine API fallback for every other driver.
+
+
+def _demux(payload: bytes) -> bytes:
+    """Strips the 8-byte stdout/stderr frame headers of non-TTY containers."""
+    if len(payload) < 8 or payload[0] not in (0, 1, 2) or payload[1:4] != b"\0\0\0":
+        return payload
+    out, i = [], 0
+    while i + 8 <= len(payload):
+        (length,) = struct.unpack(">I", payload[i + 4 : i + 8])
+        out.append(payload[i + 8 : i + 8 + length])
+        i += 8 + length
+    return b"".join(out)
+
+
+def read_engine(container_id: str, query: LogQuery) -> bytes:
+    params = {
+        "stdout": 1,
+        "stderr": 1,
+        "tail": "all" if query.tail is None else query.tail,
+    }
+    if query.since is not None:
+        params["since"] = f"{query.since / 1e9:.9f}"
+    if query.until is not None:
+        params["until"] = f"{query.until / 1e9:.9f}"
+    import httpx
+
+    transport = httpx.HTTPTransport(uds=DOCKER_SOCK_PATH)
+    with httpx.Client(
+        transport=transport, timeout=ENGINE_TIMEOUT, headers=docker_headers()
+    ) as client:
+        response = client.get(
+            f"http://docker/containers/{container_id}/logs", params=params
+        )
+        response.raise_for_status()
+    return _trim([_demux(response.content)], query.max_bytes)
+
+
+def log_source(container_id: str) -> tuple[str, Optional[Path]]:
+    container_dir = DOCKER_CONTAINERS_DIR / container_id
+    try:
+        with open(container_dir / "hostconfig.json", "rb") as f:
+            driver = json.load(f).get("LogConfig", {}).get("Type") or "json-file"
+    except (OSError, json.JSONDecodeError):
+        return "engine", None
+    if driver == "json-file":
+        return driver, container_dir / f"{container_id}-json.log"
+    if driver == "local":
+        return driver, container_dir / "local-logs" / "container.log"
+    return "engine", None
+
+
+def read_logs(container_id: str, query: LogQuery) -> str:
+    driver, path = log_source(container_id)
+    with span("logs.read", driver=driver):
+        if path is not None:
+            try:
+                reader = read_json_file if driver == "json-file" else read_local
+                return reader(path, query).decode("utf-8", errors="replace")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(
+                    f"Direct {driver} log read failed, using Engine API: {e}"
+                )
+        return read_engine(container_id, query).decode("utf-8", errors="replace")
+
+
+# Follow mode: incremental readers that never block on file-backed drivers,
+# so a viewer costs one open file and only reads as fast as it consumes.
+
+
+def _tail_offset(f: BinaryIO, size: int, lines: int) -> int:
+    if lines <= 0:
+        return size
+    position, seen = size, 0
+    f.seek(max(0, size - 1))
+    # The final newline terminates the last record, it does not start one.
+    skip_last = f.read(1) == b"\n"
+    while position > 0:
+        block_size = min(BLOCK_SIZE, position)
+        position -= block_size
+        f.seek(position)
+        block = f.read(block_size)
+        i = len(block) - (1 if skip_last and position + block_size == size else 0)
+        while True:
+            i = block.rfind(b"\n", 0, i)
+            if i < 0:
+                break
+            seen += 1
+            if seen == lines:
+                return position + i + 1
+    return 0
+
+
+def _tail_offset_local(f: BinaryIO, size: int, lines: int) -> int:
+    position = size
+    for _ in range(lines):
+        if position < 8:
+            break
+        f.seek(position - 4)
+        (length,) = struct.unpack(">I", f.read(4))
+        if position - length - 8 < 0:
+            break
+        position -= length + 8
+    return position
+
+
+class LogFollower(abc.ABC):
+
+    def __init__(self, path: Path, position: int) -> None:
+        self.path = path
+        self.last_ts: Optional[int] = None
+        self.done = False
+        self._f = open(path, "rb")
+        self._inode = os.fstat(self._f.fileno()).st_ino
+        self._f.seek(position)
+        self._buffer = b""
+
+    def read(self, limit: int = BLOCK_SIZE) -> bytes:
+        data = self._f.read(limit)
+        if not data:
+            self._reopen_if_rotated()
+            return b""
+        self._buffer += data
+        out, self._buffer = self._decode(self._buffer)
+        return out
+
+    def _reopen_if_rotated(self) -> None:
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return
+        if inode != self._inode:
+            self._f.close()
+            self._f = open(self.path, "rb")
+            self._inode = os.fstat(self._f.fileno()).st_ino
+            self._buffer = b""
+
+    @abc.abstractmethod
+    def _decode(self, buffer: bytes) -> tuple[bytes, bytes]:
+        """Complete entries of ``buffer`` as plain text, and the rest."""
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class JsonFileFollower(LogFollower):
+
+    def _decode(self, buffer: bytes) -> tuple[bytes, bytes]:
+        cut = buffer.rfind(b"\n") + 1
+        out = []
+        for line in buffer[:cut].split(b"\n"):
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            out.append(str(record.get("log", "")).encode())
+            # A record without a time keeps the last id.
+            self.last_ts = _record_time(record) or self.last_ts
+        return b"".join(out), buffer[cut:]
+
+
+class LocalFollower(LogFollower):
+
+    def _decode(self, buffer: bytes) -> tuple[bytes, bytes]:
+        out, i = [], 0
+        while i + 4 <= len(buffer):
+            (length,) = struct.unpack_from(">I", buffer, i)
+            if i + length + 8 > len(buffer):
+                break
+            ts, line, partial = decode_log_entry(buffer[i + 4 : i + 4 + length])
+            out.append(line if partial else line + b"\n")
+            self.last_ts = ts
+            i += length + 8
+        return b"".join(out), buffer[i:]
+
+
+class _Demuxer:
+    """Incremental version of ``_demux`` for a followed Engine API stream."""
+
+    def __init__(self) -> None:
+        self._buffer = b""
+        self._raw: Optional[bool] = None
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer += data
+        if self._raw is None:
+            if len(self._buffer) < 8:
+                return b""
+            head = self._buffer
+            self._raw = head[0] not in (0, 1, 2) or head[1:4] != b"\0\0\0"
+        if self._raw:
+            out, self._buffer = self._buffer, b""
+            return out
+        out, i = [], 0
+        while i + 8 <= len(self._buffer):
+            (length,) = struct.unpack_from(">I", self._buffer, i + 4)
+            if i + 8 + length > len(self._buffer):
+                break
+            out.append(self._buffer[i + 8 : i + 8 + length])
+            i += 8 + length
+        self._buffer = self._buffer[i:]
+        return b"".join(out)
+
+
+class EngineFollower:
+    """Fallback follower over the Engine API.
+
+    ``read`` waits at most ENGINE_FOLLOW_TIMEOUT for data and returns an
+    empty chunk otherwise, so callers get to check their deadline. The
+    request is plain HTTP on the socket: a timed out read leaves it usable.
+    """
+
+    def __init__(
+        self, container_id: str, since: Optional[int], tail: Optional[int]
+    ) -> None:
+        self.last_ts: Optional[int] = None
+        self.done = False
+        params = {
+            "stdout": 1,
+            "stderr": 1,
+            "follow": 1,
+            "tail": "all" if tail is None else tail,
+        }
+        if since is not None:
+            params["since"] = f"{since / 1e9:.9f}"
+        headers = {"Host": "docker", "Connection": "close", **docker_headers()}
+        request = (
+            f"GET /containers/{container_id}/logs?{urlencode(params)} HTTP/1.1\r\n"
+            + "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+            + "\r\n"
+        )
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.settimeout(ENGINE_TIMEOUT)
+            self._sock.connect(DOCKER_SOCK_PATH)
+            self._sock.sendall(request.encode())
+            self._body = self._read_head()
+        except BaseException:
+            self._sock.close()
+            raise
+        self._sock.settimeout(ENGINE_FOLLOW_TIMEOUT)
+        self._pending = b""
+        self._chunk_left = 0
+        self._demuxer = _Demuxer()
+
+    def _read_head(self) -> bytes:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            if len(data) > BLOCK_SIZE:
+                raise OSError("Engine response headers are too large")
+            chunk = self._sock.recv(BLOCK_SIZE)
+            if not chunk:
+                raise OSError("Engine closed the connection")
+            data += chunk
+        head, _, body = data.partition(b"\r\n\r\n")
+        status, *lines = head.decode("latin-1").split("\r\n")
+        if status.split()[1:2] != ["200"]:
+            raise OSError(f"Engine answered {status}")
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+        self._chunked = "chunked" in headers.get("transfer-encoding", "")
+        return body
+
+    def _dechunk(self, data: bytes) -> bytes:
+        self._pending += data
+        out = []
+        while self._pending:
+            if self._chunk_left:
+                part = self._pending[: self._chunk_left]
+                self._pending = self._pending[len(part) :]
+                self._chunk_left -= len(part)
+                out.append(part)
+                continue
+            if self._pending.startswith(b"\r\n"):
+                self._pending = self._pending[2:]
+                continue
+            end = self._pending.find(b"\r\n")
+            if end < 0:
+                break
+            size = int(self._pending[:end].split(b";")[0], 16)
+            self._pending = self._pending[end + 2 :]
+            if size == 0:
+                self.done = True
+                self._pending = b""
+                break
+            self._chunk_left = size
+        return b"".join(out)
+
+    def read(self, limit: int = BLOCK_SIZE) -> bytes:
+        if self._body:
+            data, self._body = self._body, b""
+        elif self.done:
+            return b""
+        else:
+            try:
+                data = self._sock.recv(limit)
+            except socket.timeout:
+                return b""
+            if not data:
+                self.done = True
+                return b""
+        if self._chunked:
+            try:
+                data = self._dechunk(data)
+            except ValueError:
+                logger.warning("Malformed chunk in the Engine log stream")
+                self.done = True
+                return b""
+        return self._demuxer.feed(data)
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+def open_follower(
+    container_id: str, since: Optional[int] = None, tail: Optional[int] = 100
+):
+    """Follower positioned at ``since`` (unix ns) or at the last ``tail`` lines."""
+    driver, path = log_source(container_id)
+    if path is not None:
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if driver == "json-file":
+                    if since is not None:
+                        position = _bisect(f, size, since, True)
+                    elif tail is not None:
+                        position = _tail_offset(f, size, tail)
+                    else:
+                        position = 0
+                    return JsonFileFollower(path, position)
+                if since is not None:
+                    position = _bisect_local(f, size, since, True)
+                elif tail is not None:
+                    position = _tail_offset_local(f, size, tail)
+                else:
+                    position = 0
+                return LocalFollower(path, position)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Direct {driver} log follow failed, using Engine API: {e}")
+    return EngineFollower(container_id, since, tail)
+
+
+def container_running(container_id: str) -> bool:
+    try:
+        with open(DOCKER_CONTAINERS_DIR / container_id / "config.v2.json", "rb") as f:
+            return bool(json.load(f).get("State", {}).get("Running"))
+    except (OSError, json.JSONDecodeError):
+        return True
@@ -0,0 +1,280 @@
+"""Agent TCP proxy from a renter's port to a container's published port"""
+
+import errno
+import os
+import selectors
+import socket
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Optional
+
+from src import consts
+from src.storage.state import port_proxies
+from src.utils.xlogging import get_logger
+
+if TYPE_CHECKING:
+    from src.utils.scheduler import PeriodicTask, Scheduler
+
+logger = get_logger(__name__)
+
+_CHUNK = 64 * 1024
+
+
+class _End:
+    """One socket of a proxied connection and the bytes waiting to be sent to it."""
+
+    __slots__ = ("sock", "peer", "out", "eof", "shut", "connecting", "events")
+
+    def __init__(self, sock: socket.socket, connecting: bool = False) -> None:
+        self.sock = sock
+        self.peer: Optional["_End"] = None
+        self.out = bytearray()
+        self.eof = False
+        self.shut = False
+        self.connecting = connecting
+        self.events = 0
+
+
+class _ProxyLoop:
+    """
+    One thread serves every proxy of the agent on a selector
+
+    A busy or slow connection costs buffers, not threads, so the proxies
+    cannot crowd out the agent's heartbeat. At ``max_connections`` open
+    connections the listeners stop accepting; new clients wait in the
+    backlog until a connection closes.
+    """
+
+    def __init__(self, max_connections: int) -> None:
+        self.max_connections = max_connections
+        self._selector = selectors.DefaultSelector()
+        self._calls: deque[Callable[[], None]] = deque()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._listeners: set["PortProxy"] = set()
+        self._connections = 0
+        threading.Thread(target=self._run, name="port-proxy", daemon=True).start()
+
+    def call(self, fn: Callable[[], None]) -> None:
+        """Runs ``fn`` on the loop thread, which owns the selector."""
+        self._calls.append(fn)
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def add_listener(self, proxy: "PortProxy") -> None:
+        self._listeners.add(proxy)
+        if self._connections < self.max_connections:
+            self._selector.register(proxy.sock, selectors.EVENT_READ, proxy)
+
+    def remove_listener(self, proxy: "PortProxy") -> None:
+        if proxy in self._listeners:
+            self._listeners.discard(proxy)
+            if self._connections < self.max_connections:
+                self._selector.unregister(proxy.sock)
+        proxy.sock.close()
+
+    def _run(self) -> None:
+        while True:
+            for key, mask in self._selector.select():
+                try:
+                    if key.data is None:
+                        self._run_calls()
+                    elif isinstance(key.data, PortProxy):
+                        self._accept(key.data)
+                    elif key.data.sock.fileno() != -1:
+                        # Skipped if closed by an earlier event of this batch.
+                        self._ready(key.data, mask)
+                except Exception as e:
+                    logger.error(f"Port proxy loop: {e}")
+                    if isinstance(key.data, _End):
+                        self._close(key.data)
+
+    def _run_calls(self) -> None:
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self._calls:
+            self._calls.popleft()()
+
+    def _accept(self, proxy: "PortProxy") -> None:
+        try:
+            client, _ = proxy.sock.accept()
+        except OSError:
+            return
+        client.setblocking(False)
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        upstream.setblocking(False)
+        err = upstream.connect_ex(("127.0.0.1", proxy.target))
+        if err not in (0, errno.EINPROGRESS):
+            logger.warning(f"Proxy {proxy.port} -> {proxy.target}: {os.strerror(err)}")
+            client.close()
+            upstream.close()
+            return
+        front, back = _End(client), _End(upstream, connecting=True)
+        front.peer, back.peer = back, front
+        self._connections += 1
+        if self._connections == self.max_connections:
+            logger.warning(
+                f"Port proxies at {self.max_connections} connections, "
+                f"new ones wait in the backlog"
+            )
+            for listener in self._listeners:
+                self._selector.unregister(listener.sock)
+        self._update(front)
+        self._update(back)
+
+    def _ready(self, end: _End, mask: int) -> None:
+        if mask & selectors.EVENT_WRITE:
+            if end.connecting:
+                err = end.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    logger.warning(f"Proxy upstream: {os.strerror(err)}")
+                    self._close(end)
+                    return
+                end.connecting = False
+            if not self._flush(end):
+                return
+        if mask & selectors.EVENT_READ:
+            try:
+                data = end.sock.recv(_CHUNK)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                self._close(end)
+                return
+            if data:
+                end.peer.out += data
+                if not self._flush(end.peer):
+                    return
+            elif data == b"":
+                end.eof = True
+                if not self._flush(end.peer):
+                    return
+        if end.eof and end.peer.eof and not end.out and not end.peer.out:
+            self._close(end)
+            return
+        self._update(end)
+        self._update(end.peer)
+
+    def _flush(self, end: _End) -> bool:
+        """Sends what is buffered for ``end``; False if the connection closed."""
+        if end.connecting:
+            return True
+        try:
+            if end.out:
+                del end.out[: end.sock.send(end.out)]
+            # Half-close: the reply may still be flowing the other way.
+            if not end.out and end.peer.eof and not end.shut:
+                end.shut = True
+                end.sock.shutdown(socket.SHUT_WR)
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(end)
+            return False
+        return True
+
+    def _update(self, end: _End) -> None:
+        if end.connecting:
+            events = selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_WRITE if end.out else 0
+            # Back-pressure: no more reads while the other side is behind.
+            if not end.eof and len(end.peer.out) < _CHUNK:
+                events |= selectors.EVENT_READ
+        if events == end.events:
+            return
+        if not end.events:
+            self._selector.register(end.sock, events, end)
+        elif not events:
+            self._selector.unregister(end.sock)
+        else:
+            self._selector.modify(end.sock, events, end)
+        end.events = events
+
+    def _close(self, end: _End) -> None:
+        if end.sock.fileno() == -1:
+            return
+        for side in (end, end.peer):
+            if side.events:
+                self._selector.unregister(side.sock)
+                side.events = 0
+            side.sock.close()
+        if self._connections == self.max_connections:
+            for listener in self._listeners:
+                self._selector.register(listener.sock, selectors.EVENT_READ, listener)
+        self._connections -= 1
+
+
+@lru_cache
+def _get_loop() -> _ProxyLoop:
+    return _ProxyLoop(consts.PORT_PROXY_MAX_CONNECTIONS)
+
+
+class PortProxy:
+    """
+    Listens on ``port`` on all addresses and forwards connections to ``target``
+
+    SO_REUSEPORT: a new agent generation opens its proxy while the old one
+    still holds its own, so the port does not go dark during a handoff.
+    """
+
+    def __init__(self, port: int, target: int) -> None:
+        self.port = port
+        self.target = target
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            self.sock.bind(("0.0.0.0", port))
+            self.sock.listen(consts.LISTEN_BACKLOG)
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+        loop = _get_loop()
+        loop.call(lambda: loop.add_listener(self))
+
+    def close(self) -> None:
+        """Stops accepting; open connections run until either side ends them."""
+        loop = _get_loop()
+        loop.call(lambda: loop.remove_listener(self))
+
+
+_proxies: dict[int, PortProxy] = {}
+# Failures already logged: the sync runs twice a second.
+_failed: set[tuple[int, int]] = set()
+
+
+def sync_proxies() -> None:
+    """Brings the running proxies in line with the state's ``port_proxies``"""
+    wanted = port_proxies()
+    for port, proxy in list(_proxies.items()):
+        if wanted.get(port) != proxy.target:
+            proxy.close()
+            del _proxies[port]
+    for port, target in wanted.items():
+        if port not in _proxies:
+            try:
+                _proxies[port] = PortProxy(port, target)
+            except OSError as e:
+                if (port, target) not in _failed:
+                    _failed.add((port, target))
+                    logger.error(
+                        f"Cannot proxy port {port} to {target}: {e}", exc_info=False
+                    )
+                continue
+            _failed.discard((port, target))
+            logger.info(f"Proxying port {port} to container port {target}")
+
+
+def start_port_proxies(scheduler: "Scheduler") -> "PeriodicTask":
+    sync_proxies()
+    return scheduler.add("port-proxies", sync_proxies, consts.PORT_PROXY_INTERVAL)
@@ -0,0 +1,178 @@
+"""Recovery after a restart: containers with the agent's labels are managed again"""
+
+import json
+import time
+from typing import Any, Optional
+
+from src import consts
+from src.service.docker_api import list_containers
+from src.service.health import sync_state_with_docker
+from src.service.instances import _progress, watch_ssh
+from src.service.logs import DOCKER_SOCK_PATH
+from src.service.warm_pool import pool_owner
+from src.storage.state import (
+    InstanceState,
+    get_current_state,
+    lease_ports,
+    port_proxies,
+    release_ports,
+    save_state,
+)
+from src.utils.xlogging import get_logger
+
+logger = get_logger(__name__)
+
+# Docker status -> instance status (as in sync_state_with_docker)
+_STATUSES = {
+    "running": "running",
+    "restarting": "running",
+    "paused": "paused",
+    "exited": "paused",
+    "created": "paused",
+}
+
+
+def _published(container: dict[str, Any]) -> dict[str, str]:
+    # IPv4 and IPv6 give one entry per port each; a stopped container lists
+    # no ports, so take them from the label.
+    published = {
+        str(port["PrivatePort"]): str(port["PublicPort"])
+        for port in container.get("Ports") or ()
+        if port.get("PublicPort")
+    }
+    if published:
+        return published
+    label = (container.get("Labels") or {}).get(consts.CONTAINER_LABEL_PORTS)
+    try:
+        return json.loads(label) if label else {}
+    except ValueError:
+        return {}
+
+
+def _instance_id(container: dict[str, Any]) -> Optional[str]:
+    return (container.get("Labels") or {}).get(consts.CONTAINER_LABEL_INSTANCE)
+
+
+def _match(
+    state: InstanceState, containers: list[dict[str, Any]]
+) -> tuple[Optional[dict[str, Any]], bool]:
+    """The current instance's container, and whether its record was lost"""
+    for container in containers:
+        if state.container_id and container["Id"] == state.container_id:
+            return container, False
+        if state.instance_id and _instance_id(container) == state.instance_id:
+            return container, False
+    if state.status != "destroyed":
+        return None, False
+    # The agent died between docker run and saving the state: the container
+    # is alive but unmanaged. Take the newest running one.
+    running = [c for c in containers if c.get("State") == "running" and _instance_id(c)]
+    if not running:
+        return None, False
+    return max(running, key=lambda c: c.get("Created", 0)), True
+
+
+def recover(
+    sock_path: str = DOCKER_SOCK_PATH, timeout: float = consts.RECOVERY_TIMEOUT
+) -> dict[str, Any]:
+    """
+    Reconciles the saved state with Docker's containers before the agent is ready
+
+    One container list call, one state write and one port lease transaction,
+    however many containers there are. If Docker does not answer, the state
+    is left alone: an empty list here does not mean there are no containers.
+
+    Returns:
+        recovery summary
+    """
+    started = time.monotonic()
+    _progress("recover", "started")
+    try:
+        containers = list_containers(sock_path=sock_path, timeout=timeout)
+    except Exception as e:
+        logger.error(f"Recovery skipped, Docker is not available: {e}", exc_info=False)
+        _progress("recover", "failed", error=str(e))
+        return {
+            "ok": False,
+            "error": str(e),
+            "seconds": round(time.monotonic() - started, 3),
+        }
+
+    state = get_current_state()
+    current, adopted = _match(state, containers)
+    if current is None:
+        if state.status != "destroyed":
+            # An unlabelled (older) or removed container: check by id.
+            sync_state_with_docker()
+        recovered = get_current_state()
+    else:
+        instance_id = _instance_id(current) or state.instance_id
+        same = instance_id == state.instance_id
+        ports = _published(current)
+        # Requested ports of a pooled container may be served by the proxy
+        # (see warm_pool): the record keeps what the renter sees.
+        pooled = consts.CONTAINER_LABEL_POOL in (current.get("Labels") or {})
+        if same and state.allocated_ports and (pooled or not ports):
+            ports = state.allocated_ports
+        recovered = InstanceState(
+            instance_id=instance_id,
+            container_id=current["Id"],
+            status=_STATUSES.get(current.get("State"), "error"),
+            luks_device_path=state.luks_device_path if same else None,
+            luks_mapper_name=state.luks_mapper_name if same else None,
+            allocated_ports=ports or None,
+        )
+        if adopted:
+            logger.warning(
+                f"Adopting container {current['Id'][:12]} of instance {instance_id}"
+            )
+        if recovered != state:
+            save_state(recovered)
+
+    # Containers the state does not know hold ports too: a new instance must
+    # not get a port they take when they start.
+    if state.instance_id and state.instance_id != recovered.instance_id:
+        release_ports(state.instance_id)
+    leases = {}
+    if recovered.instance_id:
+        ports = {int(port) for port in (recovered.allocated_ports or {}).values()}
+        ports.update(int(port) for port in _published(current or {}).values())
+        ports.update(port_proxies())
+        leases[recovered.instance_id] = sorted(ports)
+    orphans = []
+    for container in containers:
+        if container is current:
+            continue
+        pool = (container.get("Labels") or {}).get(consts.CONTAINER_LABEL_POOL)
+        if pool and container.get("State") == "created":
+            owner = pool_owner(pool)
+        else:
+            orphans.append(container["Id"][:12])
+            owner = _instance_id(container) or container["Id"]
+        leases.setdefault(owner, []).extend(
+            int(port) for port in _published(container).values()
+        )
+    lease_ports(leases, replace=True)
+    if orphans:
+        logger.warning(
+            f"{len(orphans)} labelled containers do not belong to the current "
+            f"instance: {', '.join(orphans[:10])}"
+        )
+
+    ssh_port = (recovered.allocated_ports or {}).get("22")
+    labels = (current or {}).get("Labels") or {}
+    ssh = consts.CONTAINER_LABEL_SSH in labels
+    if recovered.status == "running" and ssh_port and ssh:
+        watch_ssh(recovered.instance_id, int(ssh_port), "recover")
+
+    summary = {
+        "ok": True,
+        "containers": len(containers),
+        "status": recovered.status,
+        "adopted": adopted,
+        "orphans": len(orphans),
+        "leased_ports": sum(len(ports) for ports in leases.values()),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    _progress("recover", "completed", instance_id=recovered.instance_id, **summary)
+    return summary
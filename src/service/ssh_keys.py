@@ -1,70 +1,253 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterable, Optional
 
+from src import consts
 from src.utils.xlogging import get_logger
 
 logger = get_logger(__name__)
-AUTHORIZED_KEYS_PATH = Path("/root/.ssh/authorized_keys")
-
-
-def _read_keys() -> set[str]:
-    if not AUTHORIZED_KEYS_PATH.exists():
-        return set()
-    try:
-        content = AUTHORIZED_KEYS_PATH.read_text(encoding="utf-8")
-        return {line.strip() for line in content.splitlines() if line.strip()}
-    except IOError as e:
-        logger.error(f"Failed to read authorized_keys file: {e}")
-        return set()
-
-
-def _write_keys(keys: set[str]) -> bool:
+# Mounted as /root/.ssh in the instance, see ssh_setup.ssh_run_args.
+AUTHORIZED_KEYS_PATH = Path(consts.SSH_KEYS_DIR) / "authorized_keys"
+
+KEY_TYPES = frozenset(
+    {
+        "ssh-ed25519",
+        "ssh-rsa",
+        "ecdsa-sha2-nistp256",
+        "ecdsa-sha2-nistp384",
+        "ecdsa-sha2-nistp521",
+        "sk-ssh-ed25519@openssh.com",
+        "sk-ecdsa-sha2-nistp256@openssh.com",
+    }
+)
+
+
+class InvalidKey(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class PublicKey:
+    key_type: str
+    blob: bytes
+    comment: str
+    fingerprint: str
+    # authorized_keys options such as ``command="...",no-pty``, kept verbatim.
+    options: str = ""
+
+    @property
+    def line(self) -> str:
+        data = base64.b64encode(self.blob).decode()
+        key = f"{self.key_type} {data} {self.comment}".rstrip()
+        return f"{self.options} {key}" if self.options else key
+
+
+def _split_options(line: str) -> tuple[str, str]:
+    """Options prefix of an authorized_keys line (quotes may hold spaces)."""
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"' and line[i - 1 : i] != "\\":
+            quoted = not quoted
+        elif char in " \t" and not quoted:
+            return line[:i], line[i:].lstrip()
+    return line, ""
+
+
+def parse_key(line: str) -> PublicKey:
+    options, rest = "", line.strip()
+    if rest and rest.split(None, 1)[0] not in KEY_TYPES:
+        options, rest = _split_options(rest)
+    parts = rest.split(None, 2)
+    if len(parts) < 2 or parts[0] not in KEY_TYPES:
+        raise InvalidKey(f"Unsupported or malformed key: {line[:40]!r}")
+    key_type, data = parts[0], parts[1]
     try:
-        AUTHORIZED_KEYS_PATH.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
-
-        content = "\n".join(sorted(list(keys))) + "\n"
-
-        AUTHORIZED_KEYS_PATH.write_text(content, encoding="utf-8")
-
-        AUTHORIZED_KEYS_PATH.chmod(0o600)
-
-        logger.info(f"Succesfully write {len(keys)} keys to authorized_keys")
-        return True
-
-    except IOError as e:
-        logger.error(f"Failed to write authorized_keys file: {e}")
-        return False
+        blob = base64.b64decode(data, validate=True)
+        (length,) = struct.unpack(">I", blob[:4])
+        embedded_type = blob[4 : 4 + length].decode()
+    except (binascii.Error, struct.error, UnicodeDecodeError):
+        raise InvalidKey(f"Key data is not valid base64: {line[:40]!r}") from None
+    if embedded_type != key_type:
+        raise InvalidKey(f"Key type mismatch: {key_type} vs {embedded_type}")
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode().rstrip("=")
+    comment = parts[2].strip() if len(parts) > 2 else ""
+    return PublicKey(key_type, blob, comment, f"SHA256:{digest}", options)
+
+
+class KeyStore:
+    """authorized_keys indexed by fingerprint.
+
+    Every change is applied as one batch under an advisory lock and written
+    with write-temp-and-rename, so concurrent workers never lose keys and
+    sshd never sees a half-written file.
+    """
+
+    def __init__(self, path: Path = AUTHORIZED_KEYS_PATH) -> None:
+        self.path = path
+        self._lock_path = path.with_name(f".{path.name}.lock")
+        self._keys: dict[str, PublicKey] = {}
+        self._stat: Optional[tuple[int, int, int]] = None
+
+    def _file_stat(self) -> Optional[tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def keys(self) -> dict[str, PublicKey]:
+        stat = self._file_stat()
+        if stat == self._stat:
+            return self._keys
+        keys: dict[str, PublicKey] = {}
+        if stat is not None:
+            for line in self.path.read_text(encoding="utf-8").splitlines():
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                try:
+                    key = parse_key(line)
+                except InvalidKey as e:
+                    logger.warning(f"Skipping authorized_keys entry: {e}")
+                    continue
+                keys[key.fingerprint] = key
+        self._keys, self._stat = keys, stat
+        return keys
+
+    def apply(
+        self,
+        add: Iterable[PublicKey] = (),
+        remove: Iterable[str] = (),
+        replace: Optional[Iterable[PublicKey]] = None,
+    ) -> dict[str, list[str]]:
+        """Applies a batch; ``remove`` holds fingerprints. Returns the diff."""
+        self.path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = self.keys()
+            if replace is not None:
+                updated = {key.fingerprint: key for key in replace}
+            else:
+                updated = dict(current)
+                for fingerprint in remove:
+                    updated.pop(fingerprint, None)
+                for key in add:
+                    updated.setdefault(key.fingerprint, key)
+
+            diff = {
+                "added": [fp for fp in updated if fp not in current],
+                "removed": [fp for fp in current if fp not in updated],
+            }
+            if diff["added"] or diff["removed"]:
+                self._write(updated)
+                logger.info(
+                    f"authorized_keys updated: +{len(diff['added'])} "
+                    f"-{len(diff['removed'])}, {len(updated)} keys total"
+                )
+            return diff
+
+    def _write(self, keys: dict[str, PublicKey]) -> None:
+        content = "".join(f"{key.line}\n" for key in keys.values())
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f".{self.path.name}.", dir=self.path.parent
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        dir_fd = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._keys, self._stat = keys, self._file_stat()
+
+
+_store: Optional[KeyStore] = None
+
+
+def get_key_store() -> KeyStore:
+    global _store
+    if _store is None or _store.path != AUTHORIZED_KEYS_PATH:
+        _store = KeyStore(AUTHORIZED_KEYS_PATH)
+    return _store
+
+
+def _fingerprint_of(value: str) -> str:
+    value = value.strip()
+    return value if value.startswith("SHA256:") else parse_key(value).fingerprint
+
+
+def sync_ssh_keys(
+    add: Iterable[str] = (),
+    remove: Iterable[str] = (),
+    replace: Optional[Iterable[str]] = None,
+) -> dict[str, list[str]]:
+    """Bulk change; keys are validated before anything is written.
+
+    ``remove`` accepts key lines or ``SHA256:`` fingerprints.
+    Raises InvalidKey on the first malformed entry.
+    """
+    parsed_add = [parse_key(line) for line in add]
+    fingerprints = [_fingerprint_of(value) for value in remove]
+    parsed_replace = None if replace is None else [parse_key(k) for k in replace]
+    return get_key_store().apply(parsed_add, fingerprints, parsed_replace)
+
+
+def list_ssh_keys() -> list[dict[str, str]]:
+    return [
+        {"fingerprint": fp, "type": key.key_type, "comment": key.comment}
+        for fp, key in get_key_store().keys().items()
+    ]
 
 
 def add_ssh_pubkey(pubkey: str) -> bool:
+    """False for an invalid key; OSError is raised, the file is not changed."""
     pubkey = pubkey.strip()
     if not pubkey:
         return False
 
     logger.info(f"Attempting to add ssh public key: {pubkey[:30]}")
-    current_keys = _read_keys()
-    if pubkey not in current_keys:
+    try:
+        diff = sync_ssh_keys(add=[pubkey])
+    except InvalidKey as e:
+        logger.warning(f"Rejected ssh public key: {e}")
+        return False
+    if not diff["added"]:
         logger.warning("SSH key already exists")
-        return True
-
-    current_keys.add(pubkey)
-    return _write_keys(current_keys)
+    return True
 
 
 def remove_ssh_pubkey(pubkey: str) -> bool:
+    """False for an invalid key; OSError is raised, the file is not changed."""
     pubkey = pubkey.strip()
     if not pubkey:
         return False
 
     logger.info(f"Attempting to remove ssh public key: {pubkey[:30]}")
-    current_keys = _read_keys()
-    if pubkey not in current_keys:
+    try:
+        diff = sync_ssh_keys(remove=[pubkey])
+    except InvalidKey as e:
+        logger.warning(f"Rejected ssh public key: {e}")
+        return False
+    if not diff["removed"]:
         logger.warning("SSH key not found")
-        return True
-
-    current_keys.remove(pubkey)
-    return _write_keys(current_keys)
+    return True
 
 
-def clear_ssh_keys() -> bool:
+def clear_ssh_keys() -> None:
+    """Raises OSError if the file cannot be written."""
     logger.warning("Clearing all ssh keys")
-    return _write_keys(set())
+    sync_ssh_keys(replace=[])
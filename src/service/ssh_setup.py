@@ -1,104 +1,162 @@
-"""Настройка SSH в контейнерах"""
+"""SSH setup in containers"""
 
-from typing import Tuple, Optional
+import json
+import os
+import shlex
+import shutil
+import socket
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional, Tuple
 
+from src import consts
 from src.utils.system import run_command
 from src.utils.xlogging import get_logger
 
 logger = get_logger(__name__)
 
+BUNDLE_VERSION = "2"
 
-def setup_ssh_in_container(container_id: str) -> Tuple[bool, Optional[str]]:
-    """
-    Устанавливает и настраивает SSH сервер в контейнере
-    
-    Args:
-        container_id: ID контейнера Docker
-        
-    Returns:
-        (success, error_message)
-    """
-    if not container_id:
-        err = "No container ID provided"
-        logger.error(err)
-        return False, err
-    
-    logger.info(f"Setting up SSH in container {container_id[:12]}")
-    
-    # Команды для установки и настройки SSH
-    setup_commands = [
-        # Обновление списка пакетов
-        "apt-get update -qq",
-        
-        # Установка OpenSSH сервера без интерактивных запросов
-        "DEBIAN_FRONTEND=noninteractive apt-get install -y -qq openssh-server",
-        
-        # Создание директории для SSH daemon
-        "mkdir -p /var/run/sshd",
-        
-        # Разрешение root login через SSH
-        "sed -i 's/#PermitRootLogin prohibit-password/PermitRootLogin prohibit-password/' /etc/ssh/sshd_config",
-        "sed -i 's/#PubkeyAuthentication yes/PubkeyAuthentication yes/' /etc/ssh/sshd_config",
-        
-        # Создание директории .ssh для root
-        "mkdir -p /root/.ssh",
-        "chmod 700 /root/.ssh",
-        "touch /root/.ssh/authorized_keys",
-        "chmod 600 /root/.ssh/authorized_keys",
-    ]
-    
-    for cmd in setup_commands:
-        logger.info(f"Executing: {cmd}")
-        success, _, stderr = run_command(
-            ["docker", "exec", container_id, "sh", "-c", cmd]
-        )
-        
-        if not success:
-            # Некоторые команды могут выдавать warnings, но работать
-            if "unable to resolve host" in stderr.lower():
-                logger.warning(f"Warning during SSH setup: {stderr}")
-                continue
-            
-            logger.error(f"Failed to execute command '{cmd}': {stderr}")
-            # Продолжаем даже при ошибках некоторых команд
-    
-    # Запуск SSH daemon
-    logger.info("Starting SSH daemon")
-    success, _, stderr = run_command(
-        ["docker", "exec", "-d", container_id, "/usr/sbin/sshd", "-D"]
-    )
-    
+# The bundle is shared by every instance, so it holds no host key: dropbear
+# -R generates one in the container on the first connection. It lives in
+# the container's own filesystem and goes away with it.
+INIT_SCRIPT = """#!/bin/sh
+B={mount}
+mkdir -p /etc/dropbear 2>/dev/null
+"$B/lib/ld.so" --library-path "$B/lib" "$B/bin/dropbear" \\
+    -R -p 22 -s -P /tmp/.qudata-sshd.pid \\
+    || echo "qudata: sshd failed to start" >&2
+if [ "$#" -eq 0 ]; then
+    while :; do sleep 3600; done
+fi
+exec "$@"
+"""
+
+
+def _bundle_ready(bundle: Path) -> bool:
+    try:
+        return (bundle / ".version").read_text().strip() == BUNDLE_VERSION
+    except OSError:
+        return False
+
+
+def _shared_libraries(binary: str) -> list[Path]:
+    success, stdout, stderr = run_command(["ldd", binary])
     if not success:
-        err = f"Failed to start SSH daemon: {stderr}"
+        raise RuntimeError(f"ldd {binary} failed: {stderr}")
+    libraries = []
+    for line in stdout.splitlines():
+        # "libc.so.6 => /lib/x86_64-linux-gnu/libc.so.6 (0x...)" or
+        # "/lib64/ld-linux-x86-64.so.2 (0x...)"
+        parts = line.split()
+        path = parts[2] if "=>" in parts and len(parts) > 2 else parts[0]
+        if path.startswith("/"):
+            libraries.append(Path(path))
+    return libraries
+
+
+def _build_bundle(bundle: Path) -> None:
+    dropbear = shutil.which("dropbear") or "/usr/sbin/dropbear"
+    if not os.access(dropbear, os.X_OK):
+        raise RuntimeError("dropbear is not installed on the host")
+
+    staging = Path(tempfile.mkdtemp(prefix=".sshd-", dir=bundle.parent))
+    try:
+        _populate_bundle(staging, dropbear)
+        if bundle.exists():
+            shutil.rmtree(bundle)
+        os.replace(staging, bundle)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _populate_bundle(staging: Path, dropbear: str) -> None:
+    (staging / "bin").mkdir()
+    (staging / "lib").mkdir()
+    shutil.copy2(dropbear, staging / "bin" / "dropbear")
+    for library in _shared_libraries(dropbear):
+        name = "ld.so" if library.name.startswith("ld-") else library.name
+        shutil.copy2(library.resolve(), staging / "lib" / name)
+    if not (staging / "lib" / "ld.so").exists():
+        raise RuntimeError("dynamic loader of dropbear not found")
+
+    init = staging / "init"
+    init.write_text(INIT_SCRIPT.format(mount=consts.SSHD_BUNDLE_MOUNT))
+    init.chmod(0o755)
+    (staging / ".version").write_text(BUNDLE_VERSION)
+
+
+def ensure_sshd_bundle(
+    bundle: Path = Path(consts.SSHD_BUNDLE_DIR),
+) -> Tuple[bool, Optional[str]]:
+    """Builds a portable sshd (dropbear and its libraries) once per host"""
+    if _bundle_ready(bundle):
+        return True, None
+    logger.info(f"Building sshd bundle at {bundle}")
+    try:
+        bundle.parent.mkdir(parents=True, exist_ok=True)
+        _build_bundle(bundle)
+    except (OSError, RuntimeError) as e:
+        err = f"Failed to build sshd bundle: {e}"
         logger.error(err)
         return False, err
-    
-    logger.info(f"SSH daemon started successfully in container {container_id[:12]}")
     return True, None
 
 
-def restart_ssh_in_container(container_id: str) -> Tuple[bool, Optional[str]]:
-    """Перезапускает SSH сервер в контейнере"""
-    if not container_id:
-        err = "No container ID provided"
-        logger.error(err)
-        return False, err
-    
-    logger.info(f"Restarting SSH in container {container_id[:12]}")
-    
-    # Останавливаем все процессы sshd
-    run_command(["docker", "exec", container_id, "pkill", "-9", "sshd"])
-    
-    # Запускаем заново
-    success, _, stderr = run_command(
-        ["docker", "exec", "-d", container_id, "/usr/sbin/sshd", "-D"]
-    )
-    
+def _image_command(image: str, pull: bool = True) -> Tuple[list[str], list[str]]:
+    inspect = [
+        "docker", "image", "inspect", "--format",
+        "{{json .Config.Entrypoint}}\t{{json .Config.Cmd}}", image,
+    ]
+    success, stdout, stderr = run_command(inspect)
+    if not success and pull:
+        # `docker run` would pull the image anyway; do it up front.
+        success, _, stderr = run_command(["docker", "pull", image])
+        if success:
+            success, stdout, stderr = run_command(inspect)
     if not success:
-        err = f"Failed to restart SSH daemon: {stderr}"
-        logger.error(err)
-        return False, err
-    
-    logger.info(f"SSH daemon restarted successfully in container {container_id[:12]}")
-    return True, None
+        raise RuntimeError(f"Failed to inspect image {image}: {stderr}")
+    entrypoint, cmd = stdout.split("\t")
+    return json.loads(entrypoint) or [], json.loads(cmd) or []
+
+
+def ssh_run_args(
+    image: str, command: Optional[str] = None
+) -> Tuple[list[str], list[str]]:
+    """
+    ``docker run`` arguments for SSH without installing packages in the container
+
+    Returns:
+        (options before the image name, command after the image name)
+    """
+    ok, err = ensure_sshd_bundle()
+    if not ok:
+        raise RuntimeError(err)
+    Path(consts.SSH_KEYS_DIR).mkdir(parents=True, exist_ok=True, mode=0o700)
+
+    entrypoint, cmd = _image_command(image)
+    args = entrypoint + (shlex.split(command) if command else cmd)
+    options = [
+        "-v", f"{consts.SSHD_BUNDLE_DIR}:{consts.SSHD_BUNDLE_MOUNT}:ro",
+        "-v", f"{consts.SSH_KEYS_DIR}:/root/.ssh:ro",
+        "--entrypoint", f"{consts.SSHD_BUNDLE_MOUNT}/init",
+    ]
+    return options, args
+
 
+def wait_for_ssh(
+    port: int, host: str = "127.0.0.1", timeout: float = 10.0
+) -> Optional[float]:
+    """Waits for the SSH banner on the port; returns the wait time or None"""
+    started = time.monotonic()
+    deadline = started + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5) as s:
+                if s.recv(4).startswith(b"SSH-"):
+                    return time.monotonic() - started
+        except OSError:
+            pass
+        time.sleep(0.02)
+    return None
@@ -2,6 +2,7 @@ import shutil
 import subprocess
 from typing import Dict, List, Tuple
 
+from src import consts
 from src.utils.system import run_command
 from src.utils.xlogging import get_logger
 
@@ -17,6 +18,7 @@ REQUIRED_COMMANDS = {
 OPTIONAL_COMMANDS = {
     "ethtool": "Network tools",
     "dmidecode": "Hardware info tools",
+    "dropbear": "SSH server for instances",
 }
 
 
@@ -35,7 +37,7 @@ def check_docker_nvidia() -> bool:
                 "--rm",
                 "--gpus",
                 "all",
-                "nvidia/cuda:11.0-base",
+                consts.GPU_CHECK_IMAGE,
                 "nvidia-smi",
             ]
         )
@@ -137,7 +139,14 @@ def get_system_status() -> Dict[str, bool]:
         status["docker_running"] = success
 
         if check_command("nvidia-smi"):
-            status["docker_nvidia"] = check_docker_nvidia()
+            # The container smoke test takes up to a minute; use the last
+            # background result (None until the first run).
+            from src.service.health import deep_health
+
+            deep = deep_health()
+            status["docker_nvidia"] = (
+                deep["checks"]["gpu_container"]["ok"] if deep else None
+            )
 
     return status
 
@@ -0,0 +1,423 @@
+"""Warm pool: created, stopped containers of popular images, made in advance"""
+
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from src import consts, runtime
+from src.server.models import CreateInstance
+from src.service.docker_api import list_containers
+from src.service.live_metrics import live_metrics
+from src.service.ssh_setup import _image_command, ssh_run_args
+from src.storage.state import create_stats, lease_ports, leased_ports, release_ports
+from src.utils.ports import _port_is_free, get_free_port
+from src.utils.system import run_command
+from src.utils.xlogging import get_logger
+
+if TYPE_CHECKING:
+    from src.utils.scheduler import PeriodicTask, Scheduler
+
+logger = get_logger(__name__)
+
+# The renter's env is only known at claim time. docker cp needs the archive
+# route, which the Docker policy forbids, so each pooled container is created
+# with its own host directory bind-mounted here: the agent writes the env file
+# into it at claim, the entrypoint sources and deletes the file before exec.
+# The image may run as any user: the directory is writable and the file
+# readable by all, host users are kept out by the 0700 parent. An env that
+# cannot be read stops the container rather than run it without the env.
+ENV_MOUNT = "/.qudata-env"
+ENV_FILE = f"{ENV_MOUNT}/env"
+_ENV_LOADER = (
+    f"if [ -f {ENV_FILE} ]; then "
+    f"if [ ! -r {ENV_FILE} ]; then echo 'cannot read {ENV_FILE}' >&2; exit 126; fi; "
+    f"set -a; . {ENV_FILE}; set +a; rm -f {ENV_FILE}; fi; "
+    'exec "$@"'
+)
+# What docker run -e accepts as a name that a shell can also assign.
+_ENV_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+@dataclass(frozen=True)
+class PoolSpec:
+    """
+    One pooled image
+
+    The pooled container's entrypoint is /bin/sh, which loads the renter's
+    env before it runs the image's own: images without /bin/sh (distroless,
+    scratch) cannot be pooled, their containers fail on claim.
+    """
+
+    image: str
+    tag: str = "latest"
+    size: int = 1
+    ports: tuple[str, ...] = ()
+    gpus: int = 0
+    ssh: bool = False
+    command: Optional[str] = None
+
+    @property
+    def image_full_name(self) -> str:
+        return f"{self.image}:{self.tag}"
+
+    @property
+    def container_ports(self) -> set[str]:
+        return set(self.ports) | ({"22"} if self.ssh else set())
+
+    @property
+    def key(self) -> str:
+        # Without size: resizing the pool does not orphan its containers.
+        fields = json.dumps(dict(asdict(self), size=None), sort_keys=True)
+        return hashlib.sha1(fields.encode()).hexdigest()[:12]
+
+    def matches(self, params: CreateInstance, gpus: int) -> bool:
+        requested = set(params.ports or ()) | ({"22"} if params.ssh_enabled else set())
+        return (
+            self.image == params.image
+            and self.tag == params.image_tag
+            and self.gpus == gpus
+            and self.ssh == params.ssh_enabled
+            and (self.command or None) == (params.command or None)
+            and self.container_ports == requested
+        )
+
+
+def pool_owner(key: str) -> str:
+    """Port lease owner of pooled containers until they are claimed"""
+    return f"pool:{key}"
+
+
+def load_specs(path: Optional[str] = None) -> list[PoolSpec]:
+    path = path or runtime.warm_pool_config()
+    try:
+        items = json.loads(Path(path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logger.error(f"Warm pool config {path} is unreadable: {e}", exc_info=False)
+        return []
+    specs = []
+    for item in items if isinstance(items, list) else ():
+        try:
+            ports = tuple(str(port) for port in item.pop("ports", ()))
+            specs.append(PoolSpec(ports=ports, **item))
+        except (TypeError, AttributeError) as e:
+            logger.error(f"Skipping warm pool entry {item!r}: {e}", exc_info=False)
+    return specs
+
+
+def _env_dir(env_key: str) -> Path:
+    return Path(runtime.warm_pool_env_dir()) / env_key
+
+
+def _remove_env_dir(container: dict[str, Any]) -> None:
+    env_key = container["Labels"].get(consts.CONTAINER_LABEL_ENV)
+    if env_key:
+        shutil.rmtree(_env_dir(env_key), ignore_errors=True)
+
+
+def _sweep_env_dirs() -> None:
+    """Removes the env directories of containers that are gone"""
+    root = Path(runtime.warm_pool_env_dir())
+    try:
+        names = {path.name for path in root.iterdir()}
+    except FileNotFoundError:
+        return
+    if not names:
+        return
+    containers = list_containers({"label": [consts.CONTAINER_LABEL_ENV]})
+    names -= {c["Labels"][consts.CONTAINER_LABEL_ENV] for c in containers}
+    for name in names:
+        shutil.rmtree(root / name, ignore_errors=True)
+
+
+def _pool_containers() -> list[dict[str, Any]]:
+    """Unclaimed pooled containers: never started yet"""
+    return list_containers(
+        {"label": [consts.CONTAINER_LABEL_POOL], "status": ["created"]}
+    )
+
+
+def _entrypoint(spec: PoolSpec) -> tuple[list[str], list[str]]:
+    if spec.ssh:
+        options, args = ssh_run_args(spec.image_full_name, spec.command)
+        # The sshd entrypoint runs after the env is loaded.
+        i = options.index("--entrypoint")
+        args = [options[i + 1], *args]
+        options = options[:i] + options[i + 2 :]
+    else:
+        entrypoint, cmd = _image_command(spec.image_full_name, pull=False)
+        options = []
+        args = entrypoint + (shlex.split(spec.command) if spec.command else cmd)
+    return [*options, "--entrypoint", "/bin/sh"], ["-c", _ENV_LOADER, "sh", *args]
+
+
+def _create(spec: PoolSpec) -> Optional[str]:
+    taken = leased_ports()
+    ports = {}
+    for container_port in sorted(spec.container_ports):
+        ports[container_port] = get_free_port(taken)
+        taken.add(ports[container_port])
+    # Lease before docker create: the ports are not bound until it starts.
+    owner = pool_owner(spec.key)
+    lease_ports({owner: list(ports.values())})
+
+    command = [
+        "docker",
+        "create",
+        "--rm",
+        "--label",
+        f"{consts.CONTAINER_LABEL}=1",
+        "--label",
+        f"{consts.CONTAINER_LABEL_POOL}={spec.key}",
+        "--label",
+        f"{consts.CONTAINER_LABEL_PORTS}="
+        f"{json.dumps({port: str(host) for port, host in ports.items()})}",
+    ]
+    if spec.ssh:
+        command.extend(["--label", f"{consts.CONTAINER_LABEL_SSH}=1"])
+    if spec.gpus > 0:
+        command.append(f"--gpus=count={spec.gpus}")
+    for container_port, host_port in ports.items():
+        command.extend(["-p", f"{host_port}:{container_port}"])
+    try:
+        options, args = _entrypoint(spec)
+    except (RuntimeError, ValueError) as e:
+        release_ports(owner, list(ports.values()))
+        logger.error(
+            f"Cannot prepare a warm {spec.image_full_name}: {e}", exc_info=False
+        )
+        return None
+    env_key = uuid.uuid4().hex
+    env_dir = _env_dir(env_key)
+    try:
+        env_dir.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+        env_dir.mkdir()
+        # Not subject to the umask: the image's user deletes the env file.
+        env_dir.chmod(0o777)
+    except OSError as e:
+        release_ports(owner, list(ports.values()))
+        logger.error(f"Cannot create {env_dir}: {e}", exc_info=False)
+        return None
+    command.extend(["--label", f"{consts.CONTAINER_LABEL_ENV}={env_key}"])
+    command.extend(["-v", f"{env_dir}:{ENV_MOUNT}"])
+    command.extend([*options, spec.image_full_name, *args])
+
+    success, container_id, stderr = run_command(command)
+    if not success or not container_id:
+        release_ports(owner, list(ports.values()))
+        shutil.rmtree(env_dir, ignore_errors=True)
+        logger.error(f"Failed to create a warm {spec.image_full_name}: {stderr}")
+        return None
+    return container_id.strip()
+
+
+def _cached(spec: PoolSpec) -> bool:
+    success, _, _ = run_command(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", spec.image_full_name]
+    )
+    return success
+
+
+def _held_back(ready: dict[str, int], created: int) -> Optional[str]:
+    """Why no pooled container should be created now, or None"""
+    if sum(ready.values()) >= consts.WARM_POOL_MAX_CONTAINERS:
+        return "pool is full"
+    if created >= consts.WARM_POOL_REFILL_BATCH:
+        return "batch done"
+    usage = shutil.disk_usage("/")
+    free = usage.free / usage.total * 100
+    if free < consts.HEALTH_MIN_FREE_DISK:
+        return f"{free:.1f}% disk free"
+    live = live_metrics()
+    if live and live["system"]["cpu_util"] > consts.WARM_POOL_MAX_CPU:
+        return f"CPU at {live['system']['cpu_util']}%"
+    return None
+
+
+def refill() -> dict[str, Any]:
+    """
+    Tops the pool up to the sizes in the config
+
+    Pooled containers no longer in the config, or made before their env
+    was bind-mounted, are removed, and so are the env directories of
+    containers that are gone. At most
+    WARM_POOL_REFILL_BATCH are created per call, only for images already on
+    the host, and only while the pool is under WARM_POOL_MAX_CONTAINERS.
+    """
+    specs = {spec.key: spec for spec in load_specs()}
+    containers = _pool_containers() if specs else []
+    ready: dict[str, int] = {key: 0 for key in specs}
+    for container in containers:
+        key = container["Labels"][consts.CONTAINER_LABEL_POOL]
+        if key in ready and consts.CONTAINER_LABEL_ENV in container["Labels"]:
+            ready[key] += 1
+            continue
+        run_command(["docker", "rm", "-f", container["Id"]])
+        release_ports(pool_owner(key))
+        _remove_env_dir(container)
+        logger.info(f"Removed warm container {container['Id'][:12]} of an old spec")
+    _sweep_env_dirs()
+
+    created = 0
+    reason = None
+    for key, spec in specs.items():
+        while ready[key] < spec.size:
+            reason = _held_back(ready, created)
+            if reason:
+                break
+            if not _cached(spec):
+                reason = f"{spec.image_full_name} is not cached"
+                break
+            if _create(spec) is None:
+                break
+            ready[key] += 1
+            created += 1
+    report = {"ready": ready, "created": created, "held_back": reason}
+    if created or reason:
+        logger.info(f"Warm pool refill: {json.dumps(report)}")
+    return report
+
+
+def _valid_env(env: dict[str, str]) -> bool:
+    return all(_ENV_NAME.fullmatch(key) for key in env)
+
+
+def _write_env(env_key: str, env: dict[str, str]) -> tuple[bool, str]:
+    if not _valid_env(env):
+        return False, "invalid env variable name"
+    # The container has never run, so nothing in its directory can be a link.
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW
+    try:
+        fd = os.open(_env_dir(env_key) / "env", flags, 0o644)
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for key, value in env.items():
+                f.write(f"{key}={shlex.quote(str(value))}\n")
+    except OSError as e:
+        return False, str(e)
+    return True, ""
+
+
+def claim(
+    params: CreateInstance, cpu_cores: str, memory_gb: str, gpus: int
+) -> Optional[tuple[str, dict[str, str], dict[int, int]]]:
+    """
+    Claims a pooled container for the request and starts it
+
+    The env is written to the container's bind-mounted env directory
+    (no docker cp: the policy forbids the archive route), docker update
+    sets the CPU and memory limits. An explicitly requested port that
+    differs from the container's is served by the agent's proxy. An env
+    name a shell cannot assign is a miss: docker run handles it.
+
+    Returns:
+        (container id, renter's ports, proxies {port: container port}),
+        or None if no container fits
+    """
+    spec = next((s for s in load_specs() if s.matches(params, gpus)), None)
+    if spec is None:
+        return None
+    env = {
+        key: value
+        for key, value in (params.env_variables or {}).items()
+        if key != "QUDATA_WRAPPED_DEK"
+    }
+    if not _valid_env(env):
+        return None
+    try:
+        containers = [
+            c
+            for c in _pool_containers()
+            if c["Labels"].get(consts.CONTAINER_LABEL_POOL) == spec.key
+            and consts.CONTAINER_LABEL_ENV in c["Labels"]
+        ]
+    except Exception as e:
+        logger.error(f"Warm pool is not available: {e}", exc_info=False)
+        return None
+    if not containers:
+        return None
+    container = min(containers, key=lambda c: c.get("Created", 0))
+    container_id = container["Id"]
+    pooled = json.loads(container["Labels"][consts.CONTAINER_LABEL_PORTS])
+
+    allocated_ports, proxies = {}, {}
+    requested = dict(params.ports or {})
+    if params.ssh_enabled:
+        requested.setdefault("22", "auto")
+    leased = leased_ports()
+    for container_port, host_port_def in requested.items():
+        pooled_port = str(pooled[container_port])
+        host_port = str(host_port_def)
+        if host_port.lower() in ("auto", pooled_port):
+            host_port = pooled_port
+        elif int(host_port) in leased or not _port_is_free(int(host_port)):
+            # docker run tells the renter the port is taken.
+            return None
+        else:
+            proxies[int(host_port)] = int(pooled_port)
+        allocated_ports[container_port] = host_port
+
+    env_key = container["Labels"][consts.CONTAINER_LABEL_ENV]
+    success, stderr = _write_env(env_key, env) if env else (True, "")
+    if success:
+        # As docker run without --memory-swap: swap is twice the memory.
+        success, _, stderr = run_command(
+            [
+                "docker",
+                "update",
+                f"--cpus={cpu_cores}",
+                f"--memory={memory_gb}g",
+                f"--memory-swap={float(memory_gb) * 2:g}g",
+                container_id,
+            ]
+        )
+    if success:
+        success, _, stderr = run_command(["docker", "start", container_id])
+    if not success:
+        logger.error(f"Warm container {container_id[:12]} failed: {stderr}")
+        run_command(["docker", "rm", "-f", container_id])
+        release_ports(pool_owner(spec.key), [int(p) for p in pooled.values()])
+        _remove_env_dir(container)
+        return None
+    return container_id, allocated_ports, proxies
+
+
+def enabled() -> bool:
+    return bool(load_specs())
+
+
+def stats() -> dict[str, Any]:
+    """Pool hits and time to a running container over the stats window"""
+    by_pool = create_stats(time.time() - consts.WARM_POOL_STATS_WINDOW)
+    hits = by_pool.get("hit", {}).get("count", 0)
+    misses = by_pool.get("miss", {}).get("count", 0)
+    return {
+        "window_s": consts.WARM_POOL_STATS_WINDOW,
+        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+        "time_to_running": {
+            "hit": by_pool.get("hit"),
+            "miss": by_pool.get("miss"),
+            "off": by_pool.get("off"),
+        },
+    }
+
+
+def start_refill(scheduler: "Scheduler") -> Optional["PeriodicTask"]:
+    if not enabled():
+        return None
+    return scheduler.add(
+        "warm-pool",
+        refill,
+        consts.WARM_POOL_INTERVAL,
+        deadline=consts.WARM_POOL_INTERVAL,
+        delay=consts.WARM_POOL_DELAY,
+    )
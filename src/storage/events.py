@@ -0,0 +1,124 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, Optional
+
+from src.utils.xlogging import get_logger
+
+logger = get_logger(__name__)
+
+EVENTS_FILE_PATH = Path("events.jsonl")
+EVENTS_MAX_BYTES = 4 * 1024 * 1024
+
+
+@contextmanager
+def _journal_lock() -> Iterator[int]:
+    # Held by every writer across processes. It also stores the last event id.
+    fd = os.open(f"{EVENTS_FILE_PATH}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def _take_id(lock_fd: int) -> int:
+    last = os.pread(lock_fd, 8, 0)
+    event_id = time.time_ns()
+    if len(last) == 8:
+        event_id = max(event_id, int.from_bytes(last, "big") + 1)
+    os.pwrite(lock_fd, event_id.to_bytes(8, "big"), 0)
+    return event_id
+
+
+def next_event_id() -> int:
+    """Event id, increasing across all processes that share the journal."""
+    with _journal_lock() as lock_fd:
+        return _take_id(lock_fd)
+
+
+def publish(event_type: str, data: dict[str, Any]) -> None:
+    try:
+        with _journal_lock() as lock_fd:
+            event = {
+                "id": _take_id(lock_fd),
+                "type": event_type,
+                "ts": time.time(),
+                "data": data,
+            }
+            line = (
+                json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n"
+            ).encode()
+            # Writes and rotation happen under the lock, so nothing is
+            # appended to a file after it has been rotated away.
+            fd = os.open(
+                EVENTS_FILE_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+            )
+            try:
+                os.write(fd, line)
+                if os.fstat(fd).st_size > EVENTS_MAX_BYTES:
+                    os.replace(EVENTS_FILE_PATH, f"{EVENTS_FILE_PATH}.1")
+            finally:
+                os.close(fd)
+    except OSError as e:
+        logger.error(f"Failed to publish {event_type} event: {e}")
+
+
+class JournalTail:
+    """Reads events appended to the journal by any process since the last call.
+
+    The journal stays open, so after a rotation the rest of the old file is
+    still read before the tail moves on to the new one.
+    """
+
+    def __init__(self, path: Path = EVENTS_FILE_PATH) -> None:
+        self._path = path
+        self._file: Optional[BinaryIO] = None
+        self._partial = b""
+        try:
+            self._file = open(path, "rb")
+            self._file.seek(0, os.SEEK_END)
+        except OSError:
+            pass
+
+    def read_new(self) -> list[dict[str, Any]]:
+        try:
+            st: Optional[os.stat_result] = os.stat(self._path)
+        except OSError:
+            st = None
+
+        events = []
+        if self._file is not None:
+            if st is None or st.st_ino != os.fstat(self._file.fileno()).st_ino:
+                events.extend(self._read())
+                self._file.close()
+                self._file, self._partial = None, b""
+            elif st.st_size < self._file.tell():
+                self._file.seek(0)
+                self._partial = b""
+        if self._file is None:
+            if st is None:
+                return events
+            try:
+                self._file = open(self._path, "rb")
+            except OSError:
+                return events
+        events.extend(self._read())
+        return events
+
+    def _read(self) -> list[dict[str, Any]]:
+        chunk = self._file.read()
+        if not chunk:
+            return []
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return events
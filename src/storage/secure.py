@@ -1,16 +1,19 @@
 from typing import Final, Optional
 
-import keyring
-
 AGENT_SECRET: Final[str] = "agent-secret"
 _KEYRING_SERVICE: Final[str] = "qudata-agent-service"
 
 
 def _get_password(key: str) -> Optional[str]:
+    # Imported on first use: the API server itself rarely needs it.
+    import keyring
+
     return keyring.get_password(_KEYRING_SERVICE, key)
 
 
 def _set_password(key: str, password: str) -> None:
+    import keyring
+
     keyring.set_password(_KEYRING_SERVICE, key, password)
 
 
@@ -1,13 +1,25 @@
+import asyncio
 import json
-from dataclasses import asdict, dataclass
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, fields, replace
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
+from src.storage import events
+from src.utils.tracing import span
 from src.utils.xlogging import get_logger
 
 logger = get_logger(__name__)
 
+STATE_DB_PATH = Path("state.db")
+# Pre-SQLite state file, imported once on first start.
 STATE_FILE_PATH = Path("state.json")
+STATE_POLL_INTERVAL = 0.1
+STATE_BUSY_TIMEOUT = 5.0
+HISTORY_DEFAULT_LIMIT = 500
 
 
 @dataclass
@@ -20,53 +32,626 @@ class InstanceState:
     allocated_ports: Optional[dict[str, str]] = None
 
 
-_current_state: Optional[InstanceState] = None
+_STATE_FIELDS = tuple(f.name for f in fields(InstanceState))
 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    instance_id TEXT,
+    container_id TEXT,
+    status TEXT NOT NULL,
+    luks_device_path TEXT,
+    luks_mapper_name TEXT,
+    allocated_ports TEXT
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    generation INTEGER NOT NULL,
+    instance_id TEXT,
+    container_id TEXT,
+    from_status TEXT,
+    to_status TEXT NOT NULL,
+    allocated_ports TEXT
+);
+CREATE INDEX IF NOT EXISTS transitions_instance ON transitions (instance_id, ts);
+CREATE INDEX IF NOT EXISTS transitions_ts ON transitions (ts);
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    instance_id TEXT,
+    operation TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS operations_instance ON operations (instance_id, ts);
+CREATE INDEX IF NOT EXISTS operations_ts ON operations (ts);
+CREATE TABLE IF NOT EXISTS port_leases (
+    port INTEGER PRIMARY KEY,
+    instance_id TEXT NOT NULL,
+    leased_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS port_proxies (
+    port INTEGER PRIMARY KEY,
+    target INTEGER NOT NULL,
+    instance_id TEXT NOT NULL
+);
+"""
 
-def get_current_state() -> InstanceState:
-    global _current_state
-    if _current_state is not None:
-        return _current_state
+SELECT_STATE = (
+    "SELECT generation, instance_id, container_id, status, luks_device_path,"
+    " luks_mapper_name, allocated_ports FROM state WHERE id = 1"
+)
+UPSERT_STATE = (
+    "INSERT INTO state (id, generation, updated_at, instance_id, container_id,"
+    " status, luks_device_path, luks_mapper_name, allocated_ports)"
+    " VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT (id) DO UPDATE SET generation = excluded.generation,"
+    " updated_at = excluded.updated_at, instance_id = excluded.instance_id,"
+    " container_id = excluded.container_id, status = excluded.status,"
+    " luks_device_path = excluded.luks_device_path,"
+    " luks_mapper_name = excluded.luks_mapper_name,"
+    " allocated_ports = excluded.allocated_ports"
+)
+INSERT_TRANSITION = (
+    "INSERT INTO transitions (ts, generation, instance_id, container_id,"
+    " from_status, to_status, allocated_ports) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_OPERATION = (
+    "INSERT INTO operations (ts, instance_id, operation, stage, data)"
+    " VALUES (?, ?, ?, ?, ?)"
+)
+SELECT_TRANSITIONS = (
+    "SELECT ts, generation, instance_id, container_id, from_status, to_status,"
+    " allocated_ports FROM transitions"
+    " WHERE instance_id = ? AND ts >= ? AND ts < ? ORDER BY ts DESC LIMIT ?"
+)
+SELECT_OPERATIONS = (
+    "SELECT ts, instance_id, operation, stage, data FROM operations"
+    " WHERE instance_id = ? AND ts >= ? AND ts < ? ORDER BY ts DESC LIMIT ?"
+)
+SELECT_LEASES = "SELECT port FROM port_leases"
+INSERT_LEASE = (
+    "INSERT OR REPLACE INTO port_leases (port, instance_id, leased_at)"
+    " VALUES (?, ?, ?)"
+)
+DELETE_LEASES = "DELETE FROM port_leases WHERE instance_id = ?"
+DELETE_LEASE = "DELETE FROM port_leases WHERE port = ? AND instance_id = ?"
+SELECT_PROXIES = "SELECT port, target FROM port_proxies"
+INSERT_PROXY = (
+    "INSERT OR REPLACE INTO port_proxies (port, target, instance_id) VALUES (?, ?, ?)"
+)
+DELETE_PROXIES = "DELETE FROM port_proxies WHERE instance_id = ?"
+SELECT_CREATE_STATS = (
+    "SELECT json_extract(data, '$.pool'), count(*),"
+    " avg(json_extract(data, '$.seconds')), max(json_extract(data, '$.seconds'))"
+    " FROM operations WHERE ts >= ? AND operation = 'create'"
+    " AND stage = 'completed' GROUP BY 1"
+)
 
-    if not STATE_FILE_PATH.exists():
-        _current_state = InstanceState()
-        return _current_state
 
-    try:
-        with open(STATE_FILE_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            _current_state = InstanceState(**data)
-            return _current_state
-    except (json.JSONDecodeError, TypeError) as e:
-        logger.error(
-            f"Failed to load or parse state file {STATE_FILE_PATH}: {e}."
-            f" Initializing a fresh state."
+def _dump_ports(ports: Optional[dict[str, str]]) -> Optional[str]:
+    return None if ports is None else json.dumps(ports, separators=(",", ":"))
+
+
+def _load_ports(value: Optional[str]) -> Optional[dict[str, str]]:
+    return None if value is None else json.loads(value)
+
+
+def _copy_state(state: InstanceState) -> InstanceState:
+    ports = state.allocated_ports
+    return replace(state, allocated_ports=None if ports is None else dict(ports))
+
+
+class StateStore:
+    """Current state and its history in an embedded SQLite database.
+
+    The database runs in WAL mode, so readers in other processes never block
+    on a writer and a crash leaves the last committed state. Every write bumps
+    the generation and appends a row to ``transitions`` in the same
+    transaction. Readers keep the decoded state and only query it again when
+    ``PRAGMA data_version`` says another connection has committed.
+    """
+
+    def __init__(
+        self, path: Path = STATE_DB_PATH, legacy_path: Path = STATE_FILE_PATH
+    ) -> None:
+        self.path = path
+        self.legacy_path = legacy_path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._data_version: Optional[int] = None
+        self._state = InstanceState()
+        self._generation = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection must not be shared with a forked child.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path,
+                timeout=STATE_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            # A state write is rare and must survive power loss.
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(SCHEMA)
+            self._conn, self._pid, self._data_version = conn, os.getpid(), None
+            self._migrate(conn)
+        return self._conn
+
+    def _refresh(self, conn: sqlite3.Connection) -> None:
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        with span("state.load"):
+            row = conn.execute(SELECT_STATE).fetchone()
+        if row is None:
+            self._state, self._generation = InstanceState(), 0
+        else:
+            values = dict(zip(_STATE_FIELDS, row[1:]))
+            values["allocated_ports"] = _load_ports(values["allocated_ports"])
+            self._state, self._generation = InstanceState(**values), row[0]
+        self._data_version = data_version
+
+    def get(self) -> InstanceState:
+        """A copy: callers may change it without touching the cache."""
+        with self._lock:
+            self._refresh(self._connection())
+            return _copy_state(self._state)
+
+    def generation(self) -> int:
+        with self._lock:
+            self._refresh(self._connection())
+            return self._generation
+
+    def put(self, state: InstanceState) -> int:
+        """Writes ``state`` as the next generation and returns it."""
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._data_version = None
+                self._refresh(conn)
+                previous = self._state.status
+                generation = self._generation + 1
+                ports = _dump_ports(state.allocated_ports)
+                conn.execute(
+                    UPSERT_STATE,
+                    (
+                        generation,
+                        now,
+                        state.instance_id,
+                        state.container_id,
+                        state.status,
+                        state.luks_device_path,
+                        state.luks_mapper_name,
+                        ports,
+                    ),
+                )
+                conn.execute(
+                    INSERT_TRANSITION,
+                    (
+                        now,
+                        generation,
+                        state.instance_id,
+                        state.container_id,
+                        previous,
+                        state.status,
+                        ports,
+                    ),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            # Our own commit does not change data_version on this connection.
+            self._state, self._generation = _copy_state(state), generation
+        events.publish(
+            "state",
+            {
+                "instance_id": state.instance_id,
+                "from": previous,
+                "to": state.status,
+                "version": generation,
+            },
         )
-        _current_state = InstanceState()
-        return _current_state
+        return generation
+
+    def record_operations(
+        self, rows: list[tuple[float, Optional[str], str, str, dict]]
+    ) -> None:
+        """Appends ``(ts, instance_id, operation, stage, data)`` rows in one batch."""
+        params = [
+            (ts, instance_id, operation, stage, json.dumps(data, default=str))
+            for ts, instance_id, operation, stage, data in rows
+        ]
+        with self._lock:
+            conn = self._connection()
+            # History is written on every progress step and may lose its last
+            # rows on power loss; in WAL mode NORMAL skips the fsync per commit.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(INSERT_OPERATION, params)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                conn.execute("PRAGMA synchronous=FULL")
+
+    def leased_ports(self) -> set[int]:
+        with self._lock:
+            return {port for (port,) in self._connection().execute(SELECT_LEASES)}
+
+    def lease_ports(self, leases: dict[str, list[int]], replace: bool = False) -> None:
+        """Leases host ports to instances; ``replace`` drops every other lease."""
+        now = time.time()
+        params = [
+            (port, instance_id, now)
+            for instance_id, ports in leases.items()
+            for port in ports
+        ]
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    conn.execute("DELETE FROM port_leases")
+                conn.executemany(INSERT_LEASE, params)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def release_ports(
+        self, instance_id: str, ports: Optional[list[int]] = None
+    ) -> None:
+        """Drops the leases of ``instance_id`` (only ``ports`` if given) and,
+        when all of them go, its port proxies too."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if ports is None:
+                    conn.execute(DELETE_LEASES, (instance_id,))
+                    conn.execute(DELETE_PROXIES, (instance_id,))
+                else:
+                    conn.executemany(
+                        DELETE_LEASE, [(port, instance_id) for port in ports]
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def set_port_proxies(self, instance_id: str, proxies: dict[int, int]) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(DELETE_PROXIES, (instance_id,))
+                conn.executemany(
+                    INSERT_PROXY,
+                    [(port, target, instance_id) for port, target in proxies.items()],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def port_proxies(self) -> dict[int, int]:
+        with self._lock:
+            return dict(self._connection().execute(SELECT_PROXIES).fetchall())
+
+    def create_stats(self, since: float) -> dict[Optional[str], dict[str, Any]]:
+        """Completed creates since ``since`` by warm pool outcome."""
+        with self._lock:
+            rows = self._connection().execute(SELECT_CREATE_STATS, (since,))
+            return {
+                pool: {"count": count, "mean_s": mean, "max_s": top}
+                for pool, count, mean, top in rows
+            }
+
+    def history(
+        self,
+        instance_id: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = HISTORY_DEFAULT_LIMIT,
+    ) -> list[dict[str, Any]]:
+        """Transitions and operations of an instance, newest first."""
+        bounds = (
+            instance_id,
+            since if since is not None else 0.0,
+            until if until is not None else float("inf"),
+            limit,
+        )
+        with self._lock:
+            conn = self._connection()
+            transitions = conn.execute(SELECT_TRANSITIONS, bounds).fetchall()
+            operations = conn.execute(SELECT_OPERATIONS, bounds).fetchall()
+        entries = [
+            {
+                "ts": ts,
+                "type": "transition",
+                "generation": generation,
+                "container_id": container_id,
+                "from": old,
+                "to": new,
+                "allocated_ports": _load_ports(ports),
+            }
+            for ts, generation, _, container_id, old, new, ports in transitions
+        ]
+        entries.extend(
+            {
+                "ts": ts,
+                "type": "operation",
+                "operation": operation,
+                "stage": stage,
+                "data": json.loads(data) if data else None,
+            }
+            for ts, _, operation, stage, data in operations
+        )
+        entries.sort(key=lambda entry: entry["ts"], reverse=True)
+        return entries[:limit]
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        if not self.legacy_path.exists():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock.
+            migrated = conn.execute(SELECT_STATE).fetchone() is not None
+            if not migrated and self.legacy_path.exists():
+                self._import_legacy(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_legacy(self, conn: sqlite3.Connection) -> None:
+        try:
+            data = json.loads(self.legacy_path.read_text(encoding="utf-8"))
+            generation = int(data.get("generation", 0))
+            state = InstanceState(**data.get("state", data))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Failed to migrate {self.legacy_path}: {e}. Starting fresh.")
+            generation, state = 0, InstanceState()
+
+        # State transitions published to the event journal become history.
+        transitions = []
+        for path in (Path(f"{events.EVENTS_FILE_PATH}.1"), events.EVENTS_FILE_PATH):
+            try:
+                lines = path.read_text(encoding="utf-8").splitlines()
+            except OSError:
+                continue
+            for line in lines:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("type") != "state":
+                    continue
+                data = event.get("data") or {}
+                transitions.append(
+                    (
+                        event.get("ts", 0.0),
+                        data.get("version", 0),
+                        data.get("instance_id"),
+                        None,
+                        data.get("from"),
+                        data.get("to", "unknown"),
+                        None,
+                    )
+                )
+        conn.executemany(INSERT_TRANSITION, transitions)
+        conn.execute(
+            UPSERT_STATE,
+            (
+                generation,
+                time.time(),
+                state.instance_id,
+                state.container_id,
+                state.status,
+                state.luks_device_path,
+                state.luks_mapper_name,
+                _dump_ports(state.allocated_ports),
+            ),
+        )
+        os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
+        logger.info(
+            f"Migrated {self.legacy_path} to {self.path}"
+            f" with {len(transitions)} past transitions"
+        )
+
+
+_store: Optional[StateStore] = None
+
+
+def get_state_store() -> StateStore:
+    global _store
+    if _store is None or _store.path != STATE_DB_PATH:
+        _store = StateStore(STATE_DB_PATH, STATE_FILE_PATH)
+    return _store
+
+
+def get_state_version() -> int:
+    return get_state_store().generation()
+
+
+class _StateWatch:
+    """
+    Wakes the long-polls of an event loop when the state version moves
+
+    One task checks the version every STATE_POLL_INTERVAL, on a short-lived
+    thread, while anyone waits; the waiters themselves only await an event,
+    so an idle long-poll holds neither a thread nor a database query.
+    """
+
+    def __init__(self) -> None:
+        self.version = 0
+        self._changed = asyncio.Event()
+        self._waiters = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _set(self, version: int) -> None:
+        if version != self.version:
+            self.version = version
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def _run(self) -> None:
+        try:
+            while self._waiters:
+                await asyncio.sleep(STATE_POLL_INTERVAL)
+                self._set(await asyncio.to_thread(get_state_version))
+        finally:
+            self._task = None
+
+    async def wait(self, since: Optional[int], timeout: float) -> int:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._waiters += 1
+        try:
+            if self._task is None:
+                self._set(await asyncio.to_thread(get_state_version))
+                if self._task is None:
+                    self._task = loop.create_task(self._run())
+            if since is None:
+                since = self.version
+            while self.version <= since:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            return self.version
+        finally:
+            self._waiters -= 1
+
+
+_watch: Optional[_StateWatch] = None
+
+
+async def wait_for_state_change(since: Optional[int], timeout: float) -> int:
+    """
+    The state version once it is past ``since`` (by default the current
+    one), or after ``timeout``
+    """
+    global _watch
+    if _watch is None:
+        _watch = _StateWatch()
+    return await _watch.wait(since, timeout)
+
+
+def get_current_state() -> InstanceState:
+    return get_state_store().get()
 
 
 def save_state(state: InstanceState) -> bool:
-    global _current_state
     try:
-        with open(STATE_FILE_PATH, "w", encoding="utf-8") as f:
-            json.dump(asdict(state), f, indent=4)
-        _current_state = state
+        with span("state.save", status=state.status):
+            get_state_store().put(state)
         logger.info(f"State saved successfully. Current status: {state.status}")
         return True
-    except (IOError, TypeError) as e:
-        logger.error(f"Failed to save state to {STATE_FILE_PATH}: {e}")
+    except (sqlite3.Error, OSError, TypeError) as e:
+        logger.error(f"Failed to save state to {STATE_DB_PATH}: {e}")
         return False
 
 
 def clear_state() -> bool:
-    global _current_state
-    if STATE_FILE_PATH.exists():
-        try:
-            STATE_FILE_PATH.unlink()
-        except OSError as e:
-            logger.error(f"Failed to delete state file {STATE_FILE_PATH}: {e}")
-            return False
-    _current_state = InstanceState()
+    # A destroyed record keeps the generation monotonic and the history intact.
+    try:
+        get_state_store().put(InstanceState())
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to clear state in {STATE_DB_PATH}: {e}")
+        return False
     logger.info("State cleared successfully.")
     return True
+
+
+def record_operation(
+    operation: str, stage: str, instance_id: Optional[str] = None, **data
+) -> None:
+    try:
+        get_state_store().record_operations(
+            [(time.time(), instance_id, operation, stage, data)]
+        )
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to record {operation}/{stage} in history: {e}")
+
+
+def leased_ports() -> set[int]:
+    try:
+        return get_state_store().leased_ports()
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to read port leases from {STATE_DB_PATH}: {e}")
+        return set()
+
+
+def lease_ports(leases: dict[str, list[int]], replace: bool = False) -> bool:
+    try:
+        get_state_store().lease_ports(leases, replace)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to save port leases to {STATE_DB_PATH}: {e}")
+        return False
+    return True
+
+
+def release_ports(
+    instance_id: Optional[str], ports: Optional[list[int]] = None
+) -> None:
+    if not instance_id:
+        return
+    try:
+        get_state_store().release_ports(instance_id, ports)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to release ports of {instance_id}: {e}")
+
+
+def set_port_proxies(instance_id: str, proxies: dict[int, int]) -> bool:
+    try:
+        get_state_store().set_port_proxies(instance_id, proxies)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to save port proxies of {instance_id}: {e}")
+        return False
+    return True
+
+
+def port_proxies() -> dict[int, int]:
+    try:
+        return get_state_store().port_proxies()
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to read port proxies from {STATE_DB_PATH}: {e}")
+        return {}
+
+
+def create_stats(since: float) -> dict[Optional[str], dict[str, Any]]:
+    try:
+        return get_state_store().create_stats(since)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to read create stats from {STATE_DB_PATH}: {e}")
+        return {}
+
+
+def instance_history(
+    instance_id: str,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = HISTORY_DEFAULT_LIMIT,
+) -> list[dict[str, Any]]:
+    try:
+        return get_state_store().history(instance_id, since, until, limit)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to read history of {instance_id}: {e}")
+        return []
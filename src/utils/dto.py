@@ -1,31 +1,169 @@
-from dataclasses import asdict, fields, is_dataclass
-from typing import Any, Type, TypeVar
+import json
+import types
+import typing
+from dataclasses import MISSING, fields, is_dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Callable, Type, TypeVar, Union
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
 
 T = TypeVar("T")
 
+Codec = Callable[[Any], Any]
+
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _optional_arg(tp: Any) -> Any:
+    origin = typing.get_origin(tp)
+    if origin is Union or origin is types.UnionType:
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return None
+
+
+@lru_cache(maxsize=None)
+def _decoder(tp: Any) -> Codec:
+    if tp in _PRIMITIVES or tp is Any:
+        return _identity
+
+    inner = _optional_arg(tp)
+    if inner is not None:
+        decode = _decoder(inner)
+        if decode is _identity:
+            return _identity
+        return lambda v: None if v is None else decode(v)
+
+    if isinstance(tp, type) and issubclass(tp, Enum):
+        return tp
+
+    if is_dataclass(tp):
+        return _dataclass_decoder(tp)
+
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+    if origin in (list, set, tuple, frozenset):
+        decode = _decoder(args[0]) if args else _identity
+        if decode is _identity:
+            return origin
+        return lambda v: origin(decode(i) for i in v)
+    if origin is dict:
+        decode_key = _decoder(args[0]) if args else _identity
+        decode_value = _decoder(args[1]) if args else _identity
+        if decode_key is _identity and decode_value is _identity:
+            return dict
+        return lambda v: {decode_key(k): decode_value(i) for k, i in v.items()}
+
+    return _identity
+
+
+def _dataclass_decoder(cls: type) -> Codec:
+    hints = typing.get_type_hints(cls)
+    plan = [(f.name, _decoder(hints.get(f.name, Any))) for f in fields(cls)]
+    required = [
+        f.name
+        for f in fields(cls)
+        if f.init and f.default is MISSING and f.default_factory is MISSING
+    ]
+
+    def decode(data: Any) -> Any:
+        if data is None:
+            data = {}
+        kwargs = {}
+        for name, convert in plan:
+            if name in data:
+                value = data[name]
+                kwargs[name] = None if value is None else convert(value)
+        for name in required:
+            kwargs.setdefault(name, None)
+        return cls(**kwargs)
+
+    return decode
+
+
+@lru_cache(maxsize=None)
+def _encoder(tp: Any) -> Codec:
+    if tp in _PRIMITIVES:
+        return _identity
+
+    inner = _optional_arg(tp)
+    if inner is not None:
+        encode = _encoder(inner)
+        if encode is _identity:
+            return _identity
+        return lambda v: None if v is None else encode(v)
+
+    if isinstance(tp, type) and issubclass(tp, Enum):
+        return lambda v: v.value if isinstance(v, Enum) else v
+
+    if is_dataclass(tp):
+        return _dataclass_encoder(tp)
+
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+    if origin in (list, set, tuple, frozenset):
+        encode = _encoder(args[0]) if args else _encode_any
+        if encode is _identity:
+            return list
+        return lambda v: [encode(i) for i in v]
+    if origin is dict:
+        encode_key = _encoder(args[0]) if args else _encode_any
+        encode_value = _encoder(args[1]) if args else _encode_any
+        if encode_key is _identity and encode_value is _identity:
+            return dict
+        return lambda v: {encode_key(k): encode_value(i) for k, i in v.items()}
+
+    return _encode_any
+
+
+def _dataclass_encoder(cls: type) -> Codec:
+    hints = typing.get_type_hints(cls)
+    plan = [(f.name, _encoder(hints.get(f.name, Any))) for f in fields(cls)]
+
+    def encode(obj: Any) -> dict[str, Any]:
+        return {name: convert(getattr(obj, name)) for name, convert in plan}
+
+    return encode
+
+
+def _encode_any(value: Any) -> Any:
+    if isinstance(value, _PRIMITIVES):
+        return value
+    if isinstance(value, Enum):
+        return value.value
+    if is_dataclass(value):
+        return _encoder(type(value))(value)
+    if isinstance(value, dict):
+        return {_encode_any(k): _encode_any(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_encode_any(v) for v in value]
+    return value
+
 
 def to_json(obj: Any) -> dict[str, Any]:
-    return asdict(obj)
+    return _encoder(type(obj))(obj)
 
 
 def from_json(cls: Type[T], data: Any) -> T:
-    kwargs = {}
-    for f in fields(cls):
-        value = data.get(f.name)
-        if value is None:
-            kwargs[f.name] = None
-            continue
-
-        ftype = f.type
-        origin = getattr(ftype, "__origin__", None)
-
-        if origin is list:
-            subtype = ftype.__args__[0]
-            kwargs[f.name] = [from_json(subtype, i) for i in value]
-
-        elif is_dataclass(ftype):
-            kwargs[f.name] = from_json(ftype, value)
-        else:
-            kwargs[f.name] = value
-
-    return cls(**kwargs)
+    return _decoder(cls)(data)
+
+
+def dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
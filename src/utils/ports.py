@@ -1,4 +1,7 @@
 import socket
+from collections.abc import Container
+
+from src.utils.tracing import span
 
 
 def _port_is_free(port: int) -> bool:
@@ -12,13 +15,18 @@ def _port_is_free(port: int) -> bool:
             return False
 
 
-def get_free_port() -> int:
-    ip = "0.0.0.0"
+def get_free_port(exclude: Container[int] = ()) -> int:
+    """First bindable port not in ``exclude``.
+
+    A port published by a stopped container is bindable, so leased ports
+    have to be passed in ``exclude``.
+    """
     start = 1024
     end = 65535
-    for port in range(start, end):
-        if _port_is_free(port):
-            return port
+    with span("ports.scan"):
+        for port in range(start, end):
+            if port not in exclude and _port_is_free(port):
+                return port
     raise RuntimeError("Cannot start agent: no ports available")
 
 
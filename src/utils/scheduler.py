@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from src import consts
+from src.utils.xlogging import get_logger
+
+logger = get_logger(__name__)
+
+# Upper bounds in milliseconds; the last bucket counts everything above.
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, 15000)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect_left(HISTOGRAM_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def snapshot(self) -> dict[str, Any]:
+        labels = [f"le_{b}" for b in HISTOGRAM_BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "max_ms": round(self.max, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class PeriodicTask:
+    """One registered job and its counters.
+
+    Ticks sit on a fixed grid (``start + n * period``), so the period does
+    not drift by however long a run takes; jitter only shifts a single run
+    off its grid point.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        period: float,
+        jitter: float = 0.0,
+        deadline: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.period = period
+        self.jitter = jitter
+        self.deadline = deadline
+        self.tick = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        # A tick that found the previous run still going, or that was
+        # missed altogether because the process was stopped.
+        self.skipped = 0
+        self.overruns = 0
+        self.lateness = Histogram()
+        self.duration = Histogram()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "period": self.period,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "overruns": self.overruns,
+            "running": self.running,
+            "lateness": self.lateness.snapshot(),
+            "duration": self.duration.snapshot(),
+        }
+
+
+class Scheduler:
+    """Runs periodic jobs of one process from a single timer thread.
+
+    The timer thread only decides what is due; runs go to a small pool, at
+    most one per task, so a slow job never holds up the others as long as
+    there are no more tasks than workers.
+    """
+
+    def __init__(self, workers: int = consts.SCHEDULER_WORKERS) -> None:
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: dict[str, PeriodicTask] = {}
+        # (due, sequence, task); the sequence keeps equal due times ordered.
+        self._queue: list[tuple[float, int, PeriodicTask]] = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        period: float,
+        jitter: float = 0.0,
+        deadline: Optional[float] = None,
+        delay: float = 0.0,
+    ) -> PeriodicTask:
+        task = PeriodicTask(name, func, period, jitter, deadline)
+        with self._cond:
+            if name in self._tasks:
+                raise ValueError(f"Task {name!r} is already scheduled")
+            if len(self._tasks) >= self._workers:
+                logger.warning(
+                    f"Scheduler has more tasks than workers; {name!r} may wait "
+                    f"behind slow runs"
+                )
+            self._tasks[name] = task
+            task.tick = time.monotonic() + delay
+            self._push(task)
+        return task
+
+    def _push(self, task: PeriodicTask) -> None:
+        due = task.tick + (random.uniform(0, task.jitter) if task.jitter else 0)
+        heapq.heappush(self._queue, (due, next(self._sequence), task))
+        self._cond.notify()
+
+    def start(self) -> "Scheduler":
+        with self._cond:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="scheduler"
+                )
+                self._thread = threading.Thread(
+                    target=self._run, name="scheduler", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and (
+                    not self._queue or self._queue[0][0] > time.monotonic()
+                ):
+                    timeout = (
+                        self._queue[0][0] - time.monotonic() if self._queue else None
+                    )
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                due, _, task = heapq.heappop(self._queue)
+                now = time.monotonic()
+                if task.running:
+                    task.skipped += 1
+                else:
+                    task.running = True
+                    try:
+                        self._executor.submit(self._execute, task, due)
+                    except RuntimeError:
+                        # The interpreter is exiting.
+                        return
+                # Next grid point; ticks that already passed (a stopped
+                # process, a suspended host) are dropped, not run in a burst.
+                task.tick += task.period
+                if task.tick <= now:
+                    missed = math.floor((now - task.tick) / task.period) + 1
+                    task.skipped += missed
+                    task.tick += missed * task.period
+                self._push(task)
+
+    def _execute(self, task: PeriodicTask, due: float) -> None:
+        started = time.monotonic()
+        try:
+            task.func()
+        except Exception as e:
+            task.failures += 1
+            logger.error(f"Scheduled task {task.name!r} failed: {e}")
+        finally:
+            duration = time.monotonic() - started
+            with self._cond:
+                task.runs += 1
+                task.running = False
+                task.lateness.observe(max(0.0, started - due))
+                task.duration.observe(duration)
+                overrun = task.deadline is not None and duration > task.deadline
+                if overrun:
+                    task.overruns += 1
+            if overrun:
+                logger.warning(
+                    f"Scheduled task {task.name!r} took {duration:.3f}s, "
+                    f"deadline {task.deadline}s"
+                )
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._cond:
+            return {name: task.snapshot() for name, task in self._tasks.items()}
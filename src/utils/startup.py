@@ -0,0 +1,100 @@
+"""Startup profile: time per phase and per import (--profile-startup)"""
+
+import importlib.abc
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# Set through the env so child processes (agent, server) profile too.
+PROFILE_ENV = "QUDATA_PROFILE_STARTUP"
+TOP_IMPORTS = 15
+
+_started = time.perf_counter()
+_phases: list[tuple[str, float]] = []
+# name, self, cumulative
+_imports: list[tuple[str, float, float]] = []
+# Time of nested imports for every import on the stack.
+_children: list[float] = []
+
+
+def _reset_after_fork() -> None:
+    global _started
+    _started = time.perf_counter()
+    _phases.clear()
+    _imports.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def enabled() -> bool:
+    return os.environ.get(PROFILE_ENV) == "1"
+
+
+class _TimedLoader:
+    def __init__(self, loader: Any) -> None:
+        self._loader = loader
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._loader, name)
+
+    def exec_module(self, module: Any) -> None:
+        start = time.perf_counter()
+        _children.append(0.0)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            children = _children.pop()
+            if _children:
+                _children[-1] += total
+            _imports.append((module.__name__, total - children, total))
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def find_spec(self, name: str, path: Any, target: Any = None) -> Optional[Any]:
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+            if hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader)
+            return spec
+        return None
+
+
+def install() -> None:
+    """Starts timing imports if profiling is on (call before heavy imports)"""
+    if enabled() and not any(isinstance(f, _ImportTimer) for f in sys.meta_path):
+        sys.meta_path.insert(0, _ImportTimer())
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def report(process: str) -> None:
+    """Prints this process's phases and costliest imports to stderr"""
+    if not enabled():
+        return
+    out = sys.stderr
+    elapsed = time.perf_counter() - _started
+    print(f"STARTUP [{process} {os.getpid()}]: {elapsed * 1000:.1f} ms", file=out)
+    for name, seconds in _phases:
+        print(f"  phase  {seconds * 1000:9.1f} ms  {name}", file=out)
+    top = sorted(_imports, key=lambda item: item[2], reverse=True)[:TOP_IMPORTS]
+    for name, own, total in top:
+        print(
+            f"  import {total * 1000:9.1f} ms  (self {own * 1000:7.1f} ms)  {name}",
+            file=out,
+        )
+    out.flush()
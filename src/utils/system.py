@@ -3,6 +3,7 @@ import shutil
 import subprocess
 from typing import Optional
 
+from src.utils.tracing import span
 from src.utils.xlogging import get_logger
 
 logger = get_logger(__name__)
@@ -19,16 +20,17 @@ def run_command(
             logger.error(error_msg)
             return False, "", error_msg
 
-        process = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            input=input_data,
-            check=False,
-            timeout=120,
-            encoding="utf-8",
-            errors="ignore",
-        )
+        with span("run_command", command=executable):
+            process = subprocess.run(
+                command,
+                capture_output=True,
+                text=True,
+                input=input_data,
+                check=False,
+                timeout=120,
+                encoding="utf-8",
+                errors="ignore",
+            )
 
         if process.returncode != 0:
             stderr_output = process.stderr.strip()
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import random
+import re
+import time
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Optional
+
+TRACE_FILE_PATH = "traces.jsonl"
+TRACE_MAX_BYTES = 16 * 1024 * 1024
+TRACE_BACKUP_COUNT = 3
+TRACE_HEADER = "X-Trace-Id"
+
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+SAMPLE_RATE = _env_float("QUDATA_TRACE_SAMPLE", 0.0)
+SERVER_TIMING = os.environ.get("QUDATA_SERVER_TIMING", "") not in ("", "0")
+
+_current: ContextVar[Optional["Span"]] = ContextVar("qudata_span", default=None)
+_exporter: Optional[logging.Logger] = None
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self, trace_id: str) -> None:
+        self.trace_id = trace_id
+        self.spans: list["Span"] = []
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace",
+        "span_id",
+        "parent_id",
+        "attrs",
+        "start",
+        "start_ns",
+        "duration_ns",
+        "error",
+        "root",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace: Trace,
+        parent_id: Optional[str] = None,
+        attrs: Optional[dict[str, Any]] = None,
+        root: bool = False,
+    ) -> None:
+        self.name = name
+        self.trace = trace
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = 0.0
+        self.start_ns = 0
+        self.duration_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        self.root = root
+        self._token = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def elapsed_ms(self) -> float:
+        duration = self.duration_ns
+        if duration is None:
+            duration = time.perf_counter_ns() - self.start_ns
+        return duration / 1e6
+
+    def __enter__(self) -> "Span":
+        self.start = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current.reset(self._token)
+        self.trace.spans.append(self)
+        if self.root:
+            _export(self.trace)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.elapsed_ms(), 3),
+            "attrs": self.attrs or {},
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any):
+    """Child span of the active trace, or a shared no-op when nothing is sampled."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(name, parent.trace, parent.span_id, attrs or None)
+
+
+def start_trace(name: str, headers: Optional[dict[str, str]] = None, **attrs: Any):
+    """Root span for an incoming request.
+
+    An incoming ``traceparent`` or ``X-Trace-Id`` header always samples the
+    request and keeps the caller's trace id; otherwise ``SAMPLE_RATE`` decides.
+    """
+    headers = headers or {}
+    trace_id, parent_id = None, None
+    traceparent = headers.get("traceparent")
+    match = _TRACEPARENT_RE.match(traceparent) if traceparent else None
+    if match:
+        trace_id, parent_id = match.groups()
+    elif headers.get(TRACE_HEADER.lower()):
+        trace_id = headers[TRACE_HEADER.lower()][:64]
+
+    if trace_id is None:
+        if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE:
+            return _NOOP
+        trace_id = _new_id(16)
+
+    return Span(name, Trace(trace_id), parent_id, attrs, root=True)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def outgoing_headers() -> Optional[dict[str, str]]:
+    current = _current.get()
+    if current is None:
+        return None
+    headers = {TRACE_HEADER: current.trace_id}
+    if _TRACE_ID_RE.match(current.trace_id):
+        headers["traceparent"] = f"00-{current.trace_id}-{current.span_id}-01"
+    return headers
+
+
+def server_timing(root: Span) -> str:
+    entries = [f"total;dur={root.elapsed_ms():.2f}"]
+    for child in root.trace.spans:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", child.name)
+        entries.append(f"{name};dur={child.elapsed_ms():.2f}")
+    return ", ".join(entries)
+
+
+def _get_exporter() -> logging.Logger:
+    global _exporter
+    if _exporter is None:
+        exporter = logging.getLogger("qudata.traces")
+        exporter.setLevel(logging.INFO)
+        exporter.propagate = False
+        exporter.handlers.clear()
+        handler = RotatingFileHandler(
+            TRACE_FILE_PATH,
+            maxBytes=TRACE_MAX_BYTES,
+            backupCount=TRACE_BACKUP_COUNT,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        exporter.addHandler(handler)
+        _exporter = exporter
+    return _exporter
+
+
+def _export(trace: Trace) -> None:
+    try:
+        exporter = _get_exporter()
+        for finished in trace.spans:
+            exporter.info(json.dumps(finished.to_dict(), separators=(",", ":")))
+        trace.spans.clear()
+    except Exception:
+        pass
@@ -1,8 +1,256 @@
+import atexit
+import fcntl
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
 import sys
+import threading
+import time
 from functools import lru_cache
-from logging import FileHandler, Formatter, StreamHandler, getLogger
+from logging import Formatter, StreamHandler, getLogger
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional
 
+LOG_FILE_PATH = "logs.txt"  # TODO: make prod logs output
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 60 * 60
+LOG_BACKUP_COUNT = 7
+LOG_QUEUE_SIZE = 10_000
+
+# Per call site: the first LOG_RATE_BURST INFO/DEBUG records in a window pass,
+# afterwards only every LOG_SAMPLE_EVERY-th one. Warnings and above always pass.
+LOG_RATE_WINDOW = 60.0
+LOG_RATE_BURST = 10
+LOG_SAMPLE_EVERY = 100
+
+_RECORD_ATTRS = ("process", "threadName", "funcName", "lineno")
+
+
+class JSONFormatter(Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for attr in _RECORD_ATTRS:
+            entry[attr] = getattr(record, attr, None)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+
+    def __init__(
+        self,
+        window: float = LOG_RATE_WINDOW,
+        burst: int = LOG_RATE_BURST,
+        sample_every: int = LOG_SAMPLE_EVERY,
+    ) -> None:
+        super().__init__()
+        self._window = window
+        self._burst = burst
+        self._sample_every = sample_every
+        # call site -> [window start, records in window, suppressed since last]
+        self._sites: dict[tuple[str, int], list] = {}
+        # The queue handler calls filters without its lock, from any thread.
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self._window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                record.suppressed = suppressed
+                return True
+            site[1] += 1
+            if site[1] <= self._burst or site[1] % self._sample_every == 0:
+                record.suppressed, site[2] = site[2], 0
+                return True
+            site[2] += 1
+            return False
+
+
+class _AsyncQueueHandler(QueueHandler):
+    """Caller side: formats the message and hands the record to the writer."""
+
+    dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # queue.Queue is thread-safe; skip the per-handler lock.
+        if not self.filter(record):
+            return False
+        self.enqueue(self.prepare(record))
+        return True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and record.exc_info[0] is not None:
+            record.exc_text = Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _AsyncQueueHandler.dropped += 1
+
+
+class RotatingJSONFileHandler(logging.Handler):
+    """JSON lines file rotated by size or age; old files are gzipped.
+
+    Several processes share the file, so rotation happens under a lock and a
+    process whose file was rotated by another one simply reopens it.
+    """
+
+    def __init__(
+        self,
+        filename: str = LOG_FILE_PATH,
+        max_bytes: int = LOG_MAX_BYTES,
+        interval: float = LOG_ROTATE_INTERVAL,
+        backup_count: int = LOG_BACKUP_COUNT,
+    ) -> None:
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.setFormatter(JSONFormatter())
+        self._stream = None
+        self._inode = None
+        self._opened_at = 0.0
+        self._next_check = 0.0
+
+    def _open(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+        # Unbuffered append: each record is a single write(), so lines from
+        # different processes never interleave.
+        self._stream = open(self.filename, "ab", buffering=0)
+        self._inode = os.fstat(self._stream.fileno()).st_ino
+        self._opened_at = self._first_record_ts()
+
+    def _first_record_ts(self) -> float:
+        # Age comes from the file itself so every process agrees on it.
+        try:
+            with open(self.filename, "rb") as f:
+                return float(json.loads(f.readline())["ts"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return time.time()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self._stream is None:
+                self._open()
+            self._maybe_rotate(record.created)
+            self._stream.write((self.format(record) + "\n").encode("utf-8"))
+        except Exception:
+            self.handleError(record)
+
+    def _maybe_rotate(self, now: float) -> None:
+        if now < self._next_check:
+            return
+        self._next_check = now + 1.0
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            self._open()
+            return
+        if st.st_ino != self._inode:
+            self._open()
+            return
+        if st.st_size < self.max_bytes and now - self._opened_at < self.interval:
+            return
+        with open(f"{self.filename}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.stat(self.filename).st_ino == self._inode:
+                rotated = f"{self.filename}.{time.strftime('%Y%m%d-%H%M%S')}"
+                os.replace(self.filename, rotated)
+                self._compress(rotated)
+                self._cleanup()
+        self._open()
+
+    @staticmethod
+    def _compress(path: str) -> None:
+        with open(path, "rb") as src, gzip.open(f"{path}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+
+    def _cleanup(self) -> None:
+        backups = sorted(glob.glob(f"{glob.escape(self.filename)}.*.gz"))
+        for path in backups[: max(0, len(backups) - self.backup_count)]:
+            os.remove(path)
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        super().close()
+
+
+class _Backend:
+    """One queue and one writer thread per process, shared by all loggers."""
+
+    def __init__(self) -> None:
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler = _AsyncQueueHandler(self.queue)
+        self.handler.addFilter(RateLimitFilter())
+
+        console = StreamHandler(stream=sys.stdout)
+        console.setFormatter(
+            Formatter(fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+        self._sinks = (console, RotatingJSONFileHandler())
+        self._listener: Optional[QueueListener] = None
+        self.start()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self) -> None:
+        self._listener = QueueListener(
+            self.queue, *self._sinks, respect_handler_level=True
+        )
+        self._listener.start()
+
+    def stop(self) -> None:
+        if self._listener is not None and self._listener._thread is not None:
+            self._listener.stop()
+
+    def _after_fork(self) -> None:
+        # The writer thread does not survive fork; start a fresh one.
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler.queue = self.queue
+        self.start()
+
+
+_backend: Optional[_Backend] = None
+_backend_lock = threading.Lock()
+
+
+def _get_backend() -> _Backend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _Backend()
+    return _backend
+
 
 class XLogger:
 
@@ -14,29 +262,22 @@ class XLogger:
     def _setting(self) -> None:
         self._logger.setLevel("DEBUG")
         self._logger.handlers.clear()
-
-        filename = "logs.txt"  # TODO: make prod logs output
-        self._logger.addHandler(FileHandler(filename=filename, encoding="utf-8"))
-        self._logger.addHandler(StreamHandler(stream=sys.stdout))
-
-        for handler in self._logger.handlers:
-            handler.setFormatter(
-                Formatter(fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-            )
+        self._logger.propagate = False
+        self._logger.addHandler(_get_backend().handler)
 
     def info(self, message: str) -> None:
-        self._logger.info(message)
+        self._logger.info(message, stacklevel=2)
 
     def warning(self, message: str) -> None:
-        self._logger.warning(message)
+        self._logger.warning(message, stacklevel=2)
 
     def error(
         self, message: str, exc: Optional[Exception] = None, exc_info: bool = True
     ) -> None:
         if exc:
-            self._logger.error(message, exc_info=exc)
+            self._logger.error(message, exc_info=exc, stacklevel=2)
         else:
-            self._logger.error(message, exc_info=exc_info)
+            self._logger.error(message, exc_info=exc_info, stacklevel=2)
 
     def critical(
         self,
@@ -44,7 +285,7 @@ class XLogger:
         exc: Optional[Exception] = None,
         exc_info: bool = True,
     ):
-        self._logger.critical(message, exc_info=exc_info)
+        self._logger.critical(message, exc_info=exc_info, stacklevel=2)
 
 
 @lru_cache
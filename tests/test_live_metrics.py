@@ -0,0 +1,125 @@
+import pytest
+
+from src.service import live_metrics
+from src.service.live_metrics import LiveMetrics
+
+TASK = {
+    "runs": 3,
+    "failures": 1,
+    "skipped": 0,
+    "overruns": 2,
+    "lateness": {"max_ms": 1.5, "mean_ms": None},
+    "duration": {"max_ms": 4.0, "mean_ms": 2.0},
+}
+
+
+def system(value: float) -> dict:
+    return {
+        "cpu_util": value,
+        "ram_util": value,
+        "disk_util": value,
+        "load": (value, value, value),
+        "ram_used": int(value),
+        "ram_total": int(value),
+    }
+
+
+def counter(segment: LiveMetrics) -> int:
+    return live_metrics._SEQ.unpack_from(segment._mem)[0]
+
+
+@pytest.fixture
+def segment():
+    segment = LiveMetrics.create()
+    yield segment
+    segment.close()
+    segment.unlink()
+
+
+def test_empty_segment(segment):
+    assert segment.read() is None
+
+
+def test_publish_and_read(segment):
+    segment.publish(system(12.5), {"ssh-watch": TASK})
+    reader = LiveMetrics(segment.path)
+    try:
+        snapshot = reader.read()
+    finally:
+        reader.close()
+
+    assert snapshot["samples"] == 1
+    assert snapshot["system"]["cpu_util"] == 12.5
+    assert snapshot["system"]["load"] == [12.5, 12.5, 12.5]
+    assert snapshot["scheduler"] == {
+        "ssh-watch": {
+            "runs": 3,
+            "failures": 1,
+            "skipped": 0,
+            "overruns": 2,
+            "lateness_max_ms": 1.5,
+            "lateness_mean_ms": 0.0,
+            "duration_max_ms": 4.0,
+            "duration_mean_ms": 2.0,
+        }
+    }
+    assert counter(segment) == 2
+
+
+def test_tasks_over_the_limit_are_dropped(segment):
+    tasks = {f"task-{i}": TASK for i in range(live_metrics.MAX_TASKS + 3)}
+    segment.publish(system(1.0), tasks)
+
+    assert len(segment.read()["scheduler"]) == live_metrics.MAX_TASKS
+
+
+def test_reader_gives_up_on_a_stuck_writer(segment):
+    segment.publish(system(1.0), {})
+    # A writer that died between the two counter stores.
+    live_metrics._SEQ.pack_into(segment._mem, 0, counter(segment) + 1)
+
+    assert segment.read_raw() is None
+    assert segment.read() is None
+
+
+def test_next_write_repairs_the_counter(segment):
+    segment.publish(system(1.0), {})
+    live_metrics._SEQ.pack_into(segment._mem, 0, counter(segment) + 1)
+
+    segment.publish(system(2.0), {})
+
+    assert counter(segment) % 2 == 0
+    snapshot = segment.read()
+    assert snapshot["samples"] == 2
+    assert snapshot["system"]["cpu_util"] == 2.0
+
+
+class InterruptedLiveMetrics(LiveMetrics):
+    """Lets a reader copy the segment halfway through a write."""
+
+    def __init__(self, path: str, reader: LiveMetrics) -> None:
+        super().__init__(path)
+        self.reader = reader
+        self.during_write = []
+
+    def _copy(self, payload: bytes) -> None:
+        half = len(payload) // 2
+        base = live_metrics._SEQ.size
+        self._mem[base : base + half] = payload[:half]
+        self.during_write.append(self.reader.read_raw())
+        self._mem[base + half : base + len(payload)] = payload[half:]
+
+
+def test_reader_never_returns_a_half_written_snapshot(segment):
+    segment.publish(system(1.0), {})
+    reader = LiveMetrics(segment.path)
+    writer = InterruptedLiveMetrics(segment.path, reader)
+    try:
+        writer.publish(system(2.0), {})
+        after = reader.read()
+    finally:
+        writer.close()
+        reader.close()
+
+    assert writer.during_write == [None]
+    assert after["system"]["cpu_util"] == 2.0
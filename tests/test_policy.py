@@ -0,0 +1,156 @@
+import base64
+import copy
+import json
+
+import pytest
+
+from src.security.auth_daemon import check
+from src.security.policy import DEFAULT_RULES, PolicyEngine
+
+# The body the Docker CLI (24.0) sends for `docker create alpine sh`, with
+# the fields each case sets left empty.
+CREATE_BODY = {
+    "Hostname": "",
+    "Domainname": "",
+    "User": "",
+    "AttachStdin": False,
+    "AttachStdout": True,
+    "AttachStderr": True,
+    "Tty": False,
+    "OpenStdin": False,
+    "StdinOnce": False,
+    "Env": None,
+    "Cmd": ["sh"],
+    "Image": "alpine",
+    "Volumes": {},
+    "WorkingDir": "",
+    "Entrypoint": None,
+    "OnBuild": None,
+    "Labels": {},
+    "HostConfig": {
+        "Binds": None,
+        "ContainerIDFile": "",
+        "LogConfig": {"Type": "", "Config": {}},
+        "NetworkMode": "default",
+        "PortBindings": {},
+        "RestartPolicy": {"Name": "no", "MaximumRetryCount": 0},
+        "AutoRemove": False,
+        "VolumeDriver": "",
+        "VolumesFrom": None,
+        "ConsoleSize": [50, 200],
+        "CapAdd": None,
+        "CapDrop": None,
+        "CgroupnsMode": "",
+        "Dns": [],
+        "DnsOptions": [],
+        "DnsSearch": [],
+        "ExtraHosts": None,
+        "GroupAdd": None,
+        "IpcMode": "",
+        "Cgroup": "",
+        "Links": None,
+        "OomScoreAdj": 0,
+        "PidMode": "",
+        "Privileged": False,
+        "PublishAllPorts": False,
+        "ReadonlyRootfs": False,
+        "SecurityOpt": None,
+        "UTSMode": "",
+        "UsernsMode": "",
+        "ShmSize": 0,
+        "Isolation": "",
+        "CpuShares": 0,
+        "Memory": 0,
+        "NanoCpus": 0,
+        "CgroupParent": "",
+        "BlkioWeight": 0,
+        "Devices": [],
+        "DeviceCgroupRules": None,
+        "DeviceRequests": None,
+        "MemoryReservation": 0,
+        "MemorySwap": 0,
+        "MemorySwappiness": None,
+        "OomKillDisable": False,
+        "PidsLimit": None,
+        "Ulimits": None,
+        "Mounts": None,
+        "MaskedPaths": None,
+        "ReadonlyPaths": None,
+    },
+    "NetworkingConfig": {"EndpointsConfig": {}},
+}
+
+
+def create(host_config: dict, principal: str = "uid:1000") -> dict:
+    body = copy.deepcopy(CREATE_BODY)
+    body["HostConfig"].update(host_config)
+    req = {
+        "RequestMethod": "POST",
+        "RequestURI": "/v1.43/containers/create?name=x",
+        "RequestBody": base64.b64encode(json.dumps(body).encode()).decode(),
+    }
+    return check(req, principal)
+
+
+@pytest.mark.parametrize(
+    "host_config, reason",
+    [
+        ({"Binds": ["/:/host"]}, "host mount"),
+        ({"Binds": ["data:/data", "/var/run/docker.sock:/s:ro"]}, "host mount"),
+        (
+            {
+                "Mounts": [
+                    {"Type": "volume", "Source": "data", "Target": "/data"},
+                    {"Type": "bind", "Source": "/", "Target": "/host"},
+                ]
+            },
+            "host mount",
+        ),
+        (
+            {
+                "DeviceRequests": [
+                    {
+                        "Driver": "",
+                        "Count": -1,
+                        "DeviceIDs": None,
+                        "Capabilities": [["gpu"]],
+                        "Options": {},
+                    }
+                ]
+            },
+            "device requests",
+        ),
+        ({"Privileged": True}, "privileged"),
+    ],
+)
+def test_create_denied(host_config, reason):
+    assert create(host_config) == {"allow": False, "reason": f"forbidden: {reason}"}
+
+
+@pytest.mark.parametrize(
+    "host_config",
+    [
+        {},
+        {"Binds": ["data:/data"]},
+        {"Mounts": [{"Type": "volume", "Source": "data", "Target": "/data"}]},
+        {"Mounts": [{"Type": "tmpfs", "Target": "/tmp"}], "DeviceRequests": []},
+    ],
+)
+def test_create_allowed(host_config):
+    assert create(host_config)["allow"]
+
+
+def test_keys_match_case_insensitively():
+    assert not create({"binds": ["/:/host"]})["allow"]
+    assert not create({"Mounts": [{"type": "bind", "source": "/"}]})["allow"]
+
+
+def test_agent_is_trusted():
+    assert create({"Binds": ["/:/host"]}, principal="agent")["allow"]
+
+
+def test_decided_body_without_scanner():
+    engine = PolicyEngine(DEFAULT_RULES)
+    body = {"HostConfig": {"Mounts": [{"Type": "bind"}]}}
+    decision = engine.decide("uid:1000", "POST", "/containers/create", body)
+    assert decision == {"allow": False, "reason": "forbidden: host mount"}
@@ -0,0 +1,153 @@
+import json
+
+import pytest
+
+from scripts.bench_recovery import FakeDocker, container, container_id
+from src import consts
+from src.service import health
+from src.service.recovery import _match, recover
+from src.storage import state
+from src.storage.state import InstanceState
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(state, "STATE_DB_PATH", tmp_path / "state.db")
+    monkeypatch.setattr(state, "STATE_FILE_PATH", tmp_path / "state.json")
+    monkeypatch.setattr(state, "_store", None)
+    # No Docker CLI here: a container checked by id is gone.
+    monkeypatch.setattr(health, "check_container_exists", lambda container_id: False)
+    return tmp_path
+
+
+@pytest.fixture
+def docker():
+    servers = []
+
+    def serve(containers, hang=False):
+        server = FakeDocker(f"docker-{len(servers)}.sock", containers, hang)
+        servers.append(server)
+        return server.server_address
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_match_by_container_id():
+    record = InstanceState(instance_id="other", container_id=container_id(2))
+    containers = [container(1), container(2)]
+
+    assert _match(record, containers) == (containers[1], False)
+
+
+def test_match_by_instance_label():
+    record = InstanceState(instance_id="inst-2", status="paused")
+    containers = [container(1), container(2)]
+
+    assert _match(record, containers) == (containers[1], False)
+
+
+def test_match_adopts_the_newest_running_container():
+    containers = [container(1), container(3, running=False), container(2)]
+
+    assert _match(InstanceState(), containers) == (containers[2], True)
+
+
+def test_match_adopts_nothing_for_a_known_instance():
+    record = InstanceState(instance_id="gone", status="running")
+
+    assert _match(record, [container(1)]) == (None, False)
+    assert _match(InstanceState(), [container(1, running=False)]) == (None, False)
+
+
+def test_stale_record_is_fixed(docker):
+    state.save_state(
+        InstanceState(
+            instance_id="inst-5",
+            container_id=container_id(5),
+            status="paused",
+            allocated_ports={"22": "1"},
+        )
+    )
+
+    report = recover(docker([container(4), container(5)]))
+
+    assert report["ok"]
+    assert not report["adopted"]
+    assert report["orphans"] == 1
+    assert state.get_current_state() == InstanceState(
+        instance_id="inst-5",
+        container_id=container_id(5),
+        status="running",
+        allocated_ports={"22": "20005", "8888": "40005"},
+    )
+    assert state.leased_ports() == {20004, 40004, 20005, 40005}
+
+
+def test_lost_record_is_adopted(docker):
+    containers = [container(1, running=False), container(2), container(3)]
+
+    report = recover(docker(containers))
+
+    assert report["adopted"]
+    current = state.get_current_state()
+    assert current.instance_id == "inst-3"
+    assert current.container_id == container_id(3)
+    assert current.status == "running"
+
+
+def test_removed_container_clears_the_record(docker):
+    state.save_state(
+        InstanceState(
+            instance_id="gone", container_id=container_id(999), status="running"
+        )
+    )
+
+    report = recover(docker([container(1)]))
+
+    assert report["ok"]
+    assert state.get_current_state().status == "destroyed"
+    # The stale lease goes, the other container keeps its ports.
+    assert state.leased_ports() == {20001, 40001}
+
+
+def test_warm_pool_container_is_leased(docker):
+    warm = {
+        "Id": container_id(50),
+        "Created": 1_700_000_050,
+        "State": "created",
+        "Labels": {
+            consts.CONTAINER_LABEL: "1",
+            consts.CONTAINER_LABEL_POOL: "spec",
+            consts.CONTAINER_LABEL_PORTS: json.dumps({"8888": "41000"}),
+        },
+        "Ports": [],
+    }
+
+    report = recover(docker([warm]))
+
+    assert report["orphans"] == 0
+    assert state.leased_ports() == {41000}
+    assert state.get_current_state().status == "destroyed"
+
+
+def test_docker_down_keeps_the_record(workdir):
+    before = InstanceState(
+        instance_id="kept", container_id=container_id(7), status="running"
+    )
+    state.save_state(before)
+
+    report = recover(str(workdir / "missing.sock"))
+
+    assert not report["ok"]
+    assert state.get_current_state() == before
+
+
+def test_docker_hanging_times_out(docker):
+    report = recover(docker([], hang=True), timeout=0.2)
+
+    assert not report["ok"]
+    assert report["seconds"] < 1.0
@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from src.storage import events, state
+from src.storage.state import InstanceState, StateStore
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The event journal lives in the working directory.
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def write_legacy(path, generation, current, transitions=()):
+    path.write_text(
+        json.dumps({"generation": generation, "state": current}), encoding="utf-8"
+    )
+    lines = [
+        json.dumps(
+            {
+                "id": i,
+                "type": "state",
+                "ts": 1_700_000_000 + i,
+                "data": {"instance_id": "inst-1", "from": old, "to": new},
+            }
+        )
+        for i, (old, new) in enumerate(transitions)
+    ]
+    # Other event types are not history.
+    lines.append(json.dumps({"id": 99, "type": "ssh", "ts": 1_700_000_099}))
+    lines.append("not json")
+    events.EVENTS_FILE_PATH.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_migrates_state_json(workdir):
+    legacy = workdir / "state.json"
+    current = {
+        "instance_id": "inst-1",
+        "container_id": "abc",
+        "status": "running",
+        "luks_device_path": None,
+        "luks_mapper_name": None,
+        "allocated_ports": {"22": "20001"},
+    }
+    write_legacy(legacy, 7, current, [("destroyed", "pending"), ("pending", "running")])
+
+    store = StateStore(workdir / "state.db", legacy)
+
+    assert store.get() == InstanceState(**current)
+    assert store.generation() == 7
+    assert not legacy.exists()
+    assert (workdir / "state.json.migrated").exists()
+    history = store.history("inst-1")
+    assert [(entry["from"], entry["to"]) for entry in history] == [
+        ("pending", "running"),
+        ("destroyed", "pending"),
+    ]
+
+
+def test_migration_runs_once(workdir):
+    legacy = workdir / "state.json"
+    write_legacy(legacy, 3, {"instance_id": "inst-1", "status": "paused"})
+    StateStore(workdir / "state.db", legacy).get()
+    # A state.json that shows up again must not overwrite the database.
+    write_legacy(legacy, 1, {"instance_id": "other", "status": "running"})
+
+    store = StateStore(workdir / "state.db", legacy)
+
+    assert store.get().instance_id == "inst-1"
+    assert store.generation() == 3
+    assert legacy.exists()
+
+
+def test_broken_state_json_starts_fresh(workdir):
+    legacy = workdir / "state.json"
+    legacy.write_text("{", encoding="utf-8")
+
+    store = StateStore(workdir / "state.db", legacy)
+
+    assert store.get() == InstanceState()
+    assert store.generation() == 0
+
+
+def test_history(workdir):
+    store = StateStore(workdir / "state.db", workdir / "state.json")
+    store.put(InstanceState(instance_id="inst-1", status="pending"))
+    store.put(
+        InstanceState(
+            instance_id="inst-1",
+            container_id="abc",
+            status="running",
+            allocated_ports={"22": "20001"},
+        )
+    )
+    store.put(InstanceState(instance_id="inst-2", status="running"))
+    store.record_operations([(1.0, "inst-1", "create", "started", {"image": "alpine"})])
+
+    history = store.history("inst-1")
+
+    assert [entry["type"] for entry in history] == [
+        "transition",
+        "transition",
+        "operation",
+    ]
+    assert history[0]["generation"] == 2
+    assert history[0]["from"] == "pending"
+    assert history[0]["to"] == "running"
+    assert history[0]["container_id"] == "abc"
+    assert history[0]["allocated_ports"] == {"22": "20001"}
+    assert history[1]["from"] == "destroyed"
+    assert history[2]["data"] == {"image": "alpine"}
+    assert store.history("inst-1", limit=1) == history[:1]
+    assert store.history("inst-1", until=2.0) == history[2:]
+
+
+def test_instance_history_uses_the_configured_database(workdir, monkeypatch):
+    monkeypatch.setattr(state, "STATE_DB_PATH", workdir / "state.db")
+    monkeypatch.setattr(state, "STATE_FILE_PATH", workdir / "state.json")
+    monkeypatch.setattr(state, "_store", None)
+
+    state.save_state(InstanceState(instance_id="inst-1", status="running"))
+    state.record_operation("create", "completed", "inst-1", seconds=1.5)
+
+    history = state.instance_history("inst-1")
+    assert [entry["type"] for entry in history] == ["operation", "transition"]
+    assert history[0]["data"] == {"seconds": 1.5}
+
+
+def test_stores_see_each_others_writes(workdir):
+    first = StateStore(workdir / "state.db", workdir / "state.json")
+    second = StateStore(workdir / "state.db", workdir / "state.json")
+    assert second.get() == InstanceState()
+
+    first.put(InstanceState(instance_id="inst-1", status="running"))
+
+    assert second.get().instance_id == "inst-1"
+    assert second.generation() == 1
+    second.put(InstanceState(instance_id="inst-1", status="paused"))
+    assert first.get().status == "paused"
+    assert first.generation() == 2
+
+
+def test_get_returns_a_copy(workdir):
+    store = StateStore(workdir / "state.db", workdir / "state.json")
+    saved = InstanceState(instance_id="inst-1", allocated_ports={"22": "20001"})
+    store.put(saved)
+    saved.allocated_ports["8888"] = "20002"
+
+    current = store.get()
+    current.status = "error"
+    current.allocated_ports["22"] = "1"
+
+    assert store.get() == InstanceState(
+        instance_id="inst-1", allocated_ports={"22": "20001"}
+    )
+
+
+def test_write_from_a_forked_child(workdir):
+    store = StateStore(workdir / "state.db", workdir / "state.json")
+    store.put(InstanceState(instance_id="inst-1", status="pending"))
+
+    pid = os.fork()
+    if pid == 0:
+        # The child must open its own connection, not reuse the parent's.
+        try:
+            store.put(InstanceState(instance_id="inst-1", status="running"))
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert store.get().status == "running"
+    assert store.generation() == 2
+
+
+def test_failed_write_keeps_the_previous_state(workdir):
+    store = StateStore(workdir / "state.db", workdir / "state.json")
+    store.put(InstanceState(instance_id="inst-1", status="running"))
+
+    with pytest.raises(TypeError):
+        store.put(InstanceState(instance_id="inst-1", allocated_ports={1: object()}))
+
+    assert store.get().status == "running"
+    assert store.generation() == 1
+    assert len(store.history("inst-1")) == 1
+
+
+def test_writer_killed_mid_transaction(workdir):
+    store = StateStore(workdir / "state.db", workdir / "state.json")
+    store.put(InstanceState(instance_id="inst-1", status="running"))
+
+    pid = os.fork()
+    if pid == 0:
+        conn = sqlite3.connect(workdir / "state.db", isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE state SET status = 'error', generation = 99")
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert store.get().status == "running"
+    assert store.put(InstanceState(instance_id="inst-1", status="paused")) == 2
@@ -0,0 +1,115 @@
+import os
+import stat
+import subprocess
+
+import pytest
+
+from src import runtime
+from src.server.models import CreateInstance
+from src.service import warm_pool
+from src.service.warm_pool import ENV_FILE, PoolSpec, _write_env
+
+ENV_KEY = "0123456789abcdef"
+
+
+@pytest.fixture(autouse=True)
+def env_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("QUDATA_WARM_POOL_ENV_DIR", str(tmp_path))
+    runtime.warm_pool_env_dir.cache_clear()
+    (tmp_path / ENV_KEY).mkdir()
+    yield tmp_path / ENV_KEY
+    runtime.warm_pool_env_dir.cache_clear()
+
+
+def load(env_dir, *command):
+    """Runs the pooled container's entrypoint with the env file at env_dir."""
+    loader = warm_pool._ENV_LOADER.replace(ENV_FILE, str(env_dir / "env"))
+    return subprocess.run(
+        ["/bin/sh", "-c", loader, "sh", *command],
+        capture_output=True,
+        env={"PATH": os.environ["PATH"]},
+    )
+
+
+def test_values_reach_the_entrypoint_unchanged(env_dir):
+    env = {
+        "PLAIN": "value",
+        "SPACES": "  two  words ",
+        "QUOTES": 'it\'s "quoted"',
+        "SHELL": "$(id) `id` $HOME ${PATH} ; | & > <",
+        "LINES": "first\nsecond\n",
+        "BACKSLASH": "a\\b\\",
+        "EMPTY": "",
+        "UNICODE": "größe ✓",
+        "_lower_9": "1",
+    }
+
+    assert _write_env(ENV_KEY, env) == (True, "")
+    mode = os.stat(env_dir / "env").st_mode
+    assert stat.S_IMODE(mode) == 0o644
+
+    result = load(env_dir, "env", "-0")
+    assert result.returncode == 0, result.stderr
+    seen = dict(
+        item.split("=", 1) for item in result.stdout.decode().split("\0") if item
+    )
+    assert {key: seen.get(key) for key in env} == env
+    # The entrypoint deletes the file before the image's command runs.
+    assert not (env_dir / "env").exists()
+
+
+def test_entrypoint_runs_without_an_env_file(env_dir):
+    result = load(env_dir, "echo", "started")
+
+    assert result.returncode == 0
+    assert result.stdout == b"started\n"
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="root reads any file")
+def test_unreadable_env_stops_the_entrypoint(env_dir):
+    assert _write_env(ENV_KEY, {"A": "1"}) == (True, "")
+    os.chmod(env_dir / "env", 0)
+
+    result = load(env_dir, "echo", "started")
+
+    assert result.returncode == 126
+    assert result.stdout == b""
+
+
+@pytest.mark.parametrize(
+    "name", ["A;id", "A B", "1A", "A-B", "A=B", "A\nB", "$A", "", "Ä"]
+)
+def test_invalid_names_are_rejected(env_dir, name):
+    assert _write_env(ENV_KEY, {"GOOD": "1", name: "x"}) == (
+        False,
+        "invalid env variable name",
+    )
+    assert not (env_dir / "env").exists()
+
+
+def test_existing_env_file_is_not_overwritten(env_dir):
+    (env_dir / "env").write_text("A=old\n")
+
+    success, error = _write_env(ENV_KEY, {"A": "new"})
+
+    assert not success
+    assert error
+    assert (env_dir / "env").read_text() == "A=old\n"
+
+
+def test_invalid_name_is_a_pool_miss(monkeypatch):
+    spec = PoolSpec(image="alpine")
+    monkeypatch.setattr(warm_pool, "load_specs", lambda: [spec])
+
+    def no_docker():
+        raise AssertionError("the pool was queried")
+
+    monkeypatch.setattr(warm_pool, "_pool_containers", no_docker)
+    params = CreateInstance(
+        image="alpine",
+        image_tag="latest",
+        storage_gb=1,
+        env_variables={"A;reboot": "1"},
+    )
+
+    assert warm_pool.claim(params, "1", "1", 0) is None